@@ -17,6 +17,8 @@ from RAMSIS.core.datasources import FDSNWSDataSource, HYDWSDataSource
 from RAMSIS.core.engine.engine import Engine
 from RAMSIS.core.simulator import Simulator, SimulatorState
 from RAMSIS.core.taskmanager import TaskManager
+from RAMSIS.core.tools.eventloop import StallMonitor, configure_task_runner
+from RAMSIS.core.tools.httpsession import configure_session_pool
 from ramsis.datamodel.forecast import Forecast, ForecastInput, Scenario
 from ramsis.datamodel.hydraulics import InjectionPlan, InjectionSample
 from ramsis.datamodel.ormbase import OrmBase
@@ -55,8 +57,13 @@ class Controller(QtCore.QObject):
     def __init__(self, settings):
         super(Controller, self).__init__()
         self._settings = settings
+        configure_session_pool(settings)
+        configure_task_runner(settings)
+        self.stall_monitor = StallMonitor()
+        if settings.value('engine/stall_monitor'):
+            self.stall_monitor.start()
         self.project = None
-        self.engine = Engine(self)
+        self.engine = Engine(self, settings)
         self.fdsnws_previous_end_time = None
         self.hydws_previous_end_time = None
         self.seismics_data_source = None
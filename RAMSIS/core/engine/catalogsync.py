@@ -0,0 +1,126 @@
+# -*- encoding: utf-8 -*-
+"""
+Delta uploads of the input catalog to model workers
+
+Consecutive forecasts share almost all of their input events. Workers that
+support it keep the catalog of the last run per session in memory, so the
+client only needs to send the events that were added (and identify the ones
+that were removed) since then.
+
+Each upload carries a *catalog_sync* entry::
+
+    {
+        'session': session id (client instance and project),
+        'base_version': catalog version the delta applies to, None for a
+            full upload,
+        'version': catalog version after applying the delta,
+        'removed': event keys to remove from the base version
+    }
+
+Versions are content hashes of the catalog, so clients uploading the same
+catalog agree on the version. Events are identified by their key (time,
+location and magnitude). A worker that does not hold *base_version*
+responds with 409 (Conflict) and the client starts over with a full upload.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import hashlib
+import uuid
+from threading import Lock
+
+import numpy as np
+
+# Event keys are computed like on the worker side
+from ramsis.workers.tools.catalogcache import event_keys, key_values
+
+# Distinguishes sessions of different RAMSIS instances on the same worker
+_CLIENT_ID = uuid.uuid4().hex
+
+_sessions = {}
+_sessions_lock = Lock()
+
+
+def catalog_session(url, project_id):
+    """ Returns the session for the worker at url and project_id """
+    key = (url, project_id)
+    with _sessions_lock:
+        if key not in _sessions:
+            session_id = '{}/{}'.format(_CLIENT_ID, project_id)
+            _sessions[key] = CatalogSession(session_id)
+        return _sessions[key]
+
+
+class CatalogDelta:
+    """
+    Changes between the catalog version on the worker and the current one
+
+    :ivar dict sync: the *catalog_sync* entry for the request
+    :ivar added: boolean mask of events to upload, None for all events
+    :ivar keys: keys of the current catalog
+
+    """
+
+    def __init__(self, sync, added, keys):
+        self.sync = sync
+        self.added = added
+        self.keys = keys
+
+    @property
+    def full(self):
+        return self.added is None
+
+
+class CatalogSession:
+    """
+    Tracks the catalog version that a worker holds for one session
+
+    Requests are posted from pool threads, so the state is guarded by a
+    lock.
+
+    :param str session_id: session id sent to the worker
+
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.version = None
+        self._keys = None
+        self._lock = Lock()
+
+    def delta(self, columns):
+        """
+        Compute the delta from the worker's catalog version to columns
+
+        :param CatalogColumns columns: current input catalog
+        :returns: CatalogDelta
+
+        """
+        keys = event_keys(columns)
+        order = np.lexsort(keys.T[::-1])
+        version = hashlib.sha1(
+            np.ascontiguousarray(keys[order]).tobytes()).hexdigest()
+        with self._lock:
+            base_version, base_keys = self.version, self._keys
+        sync = {'session': self.session_id, 'base_version': base_version,
+                'version': version, 'removed': []}
+        if base_version is None:
+            return CatalogDelta(sync, None, keys)
+        current, previous = key_values(keys), key_values(base_keys)
+        added = ~np.isin(current, previous)
+        removed = ~np.isin(previous, current)
+        sync['removed'] = base_keys[removed].tolist()
+        return CatalogDelta(sync, added, keys)
+
+    def commit(self, delta):
+        """ Record that the worker has accepted delta """
+        with self._lock:
+            self.version = delta.sync['version']
+            self._keys = delta.keys
+
+    def reset(self):
+        """ Forget the worker state, the next upload will be a full one """
+        with self._lock:
+            self.version = None
+            self._keys = None
@@ -2,7 +2,10 @@ import logging
 
 from PyQt5.QtCore import pyqtSignal, QObject
 
-from RAMSIS.core.engine.forecastjob import ForecastJob
+from RAMSIS.core.engine.forecastjob import ForecastJob, endpoint_limiter
+from RAMSIS.core.engine.forecastqueue import ForecastQueue, \
+    DEFAULT_POLICY, DEFAULT_MAX_FORECASTS
+from RAMSIS.core.tools.catalog import CatalogColumns, LocalCoordinateCache
 
 
 class Engine(QObject):
@@ -10,48 +13,99 @@ class Engine(QObject):
     forecast_complete = pyqtSignal()
     job_status_update = pyqtSignal(object)
 
-    def __init__(self, core):
+    def __init__(self, core, settings=None):
         super(Engine, self).__init__()
-        self.busy = False
         self.core = core
-        self._forecast = None
-        self._forecast_job = None
+        # Concurrency limits (0 or None means no limit)
+        self.max_parallel_scenarios = 1
+        # Max. number of forecasts running at the same time. The next
+        # forecast only starts once the models of all running forecasts
+        # have completed, i.e. while their hazard and risk stages run.
+        self.max_forecasts = DEFAULT_MAX_FORECASTS
+        policy = DEFAULT_POLICY
+        if settings is not None:
+            self.max_parallel_scenarios = \
+                settings.value('engine/max_parallel_scenarios') or None
+            endpoint_limiter.default_limit = \
+                settings.value('engine/max_runs_per_worker') or None
+            self.max_forecasts = \
+                settings.value('engine/max_forecasts') or None
+            policy = settings.value('engine/forecast_queue_policy') or \
+                DEFAULT_POLICY
+        self.queue = ForecastQueue(policy)
+        self._forecast_jobs = []
         self._forecast_task = None
+        # Local coordinates of events from previous forecasts
+        self.coordinate_cache = LocalCoordinateCache()
         self._logger = logging.getLogger(__name__)
 
+    @property
+    def busy(self):
+        """ True if any forecast is running """
+        return len(self._forecast_jobs) > 0
+
     def run(self, t, forecast):
+        """
+        Run forecast (due at project time t) or queue it if the engine is
+        busy. What happens to forecasts that are due while the engine is
+        busy depends on the queue policy (see :mod:`forecastqueue`).
+
+        """
         assert self.core.project
-        project = self.core.project
+        skipped = self.queue.put(forecast, t, busy=not self._can_start())
+        for f in skipped:
+            self._logger.warning('Engine busy, skipping forecast at '
+                                 't=' + str(f.forecast_time))
+        self._start_queued()
+
+    def metrics(self):
+        """ Returns forecast queue metrics (see ForecastQueue.metrics) """
+        metrics = self.queue.metrics()
+        metrics['running'] = len(self._forecast_jobs)
+        return metrics
+
+    def on_fc_status_changed(self, status):
+        if status.sender in self._forecast_jobs and status.finished:
+            self._forecast_jobs.remove(status.sender)
+            self.forecast_complete.emit()
+        else:
+            self.job_status_update.emit(status)
+        self._start_queued()
+
+    def _can_start(self):
+        if self.max_forecasts and \
+                len(self._forecast_jobs) >= self.max_forecasts:
+            return False
+        return all(job.models_done for job in self._forecast_jobs)
 
-        # Skip this forecast if the core is busy
-        if self.busy:
-            self._logger.warning('Attempted to initiate forecast while the '
-                                 'core is still busy with a previously'
-                                 'started forecast. Skipping at '
-                                 't=' + str(forecast.forecast_time))
-            return
+    def _start_queued(self):
+        while len(self.queue) > 0 and self._can_start():
+            forecast, t = self.queue.pop()
+            self._start(forecast, t)
 
+    def _start(self, forecast, t):
+        project = self.core.project
         self._logger.info(6 * '----------')
         self._logger.info('Initiating forecast {} at {}'.format(
             forecast.forecast_time, t))
+        self._logger.info('Forecast queue: {depth} waiting, {running} '
+                          'running, lag {last_lag:.1f} s'
+                          .format(running=len(self._forecast_jobs),
+                                  **self.queue.metrics()))
 
         # Snapshot the current catalog by creating a copy
         copy = project.seismic_catalog.snapshot(forecast.forecast_time)
         forecast.input.input_catalog = copy
         project.save()
+        # Columnar view of the snapshot, shared by all models and scenarios
+        catalog = CatalogColumns.from_events(
+            copy.seismic_events, coordinate_cache=self.coordinate_cache)
 
-        self._forecast = forecast
-        self.busy = True
-        self._forecast_job = ForecastJob(forecast)
-        self._forecast_job.status_changed.connect(self.on_fc_status_changed)
-        self._forecast_job.run()
-
-    def on_fc_status_changed(self, status):
-        if status.sender == self._forecast_job and status.finished:
-            self.busy = False
-            self.forecast_complete.emit()
-        else:
-            self.job_status_update.emit(status)
+        job = ForecastJob(forecast, catalog,
+                          max_parallel=self.max_parallel_scenarios)
+        self._forecast_jobs.append(job)
+        job.status_changed.connect(self.on_fc_status_changed)
+        job.run()
 
     def observe_project(self, project):
         """
@@ -65,4 +119,6 @@ class Engine(QObject):
 
     def _on_project_close(self, project):
         project.will_close.disconnect(self._on_project_close)
+        self.queue.clear()
+        self.coordinate_cache.clear()
         self._project = None
@@ -0,0 +1,118 @@
+# -*- encoding: utf-8 -*-
+"""
+Parameter ensembles for forecast models
+
+To account for epistemic uncertainty a model can be run for many parameter
+sets instead of a single one. The ensemble is configured in the model
+config as
+
+    'ensemble': {
+        # either a grid (all combinations of the listed values) ...
+        'grid': {'a': [-1.8, -1.6], 'p': [1.0, 1.1, 1.2]},
+        # ... or random samples from distributions
+        'samples': 200,
+        'seed': 42,
+        'distributions': {'a': ['normal', -1.6, 0.1],
+                          'p': ['uniform', 1.0, 1.2]},
+        # quantiles of the forecast rate to report
+        'quantiles': [0.05, 0.5, 0.95],
+        # parameter sets per worker request and concurrent requests
+        'batch_size': 50,
+        'max_concurrent': 4
+    }
+
+Parameters that are not varied are taken from the model's 'parameters'.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import itertools
+
+import numpy as np
+
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+
+# Distributions for sampled parameters (same arguments as numpy's):
+# uniform (low, high), normal (mean, std) and lognormal (mean, sigma of the
+# underlying normal distribution)
+DISTRIBUTIONS = ('uniform', 'normal', 'lognormal')
+
+
+def parameter_sets(ensemble_config, base=None):
+    """
+    Expand an ensemble configuration into a list of parameter dicts
+
+    :param dict ensemble_config: the 'ensemble' model configuration
+    :param dict base: parameters that are not varied
+    :returns: list of complete parameter dicts
+
+    """
+    base = base or {}
+    if 'grid' in ensemble_config:
+        grid = ensemble_config['grid']
+        names = sorted(grid)
+        varied = [dict(zip(names, values))
+                  for values in itertools.product(*(grid[n] for n in names))]
+    elif 'distributions' in ensemble_config:
+        varied = sample_parameters(ensemble_config['distributions'],
+                                   ensemble_config.get('samples', 100),
+                                   ensemble_config.get('seed'))
+    else:
+        raise ValueError('Ensemble needs a grid or distributions')
+    return [dict(base, **params) for params in varied]
+
+
+def sample_parameters(distributions, n, seed=None):
+    """
+    Draw n parameter sets from the given distributions
+
+    :param dict distributions: maps parameter names to [distribution name,
+        arg1, arg2] (see DISTRIBUTIONS)
+    :param int n: number of samples
+    :param seed: random seed for reproducible ensembles
+
+    """
+    rng = np.random.RandomState(seed)
+    columns = {}
+    for name in sorted(distributions):
+        kind, *args = distributions[name]
+        if kind not in DISTRIBUTIONS:
+            raise ValueError('Unknown distribution {}'.format(kind))
+        columns[name] = getattr(rng, kind)(*args, size=n)
+    return [{name: float(values[i]) for name, values in columns.items()}
+            for i in range(n)]
+
+
+def batches(items, batch_size):
+    """ Split items into consecutive lists of at most batch_size items """
+    batch_size = max(int(batch_size), 1)
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def summarize(results, quantiles=DEFAULT_QUANTILES):
+    """
+    Aggregate the results of the ensemble members
+
+    :param results: list of (rate, b_val, prob) tuples, None for members
+        that failed
+    :param quantiles: quantiles of the rate to compute
+    :returns: dict with the number of successful members *n*, the number of
+        *failed* members, the *mean* (rate, b_val, prob), the *std* of the
+        rate and the rate *quantiles* (keyed by the quantile formatted as
+        string, e.g. '0.05'). None if all members failed.
+
+    """
+    valid = np.array([r for r in results if r is not None], dtype=np.float64)
+    if valid.size == 0:
+        return None
+    valid = valid.reshape(-1, 3)
+    rates = valid[:, 0]
+    return {
+        'n': len(valid),
+        'failed': len(results) - len(valid),
+        'mean': tuple(valid.mean(axis=0).tolist()),
+        'std': float(rates.std()),
+        'quantiles': {'{:g}'.format(q): float(v) for q, v in
+                      zip(quantiles, np.quantile(rates, quantiles))}
+    }
@@ -2,97 +2,138 @@
 """
 Classes to execute a forecast
 
-A forecast is a complex sequence of serial and parallel stages:
-
-ForecastJob                Runs one or more scenarios, executing serially
-    ScenarioJob            Runs the stages of a scenario, serial
-        ForecastStage      Runs the induced seismicity models, parallel
-            SeismicityForecast  Runs a single induced seismicity model
-            SeismicityForecast
+A forecast is a graph of stages. Each scenario contributes a chain of
+stages, each stage depends on the previous stage of the same scenario:
+
+ForecastJob                Runs the stages of all scenarios (DAG)
+    ForecastStage          Runs the induced seismicity models, parallel
+        SeismicityForecast  Runs a single induced seismicity model
+        EnsembleForecast    Runs a model for many parameter sets, parallel
+            EnsembleMember  Runs a batch of parameter sets
             ...
-        HazardStage        Runs the hazard stage of a forecast
-        RiskStage          Runs the risk stage of a forecast
-    Scenario Job
+        ...
+    HazardStage            Runs the hazard stage (after ForecastStage)
+    RiskStage              Runs the risk stage (after HazardStage)
+    ForecastStage          Stages of the next scenario
     ...
 
+Stages start as soon as their predecessor has finished, so e.g. the hazard
+stage of one scenario overlaps with the model runs of the next one.
+
 The forecast (data model object) will be passed to the forecast job on init.
 
+Stages that use a remote worker acquire a slot for the worker's url from
+*endpoint_limiter* before they start, which limits the number of concurrent
+runs per worker. OpenQuake only runs one job at a time.
+
 Copyright (c) 2017, Swiss Seismological Service, ETH Zurich
 
 """
 
 import logging
 import io
-from RAMSIS.core.tools.job import ParallelJob, SerialJob, WorkUnit, JobStatus
+from RAMSIS.core.tools.job import (ParallelJob, DagJob, WorkUnit,
+                                   JobStatus, ResourceLimiter)
 from ramsis.datamodel.forecast import (ForecastResult, HazardResult,
     RiskResult, ModelResult, RatePrediction, Scenario, Forecast)
 from ramsis.datamodel.calculationstatus import CalculationStatus
 from .oqclient import OQClient
 from RAMSIS.core.tools.notifications import ClientNotification
 from . import oqutils
-from .modelclient import ModelClient
+from .modelclient import ModelClient, ForecastPayload
+from . import ensemble
+from RAMSIS.core.tools.catalog import CatalogColumns
 
 from PyQt5.QtWidgets import QApplication
 
 log = logging.getLogger(__name__)
 
+OQ_URL = 'http://127.0.0.1:8800'
+
+# Limits concurrent runs per worker url (see Engine for the configuration)
+endpoint_limiter = ResourceLimiter()
+endpoint_limiter.set_limit(OQ_URL, 1)
+
+# Resource key for limiting the number of concurrent forecast stages
+FORECAST_STAGE = 'forecast_stage'
+
 
-class ForecastJob(SerialJob):
+class ForecastJob(DagJob):
     """
-    Serial execution of scenarios
+    Runs the stages of all scenarios of a forecast
 
     :param Forecast forecast: Forecast to execute
+    :param CatalogColumns catalog: Columnar view of the forecast's input
+        catalog. Created from the input catalog if not given.
+    :param int max_parallel: max. number of scenarios that run their
+        seismicity models at the same time (None for no limit)
 
     """
 
-    def __init__(self, forecast):
+    def __init__(self, forecast, catalog=None, max_parallel=None):
         super(ForecastJob, self).__init__('forecast_job')
+        self.limiter.set_limit(FORECAST_STAGE, max_parallel)
         self.forecast = forecast
-        # our work units are scenario jobs
-        self.work_units = [ScenarioJob(s) for s in forecast.input.scenarios]
+        if catalog is None:
+            events = forecast.input.input_catalog.seismic_events
+            catalog = CatalogColumns.from_events(events)
+        self.catalog = catalog
+        self._stage_count = {}
+        self._stages_left = {}
+        self._forecast_stages = []
+        for scenario in forecast.input.scenarios:
+            self._add_scenario(scenario)
 
     def pre_process(self):
         log.info('Starting forecast job at {} scenarios: {}'
                  .format(self.forecast.forecast_time,
                          [s.name for s in self.forecast.input.scenarios]))
+        for scenario in self.forecast.input.scenarios:
+            log.info('Calculating scenario: {}'.format(scenario.name))
+            result = ForecastResult()
+            self.forecast.results.append(result)
+            scenario.forecast_result = result
+            self._stages_left[scenario] = self._stage_count[scenario]
+            if self._stages_left[scenario] == 0:
+                log.info('Scenario {} complete'.format(scenario.name))
+        self.forecast.project.save()
 
     def post_process(self):
         self.forecast.project.save()
         log.info('Forecast {} completed'.format(self.forecast.forecast_time))
 
-
-class ScenarioJob(SerialJob):
-    """
-    Runs forecast, hazard and risk calculation for a scenario
-
-    :param Scenario scenario: Scenario for this job
-
-    """
-
-    def __init__(self, scenario):
-        super(ScenarioJob, self).__init__(scenario.name)
-        self.scenario = scenario
-        self.forecast = scenario.forecast_input.forecast
-        cfg = self.scenario.config
+    @property
+    def models_done(self):
+        """ True if the seismicity models of all scenarios have finished """
+        return all(self.is_done(s) for s in self._forecast_stages)
+
+    def on_status_changed(self, status):
+        node = self._nodes.get(status.sender)
+        if status.finished and node is not None and not node.done:
+            scenario = status.sender.scenario
+            self._stages_left[scenario] -= 1
+            if self._stages_left[scenario] == 0:
+                scenario.project.save()
+                log.info('Scenario {} complete'.format(scenario.name))
+        super(ForecastJob, self).on_status_changed(status)
+
+    def _add_scenario(self, scenario):
+        """ Add the chain of stages for scenario """
+        cfg = scenario.config
         stages = []
         if cfg['run_is_forecast']:
-            stages.append(ForecastStage(self.scenario))
+            stage = ForecastStage(scenario, self.catalog)
+            self._forecast_stages.append(stage)
+            stages.append((stage, FORECAST_STAGE))
         if cfg['run_hazard']:
-            stages.append(HazardStage(self.scenario))
+            stages.append((HazardStage(scenario), None))
         if cfg['run_risk']:
-            stages.append(RiskStage(self.scenario))
-        self.work_units = stages
-
-    def pre_process(self):
-        log.info('Calculating scenario: {}'.format(self.scenario.name))
-        result = ForecastResult()
-        self.forecast.results.append(result)
-        self.scenario.forecast_result = result
-        self.scenario.project.save()
-
-    def post_process(self):
-        self.scenario.project.save()
-        log.info('Scenario {} complete'.format(self.scenario.name))
+            stages.append((RiskStage(scenario), None))
+        previous = ()
+        for stage, resource in stages:
+            self.add_unit(stage, depends_on=previous, resource=resource)
+            previous = (stage,)
+        self._stage_count[scenario] = len(stages)
 
 
 class ForecastStage(ParallelJob):
@@ -100,42 +141,99 @@ class ForecastStage(ParallelJob):
     Executes all forecast models for a scenario
 
     :param Scenario scenario: scenario for which to execute model forecasts
+    :param CatalogColumns catalog: Columnar view of the input catalog
 
     """
 
-    def __init__(self, scenario):
+    def __init__(self, scenario, catalog=None):
         super(ForecastStage, self).__init__('forecast_model_job')
         self.scenario = scenario
         self.forecast = scenario.forecast_input.forecast
+        self.catalog = catalog
 
         cfg = self.forecast.forecast_set.project.settings['forecast_models']
         work_units = []
         for model_id, config in cfg.items():
-            if config['enabled']:
-                wu = SeismicityForecast(self.scenario, model_id, config)
-                work_units.append(wu)
+            if not config['enabled']:
+                continue
+            if config.get('ensemble'):
+                wu = EnsembleForecast(self.scenario, model_id, config,
+                                      catalog)
+            else:
+                wu = SeismicityForecast(self.scenario, model_id, config,
+                                        catalog)
+            work_units.append(wu)
         self.work_units = work_units
 
     def pre_process(self):
         log.info('Starting forecast stage for scenario {} with models {}'
                  .format(self.scenario.name,
-                         [wu.client.model_id for wu in self.work_units]))
+                         [wu.job_id for wu in self.work_units]))
+        # All models share the same serialized forecast
+        payload = ForecastPayload(self.scenario, self.catalog)
+        for wu in self.work_units:
+            wu.payload = payload
 
     def post_process(self):
         log.info('All models complete for scenario: {}'
                  .format(self.scenario.name))
 
 
-class SeismicityForecast(WorkUnit):
+class RemoteWorkUnit(WorkUnit):
+    """
+    A work unit that runs on a remote worker
+
+    The unit waits for a slot for its worker *endpoint* from
+    endpoint_limiter before it starts and holds it until it has finished.
+    Subclasses implement start() and report status changes through
+    emit_status().
+
+    :param str endpoint: url of the remote worker
+
+    """
+
+    def __init__(self, job_id, endpoint):
+        super(RemoteWorkUnit, self).__init__(job_id)
+        self.endpoint = endpoint
+        self._has_slot = False
+
+    def run(self):
+        endpoint_limiter.acquire(self.endpoint, self._on_slot)
+
+    def emit_status(self, job_status):
+        """
+        Forward job_status, releasing our slot if we have finished
+
+        The slot is released after the status has been forwarded, so the
+        next unit for the endpoint starts after our completion has been
+        reported.
+
+        """
+        release = job_status.finished and self._has_slot
+        if release:
+            self._has_slot = False
+        self.status_changed.emit(job_status)
+        if release:
+            endpoint_limiter.release(self.endpoint)
+
+    def _on_slot(self):
+        self._has_slot = True
+        self.start()
+
+
+class SeismicityForecast(RemoteWorkUnit):
 
-    def __init__(self, scenario, model_id, model_config):
-        super(SeismicityForecast, self).__init__(model_id)
+    def __init__(self, scenario, model_id, model_config, catalog=None):
+        client = ModelClient(model_id, model_config)
+        super(SeismicityForecast, self).__init__(model_id, client.url)
         self.scenario = scenario
+        self.catalog = catalog
+        self.payload = None
         self.model_result = None
-        self.client = ModelClient(model_id, model_config)
+        self.client = client
         self.client.client_notification.connect(self.on_client_notification)
 
-    def run(self):
+    def start(self):
         log.info('Running forecast model {}'.format(self.client.model_id))
         project = self.scenario.forecast_input.forecast.forecast_set.project
         self.model_result = ModelResult(self.job_id)
@@ -143,7 +241,9 @@ class SeismicityForecast(WorkUnit):
         forecast_result.model_results[self.job_id] = self.model_result
         run_info = {
             'reference_point': project.reference_point,
-            'injection_point': project.injection_well.injection_point
+            'injection_point': project.injection_well.injection_point,
+            'catalog': self.catalog,
+            'payload': self.payload
         }
         self.client.run(self.scenario, run_info)
 
@@ -160,21 +260,152 @@ class SeismicityForecast(WorkUnit):
         # set the job status and forward it up the job chain
         job_status = JobStatus(self, finished=calc_status.finished,
                                info=calc_status)
-        self.status_changed.emit(job_status)
+        self.emit_status(job_status)
+
+
+class EnsembleForecast(ParallelJob):
+    """
+    Runs a forecast model for an ensemble of parameter sets
 
+    The parameter sets (see :mod:`ensemble`) are sent to the model worker
+    in batches, at most *max_concurrent* batches at a time. When all
+    batches have finished, the mean rate prediction is stored in the
+    model result and the distribution summary (std, quantiles, number of
+    successful and failed runs) in the info of its status.
 
-class HazardStage(WorkUnit):
+    Older workers keep the result of their last run only, so concurrent
+    batches would overwrite each other's results. Only one batch is
+    therefore in flight until the worker has accepted a batch with a job
+    id.
+
+    """
+
+    def __init__(self, scenario, model_id, model_config, catalog=None):
+        ensemble_config = model_config['ensemble']
+        super(EnsembleForecast, self).__init__(model_id, max_concurrent=1)
+        self.batch_concurrency = ensemble_config.get('max_concurrent')
+        self._concurrent = False
+        self.scenario = scenario
+        self.model_config = model_config
+        self.payload = None
+        self.model_result = None
+        self.quantiles = ensemble_config.get('quantiles',
+                                             ensemble.DEFAULT_QUANTILES)
+        parameter_sets = ensemble.parameter_sets(
+            ensemble_config, model_config['parameters'])
+        batches = ensemble.batches(parameter_sets,
+                                   ensemble_config.get('batch_size', 50))
+        self.work_units = [
+            EnsembleMember('{}[{}]'.format(model_id, i), model_id,
+                           model_config, batch, catalog, scenario)
+            for i, batch in enumerate(batches)]
+
+    def run(self):
+        self._concurrent = False
+        super(EnsembleForecast, self).run()
+
+    def on_status_changed(self, status):
+        super(EnsembleForecast, self).on_status_changed(status)
+        member = status.sender
+        if self._concurrent or member not in self._unit_set or \
+                not member.client.keeps_job_results:
+            return
+        # the worker keeps per job results, start the remaining batches
+        self._concurrent = True
+        more = (self.batch_concurrency or len(self.work_units)) - 1
+        if more > 0:
+            self._starter.request(more)
+
+    def pre_process(self):
+        log.info('Running forecast model {} for {} parameter sets in {} '
+                 'batches'.format(self.job_id,
+                                  sum(len(wu.parameter_sets)
+                                      for wu in self.work_units),
+                                  len(self.work_units)))
+        self.model_result = ModelResult(self.job_id)
+        forecast_result = self.scenario.forecast_result
+        forecast_result.model_results[self.job_id] = self.model_result
+        for wu in self.work_units:
+            wu.payload = self.payload
+
+    def post_process(self):
+        results = [r for wu in self.work_units for r in wu.results]
+        summary = ensemble.summarize(results, self.quantiles)
+        if summary is None:
+            log.error('All runs of forecast model {} failed'
+                      .format(self.job_id))
+            state = CalculationStatus.ERROR
+        else:
+            log.info('Forecast model {} ensemble complete ({} of {} runs '
+                     'successful)'.format(self.job_id, summary['n'],
+                                          len(results)))
+            state = CalculationStatus.COMPLETE
+            self.model_result.rate_prediction = \
+                RatePrediction(*summary['mean'])
+        self.model_result.status = CalculationStatus(
+            None, state, {'ensemble': summary})
+        self.scenario.project.save()
+
+
+class EnsembleMember(RemoteWorkUnit):
+    """
+    Runs a batch of parameter sets of an ensemble on the model worker
+
+    :ivar list results: (rate, b_val, prob) for each parameter set, None
+        for runs that failed
+
+    """
+
+    def __init__(self, job_id, model_id, model_config, parameter_sets,
+                 catalog, scenario):
+        client = ModelClient(model_id, model_config)
+        super(EnsembleMember, self).__init__(job_id, client.url)
+        self.scenario = scenario
+        self.catalog = catalog
+        self.parameter_sets = parameter_sets
+        self.payload = None
+        self.results = [None] * len(parameter_sets)
+        self.client = client
+        self.client.client_notification.connect(self.on_client_notification)
+
+    def start(self):
+        project = self.scenario.forecast_input.forecast.forecast_set.project
+        run_info = {
+            'reference_point': project.reference_point,
+            'injection_point': project.injection_well.injection_point,
+            'catalog': self.catalog,
+            'payload': self.payload,
+            'parameter_sets': self.parameter_sets
+        }
+        self.client.run(self.scenario, run_info)
+
+    def on_client_notification(self, notification):
+        calc_status = create_calculation_status(notification)
+        if calc_status.state == CalculationStatus.COMPLETE:
+            results = self.client.results
+            if len(results) == len(self.parameter_sets):
+                self.results = results
+            else:
+                log.error('Expected {} results for {}, got {}'
+                          .format(len(self.parameter_sets), self.job_id,
+                                  len(results)))
+        job_status = JobStatus(self, finished=calc_status.finished,
+                               info=calc_status)
+        self.emit_status(job_status)
+
+
+class HazardStage(RemoteWorkUnit):
 
     def __init__(self, scenario):
-        super(HazardStage, self).__init__('psha_stage')
+        super(HazardStage, self).__init__('psha_stage', OQ_URL)
         # shortcuts
         self.scenario = scenario
         self.hazard_result = None
         # client reference
-        self.client = OQClient('http://127.0.0.1:8800')
+        self.client = OQClient(OQ_URL, fetch_hazard_curves=True)
         self.client.client_notification.connect(self._on_client_notification)
 
-    def run(self):
+    def start(self):
         log.info('Running psha stage on scenario: {}'\
                  .format(self.scenario.name))
         # create the result object
@@ -187,7 +418,7 @@ class HazardStage(WorkUnit):
         if len(valid_results) == 0:
             log.error('Cannot run hazard: no valid inputs.')
             job_status = JobStatus(self, finished=True, info=None)
-            self.status_changed.emit(job_status)
+            self.emit_status(job_status)
             return
         weights = len(valid_results) * [round(1.0/len(valid_results), 2)]
         weights[-1] = 1.0 - sum(weights[:-1])  # make sure sum is exactly 1.0
@@ -205,7 +436,8 @@ class HazardStage(WorkUnit):
         if calc_status.state == CalculationStatus.RUNNING:
             self.hazard_result.calc_id = calc_status.calc_id
         elif calc_status.state == CalculationStatus.COMPLETE:
-            content, id = self.client.get_hazard_curves(calc_status.calc_id)
+            # the client fetches the curves before reporting completion
+            content, id = self.client.hazard_curves or (None, None)
             if content is None:
                 log.error('Failed to retrieve hazard curves for calc {}'
                           .format(calc_status.calc_id))
@@ -218,20 +450,20 @@ class HazardStage(WorkUnit):
         # set the job status and forward it up the job chain
         job_status = JobStatus(self, finished=calc_status.finished,
                                info=calc_status)
-        self.status_changed.emit(job_status)
+        self.emit_status(job_status)
 
 
-class RiskStage(WorkUnit):
+class RiskStage(RemoteWorkUnit):
 
     def __init__(self, scenario):
-        super(RiskStage, self).__init__('risk_stage')
+        super(RiskStage, self).__init__('risk_stage', OQ_URL)
         self.scenario = scenario
         self.risk_result = None
         # client reference
-        self.client = OQClient('http://127.0.0.1:8800')
+        self.client = OQClient(OQ_URL)
         self.client.client_notification.connect(self._on_client_notification)
 
-    def run(self):
+    def start(self):
         log.info('Running risk stage on scenario: {}'\
                  .format(self.scenario.name))
         self.risk_result = RiskResult()
@@ -247,7 +479,7 @@ class RiskStage(WorkUnit):
         # set the job status and forward it up the job chain
         job_status = JobStatus(self, finished=calc_status.finished,
                                info=calc_status)
-        self.status_changed.emit(job_status)
+        self.emit_status(job_status)
 
 
 # Helper Methods
@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+"""
+Queue of forecasts waiting to be run by the engine
+
+In real time operation forecasts are due at fixed intervals. If a forecast
+is due while earlier forecasts are still running, the queue decides what
+happens to it depending on its policy:
+
+* ``queue``: run all forecasts in order
+* ``coalesce``: only keep the most recent waiting forecast, older ones
+  are stale and skipped
+* ``drop``: skip forecasts that are due while the engine is busy
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import time
+from collections import deque
+
+POLICIES = ('queue', 'coalesce', 'drop')
+
+# Defaults: a forecast that is due while the hazard and risk stages of the
+# previous one run starts right away. If one is due while the models of
+# two forecasts are still running, only the most recent waiting one is run
+# once the models are done.
+DEFAULT_POLICY = 'coalesce'
+DEFAULT_MAX_FORECASTS = 2
+
+
+class ForecastQueue:
+    """
+    Forecasts waiting to be run, with queue depth and lag metrics
+
+    The lag of a forecast is the time it spent waiting in the queue.
+
+    :param str policy: one of POLICIES
+    :param clock: function returning the current (monotonic) time [s]
+
+    """
+
+    def __init__(self, policy=DEFAULT_POLICY, clock=time.monotonic):
+        if policy not in POLICIES:
+            raise ValueError('Unknown forecast queue policy {}'.format(policy))
+        self.policy = policy
+        self._clock = clock
+        self._items = deque()
+        self.reset_metrics()
+
+    def __len__(self):
+        return len(self._items)
+
+    def reset_metrics(self):
+        self.queued = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, forecast, t, busy):
+        """
+        Add a forecast that is due at project time t
+
+        :param bool busy: True if the engine can't start the forecast now
+        :returns: list of forecasts that were skipped
+
+        """
+        if busy and self.policy == 'drop':
+            self.skipped += 1
+            return [forecast]
+        skipped = []
+        if self.policy == 'coalesce':
+            skipped = [item[0] for item in self._items]
+            self.skipped += len(skipped)
+            self._items.clear()
+        self._items.append((forecast, t, self._clock()))
+        self.queued += 1
+        self.max_depth = max(self.max_depth, len(self._items))
+        return skipped
+
+    def pop(self):
+        """ Returns the next forecast and its project time as (forecast, t) """
+        forecast, t, t_queued = self._items.popleft()
+        self.last_lag = self._clock() - t_queued
+        self.max_lag = max(self.max_lag, self.last_lag)
+        return forecast, t
+
+    def clear(self):
+        self._items.clear()
+
+    def metrics(self):
+        """ Returns the queue metrics as a dict """
+        return {'depth': len(self._items), 'max_depth': self.max_depth,
+                'queued': self.queued, 'skipped': self.skipped,
+                'last_lag': self.last_lag, 'max_lag': self.max_lag}
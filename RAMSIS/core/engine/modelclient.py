@@ -1,14 +1,232 @@
+import io
+import json
 import requests
 import logging
-import urllib.parse
+from threading import Lock
+
+import numpy as np
 
 from PyQt5.QtCore import QObject, pyqtSignal, QTimer
-from pymap3d import geodetic2ned
 
+from RAMSIS.core.engine.catalogsync import catalog_session
+from RAMSIS.core.tools.catalog import CatalogColumns, geodetic_to_local
+from RAMSIS.core.tools.eventloop import task_runner
+from RAMSIS.core.tools.httpsession import session_pool
+from RAMSIS.core.tools.polling import PollSchedule
 from RAMSIS.core.tools.notifications import (RunningNotification,
     ErrorNotification, CompleteNotification, OtherNotification)
 from ramsis.datamodel.schemas import ForecastSchema
-from requests.exceptions import ConnectionError, Timeout
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+# Content type of the binary (columnar) forecast transport
+NPZ_MIMETYPE = 'application/x-ramsis-npz'
+
+# Default status poll schedule for model runs (see PollSchedule)
+DEFAULT_POLLING = {'first': 0.5, 'factor': 2.0, 'max_interval': 30.0,
+                   'jitter': 0.1, 'deadline': 3600.0}
+
+
+def local_injection_well(injection_point, reference_point):
+    """
+    Returns the injection point in the local coordinates of the events
+
+    Workers of models that need the well position (e.g. shapiro) get it in
+    the same frame as the local event coordinates x, y, z.
+
+    :param injection_point: (lat, lon, depth) of the injection point
+    :param dict reference_point: reference point with keys 'lat', 'lon'
+        and 'h'
+    :returns: dict with the keys well_tip_x, well_tip_y and well_tip_z
+
+    """
+    lat, lon, depth = injection_point
+    ref = (reference_point['lat'], reference_point['lon'],
+           reference_point['h'])
+    x, y, z = geodetic_to_local(np.array([lat]), np.array([lon]),
+                                np.array([depth]), ref)
+    return {'well_tip_x': float(x[0]), 'well_tip_y': float(y[0]),
+            'well_tip_z': float(z[0])}
+
+
+class ForecastPayload:
+    """
+    Serialized forecast input for a scenario
+
+    Serializing the forecast (including the input catalog) is expensive and
+    the result is the same for all models that run on a scenario. The
+    payload is therefore created once per scenario and shared by all model
+    clients. The forecast is dumped and JSON encoded on first use, only the
+    model parameters are added per request. The encoded forms are built
+    under a lock since clients encode on pool threads.
+
+    :param Scenario scenario: Scenario the models will run on
+    :param CatalogColumns catalog: Columnar view of the input catalog
+        (optional, used to add local event coordinates)
+
+    """
+
+    def __init__(self, scenario, catalog=None):
+        self.scenario = scenario
+        self.catalog = catalog
+        self.reference_point = None
+        self._data = None
+        self._encoded = None
+        self._npz = None
+        self._lock = Lock()
+        self._logger = logging.getLogger(__name__)
+
+    def prepare(self):
+        """
+        Serialize the forecast now
+
+        Must be called on the main thread before the payload is encoded on
+        another thread, since the ORM objects are not thread safe.
+
+        """
+        self.columns  # also serializes the data
+
+    @property
+    def data(self):
+        """ The serialized forecast with local event coordinates """
+        if self._data is None:
+            self._data = self._serialize()
+        return self._data
+
+    @property
+    def encoded(self):
+        """ The serialized forecast as utf-8 encoded JSON """
+        with self._lock:
+            if self._encoded is None:
+                self._encoded = json.dumps(self.data).encode('utf-8')
+            return self._encoded
+
+    @property
+    def columns(self):
+        """
+        Columnar view of the serialized seismic events (None if there are
+        no events)
+
+        """
+        try:
+            num_events = len(
+                self.data['input']['input_catalog']['seismic_events'])
+        except TypeError:
+            return None
+        return self._columns(num_events)
+
+    def npz(self, event_mask=None):
+        """
+        The forecast in the binary transport format
+
+        The format is a compressed numpy archive (npz). Seismic events are
+        stored column wise as float64 arrays named after the event
+        attributes (date_time as unix time stamp, lat, lon, depth,
+        magnitude, x, y, z). Everything else is stored as utf-8 encoded JSON
+        in the *meta* array, with an empty list of seismic events.
+
+        :param event_mask: boolean mask selecting the events to include,
+            all events if None
+
+        """
+        if event_mask is not None:
+            return self._encode_npz(event_mask)
+        with self._lock:
+            if self._npz is None:
+                self._npz = self._encode_npz()
+            return self._npz
+
+    def body(self, parameters, fields=None, event_mask=None):
+        """
+        Returns the JSON request body for a model run with parameters
+
+        The pre-encoded forecast is spliced into the body, so only the
+        parameters are encoded for each request.
+
+        :param dict parameters: model parameters
+        :param dict fields: additional request fields, e.g. catalog sync
+            info for delta uploads (optional)
+        :param event_mask: boolean mask selecting the events to include,
+            all events if None
+
+        """
+        if event_mask is None:
+            forecast = self.encoded
+        else:
+            forecast = json.dumps(self._subset(event_mask)).encode('utf-8')
+        parts = [b'{"forecast": ', forecast,
+                 b', "parameters": ', json.dumps(parameters).encode('utf-8'),
+                 b', "scenario id": ',
+                 json.dumps(self.scenario.id).encode('utf-8')]
+        for name, value in (fields or {}).items():
+            parts += [b', ', json.dumps(name).encode('utf-8'), b': ',
+                      json.dumps(value).encode('utf-8')]
+        parts.append(b'}')
+        return b''.join(parts)
+
+    def _serialize(self):
+        forecast = self.scenario.forecast_input.forecast
+        serialized = ForecastSchema().dump(forecast).data
+
+        # Add cartesian coordinates
+        ref = forecast.forecast_set.project.reference_point
+        self.reference_point = ref
+        try:
+            events = serialized['input']['input_catalog']['seismic_events']
+            num_events = len(events)
+        except TypeError:
+            self._logger.info('No seismic events')
+        else:
+            columns = self._columns(num_events)
+            x, y, z = columns.local_coordinates(ref)
+            for e, x_e, y_e, z_e in zip(events, x.tolist(), y.tolist(),
+                                        z.tolist()):
+                e['x'], e['y'], e['z'] = x_e, y_e, z_e
+        return serialized
+
+    def _columns(self, num_events):
+        """ Returns catalog columns matching the serialized events """
+        columns = self.catalog
+        if columns is None or len(columns) != num_events:
+            forecast = self.scenario.forecast_input.forecast
+            columns = CatalogColumns.from_events(
+                forecast.input.input_catalog.seismic_events)
+            self.catalog = columns
+        return columns
+
+    def _subset(self, event_mask, events=None):
+        """
+        Returns a shallow copy of the serialized forecast with only the
+        events selected by event_mask (or with events if given)
+
+        """
+        forecast = dict(self.data)
+        catalog = forecast['input']['input_catalog']
+        if events is None:
+            events = [e for e, keep in zip(catalog['seismic_events'],
+                                           event_mask.tolist()) if keep]
+        forecast['input'] = dict(forecast['input'])
+        forecast['input']['input_catalog'] = dict(catalog,
+                                                  seismic_events=events)
+        return forecast
+
+    def _encode_npz(self, event_mask=None):
+        meta = self.data
+        arrays = {}
+        columns = self.columns
+        if columns is not None:
+            x, y, z = columns.local_coordinates(self.reference_point)
+            arrays = {name: getattr(columns, name)
+                      for name in CatalogColumns.fields}
+            arrays.update(x=x, y=y, z=z)
+            if event_mask is not None:
+                arrays = {name: a[event_mask] for name, a in arrays.items()}
+            # the events go into the arrays
+            meta = self._subset(None, events=[])
+        meta = np.frombuffer(json.dumps(meta).encode('utf-8'),
+                             dtype=np.uint8)
+        buf = io.BytesIO()
+        np.savez_compressed(buf, meta=meta, **arrays)
+        return buf.getvalue()
 
 
 class ModelClient(QObject):
@@ -17,21 +235,49 @@ class ModelClient(QObject):
 
     :param str model_id: unique id for the model
     :param dict model_config: contains the model configuration
-        'url': worker url (including port)
+        'url': worker url (including port). For workers that serve
+        several models, the url includes the model, e.g.
+        http://localhost:5000/etas
         'parameters': basic model parameters
+        'transport': 'json' (default) or 'npz' for the binary columnar
+        transport. The client falls back to JSON if the worker does not
+        support the binary transport.
+        'delta_upload': only upload catalog changes since the last run
+        (default False, see :mod:`catalogsync`)
+        'polling': status poll schedule, overrides DEFAULT_POLLING (see
+        :class:`PollSchedule`)
+        'long_poll': if > 0, the worker holds each status request for up to
+        this many seconds until the results are ready (default 0)
+        'ensemble': parameter ensemble configuration (see :mod:`ensemble`)
+    :param SessionPool pool: HTTP session pool (defaults to the shared pool)
+    :param TaskRunner runner: runs the requests off the main thread
+        (defaults to the shared runner)
 
     """
     # Signal emitted when the calculation status changes
     client_notification = pyqtSignal(object)
 
-    def __init__(self, model_id, model_config):
+    def __init__(self, model_id, model_config, pool=None, runner=None):
         super(ModelClient, self).__init__()
         self.logger = logging.getLogger(__name__)
+        self.http = pool or session_pool()
+        self.runner = runner or task_runner()
         self.model_id = model_id
         self.model_config = model_config
         self.results = None
-        self.url = urllib.parse.urljoin(model_config['url'], '/run')
-        self.poll_interval = 5000  # ms
+        self.url = model_config['url'].rstrip('/')
+        if not self.url.endswith('/run'):
+            self.url += '/run'
+        self.result_url = self.url
+        self.polling = PollSchedule(**dict(DEFAULT_POLLING,
+                                           **model_config.get('polling', {})))
+        self.long_poll = model_config.get('long_poll', 0)
+        self.use_npz = model_config.get('transport', 'json') == 'npz'
+        self._transport_lock = Lock()
+        self.use_delta = model_config.get('delta_upload', False)
+        self.parameters = model_config['parameters']
+        self.parameter_sets = None
+        self.injection_well = None
 
     def run(self, scenario, run_info):
         """
@@ -45,42 +291,64 @@ class ModelClient(QObject):
         :param dict run_info: Supplementary info for this run:
            'reference_point': (lat, lon, depth) reference for coord. conversion
            'injection_point': (lat, lon, depth) of current injection point
+           'catalog': CatalogColumns of the input catalog (optional)
+           'payload': ForecastPayload shared with other clients (optional)
+           'parameters': model parameters for this run (optional,
+           overrides the parameters from the model config)
+           'parameter_sets': list of parameter dicts to run in one batch
+           (optional). Results are a list with one tuple per set.
 
         """
-        forecast = scenario.forecast_input.forecast
-        forecast_schema = ForecastSchema()
-        serialized = forecast_schema.dump(forecast).data
-        data = {
-            'forecast': serialized,
-            'parameters': self.model_config['parameters'],
-            'scenario id': scenario.id
-        }
-
-        # Add cartesian coordinates
-        ref = forecast.forecast_set.project.reference_point
-        try:
-            catalog = data['forecast']['input']['input_catalog']
-            for e in catalog['seismic_events']:
-                x, y, z = geodetic2ned(e['lat'], e['lon'], e['depth'],
-                                       ref['lat'], ref['lon'], ref['h'])
-                e['x'], e['y'], e['z'] = x, y, z
-
-        except TypeError:
-            self.logger.info('No seismic events')
+        self.parameters = run_info.get('parameters',
+                                       self.model_config['parameters'])
+        self.parameter_sets = run_info.get('parameter_sets')
+        injection_point = run_info.get('injection_point')
+        reference_point = run_info.get('reference_point')
+        self.injection_well = None
+        if injection_point is not None and reference_point is not None:
+            self.injection_well = local_injection_well(injection_point,
+                                                       reference_point)
+        payload = run_info.get('payload')
+        if payload is None:
+            payload = ForecastPayload(scenario, run_info.get('catalog'))
+        payload.prepare()
+        project_id = scenario.forecast_input.forecast.forecast_set.project.id
 
         # Request model run
         self.results = None
+        self.result_url = self.url
         self.logger.info('Starting remote worker for {}'.format(self.model_id))
+        self.runner.submit(self._post_run, self._on_run_response, payload,
+                           project_id)
+
+    @property
+    def keeps_job_results(self):
+        """
+        True if the worker returned a job id for the last run, i.e. it
+        keeps the results of concurrent runs apart
+
+        """
+        return self.result_url != self.url
+
+    def _on_run_response(self, future):
         notification = ErrorNotification(calc_id=self.model_id)
         try:
-            r = requests.post(self.url, json=data, timeout=5)
+            r = future.result()
         except (ConnectionError, Timeout) as ex:
             self.logger.error('Can''t connect to worker: {}'.format(repr(ex)))
+        except RequestException as ex:
+            self.logger.error('Request to worker failed: {}'.format(repr(ex)))
+        except Exception:
+            # e.g. a payload that can't be encoded, we must still notify
+            self.logger.exception('Failed to request model run for {}'
+                                  .format(self.model_id))
         else:
             notification.response = r
             if r.status_code == requests.codes.accepted:
                 notification = RunningNotification(self.model_id, response=r)
-                QTimer.singleShot(self.poll_interval, self._get_results)
+                self.result_url = self._result_url(r)
+                self.polling.start()
+                self._schedule_poll()
             elif r.status_code == requests.codes.bad_request:
                 self.logger.error('The worker did not accept our request: {}'
                                   .format(r.content))
@@ -95,35 +363,197 @@ class ModelClient(QObject):
                                   .format(r.status_code, r.content))
         self.client_notification.emit(notification)
 
+    def _result_url(self, response):
+        """
+        Returns the url of the results for the run that was just posted
+
+        Workers that run several jobs at the same time return a job id.
+        Older workers only keep the result of their last run.
+
+        """
+        try:
+            job_id = response.json().get('job_id')
+        except (ValueError, AttributeError):
+            job_id = None
+        if job_id is None:
+            return self.url
+        return '{}/{}'.format(self.url, job_id)
+
+    def _post_run(self, payload, project_id):
+        """
+        Post the run request (runs on a pool thread)
+
+        If delta uploads are enabled, only the events that changed since the
+        last upload that the worker acknowledged are sent. If the worker
+        doesn't hold the catalog version our delta is based on, it responds
+        with 409 (Conflict) and we resend the full catalog.
+
+        """
+        columns = payload.columns if self.use_delta else None
+        if columns is None:
+            return self._post(payload)
+        session = catalog_session(self.url, project_id)
+        delta = session.delta(columns)
+        r = self._post(payload, delta)
+        if r.status_code == requests.codes.conflict and not delta.full:
+            self.logger.info('Worker for {} lost the catalog state. '
+                             'Uploading full catalog.'.format(self.model_id))
+            session.reset()
+            delta = session.delta(columns)
+            r = self._post(payload, delta)
+        # Only workers that support delta uploads acknowledge the version
+        try:
+            acked = r.json().get('catalog_version')
+        except (ValueError, AttributeError):
+            acked = None
+        accepted = r.status_code == requests.codes.accepted
+        if accepted and acked == delta.sync['version']:
+            session.commit(delta)
+        else:
+            session.reset()
+        return r
+
+    def _post(self, payload, delta=None):
+        """
+        Post the run request, using the binary transport if enabled
+
+        Workers that don't support the binary transport respond with
+        415 (Unsupported Media Type), in which case we switch to JSON.
+
+        """
+        parameters = self.parameters
+        fields = {}
+        if self.parameter_sets is not None:
+            fields['parameter_sets'] = self.parameter_sets
+        if self.injection_well is not None:
+            fields['injection_well'] = self.injection_well
+        if delta is not None:
+            fields['catalog_sync'] = delta.sync
+        event_mask = delta.added if delta else None
+        with self._transport_lock:
+            use_npz = self.use_npz
+        if use_npz:
+            files = {'forecast': ('forecast.npz', payload.npz(event_mask),
+                                  NPZ_MIMETYPE)}
+            form = {'parameters': json.dumps(parameters),
+                    'scenario id': json.dumps(payload.scenario.id)}
+            form.update({name: json.dumps(value)
+                         for name, value in fields.items()})
+            r = self.http.post(self.url, files=files, data=form,
+                               timeout=5)
+            if r.status_code != requests.codes.unsupported_media_type:
+                return r
+            self.logger.warning('Worker for {} does not support the binary '
+                                'transport. Falling back to JSON.'
+                                .format(self.model_id))
+            with self._transport_lock:
+                self.use_npz = False
+        body = payload.body(parameters, fields, event_mask)
+        return self.http.post(self.url, data=body,
+                              headers={'Content-Type': 'application/json'},
+                              timeout=5)
+
+    def _schedule_poll(self):
+        """
+        Schedule the next status poll
+
+        :returns: False if the poll deadline has passed
+
+        """
+        interval = self.polling.next_interval_ms()
+        if interval is None:
+            self.logger.error('No result from worker for {} after {:.0f} s. '
+                              'Giving up.'.format(self.model_id,
+                                                  self.polling.elapsed))
+            return False
+        QTimer.singleShot(interval, self._poll)
+        return True
+
+    def _poll(self):
+        self.runner.submit(self._get_results, self._on_results)
+
     def _get_results(self):
         """
-        Poll the database periodically until the model results have been
-        retrieved, then emit the finished signal.
+        Request the model results from the worker (runs on a pool thread)
+
+        If long polling is enabled, the worker responds as soon as the
+        results are ready.
 
         """
-        r = requests.get(self.url, timeout=5)
+        params, timeout = None, 5
+        if self.long_poll:
+            params, timeout = {'wait': self.long_poll}, self.long_poll + 5
+        return self.http.get(self.result_url, params=params, timeout=timeout)
+
+    def _on_results(self, future):
+        """
+        Handle the worker response to a status poll. Polls are repeated
+        following the adaptive schedule in self.polling until the results
+        have been retrieved, then the finished signal is emitted.
+
+        """
+        try:
+            r = future.result()
+        except (ConnectionError, Timeout) as ex:
+            self.logger.warning('Failed to poll worker for {}: {}'
+                                .format(self.model_id, repr(ex)))
+            notification = OtherNotification(self.model_id)
+            if not self._schedule_poll():
+                notification = ErrorNotification(self.model_id)
+            self.client_notification.emit(notification)
+            return
+        except Exception as ex:
+            self.logger.error('Failed to poll worker for {}: {}'
+                              .format(self.model_id, repr(ex)))
+            self.client_notification.emit(ErrorNotification(self.model_id))
+            return
         if r.status_code == requests.codes.ok:
-            data = r.json()
-            if data['status'] == 'complete':
+            try:
+                data = r.json()
+                complete = data['status'] == 'complete'
+                if complete:
+                    self.results = self._parse_results(
+                        data['result'], self.parameter_sets is not None)
+            except (ValueError, KeyError, TypeError) as ex:
+                self.logger.error('Invalid results from worker for {}: {}'
+                                  .format(self.model_id, repr(ex)))
+                complete = False
+            if complete:
                 self.logger.info('Model run completed successfully')
-                rate, b_val, std = data['result']['rate_prediction']
-                self.results = (rate, b_val, std)
                 notification = CompleteNotification(self.model_id, response=r)
             else:
                 notification = ErrorNotification(self.model_id, response=r)
                 self.logger.error('Model run failed')
         elif r.status_code == requests.codes.accepted:  # still running
-            self.logger.debug('no result yet for {}, trying again in {} s'
-                              .format(self.model_id, self.poll_interval/1000))
-            QTimer.singleShot(self.poll_interval, self._get_results)
-            return
-        elif r.status_code == requests.codes.no_content:
+            if self._schedule_poll():
+                self.logger.debug('no result yet for {}'
+                                  .format(self.model_id))
+                return
+            notification = ErrorNotification(self.model_id, response=r)
+        elif r.status_code in (requests.codes.no_content,
+                               requests.codes.not_found):
             self.logger.error('The worker has no results and no active job')
             notification = ErrorNotification(self.model_id, response=r)
         else:
             self.logger.error('The worker reported an error {}'
                               .format(r.status_code))
             notification = OtherNotification(self.model_id, response=r)
-            # TODO: limit retries?
-            QTimer.singleShot(self.poll_interval, self._get_results)
+            if not self._schedule_poll():
+                notification = ErrorNotification(self.model_id, response=r)
         self.client_notification.emit(notification)
+
+    @staticmethod
+    def _parse_results(result, batch=False):
+        """
+        Returns the rate prediction or, for a batch of parameter sets, the
+        list of rate predictions
+
+        :raises KeyError: if the result doesn't match the request, e.g. a
+            worker that ignored the parameter sets
+
+        """
+        if batch:
+            return [tuple(r) if r else None
+                    for r in result['rate_predictions']]
+        rate, b_val, std = result['rate_prediction']
+        return rate, b_val, std
@@ -12,8 +12,11 @@ Copyright (C) 2017, ETH Zurich - Swiss Seismological Service SED
 import logging
 from urllib.parse import urljoin
 import json
-import requests
 from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+from requests.exceptions import ConnectionError, Timeout
+from RAMSIS.core.tools.eventloop import task_runner
+from RAMSIS.core.tools.httpsession import session_pool
+from RAMSIS.core.tools.polling import PollSchedule
 from RAMSIS.core.tools.notifications import (RunningNotification,
     ErrorNotification, CompleteNotification, OtherNotification)
 
@@ -29,20 +32,45 @@ class OQClient(QObject):
 
     After starting an openquake calculation it will periodically check the
     status of the calculation and report the results back by firing the
-    status_changed signal
+    status_changed signal. Status polls back off exponentially (see
+    :class:`PollSchedule`) and the job is considered failed if it doesn't
+    complete before the poll deadline.
     
+    All requests are sent from a thread pool, results are reported on the
+    main thread.
+
     :ivar calc_id: OQ id of current calculation
-    
+    :ivar busy: True while a job is being submitted or running
+    :ivar hazard_curves: (content, result id) of the last completed job if
+        fetch_hazard_curves is set
+    :param str url: OpenQuake server url
+    :param SessionPool pool: HTTP session pool (defaults to the shared pool)
+    :param dict polling: status poll schedule, overrides POLLING
+    :param TaskRunner runner: runs the requests off the main thread
+        (defaults to the shared runner)
+    :param bool fetch_hazard_curves: fetch the hazard curves when the job
+        completes, before reporting completion
+
     """
     # Signal emitted when the calculation status changes
     client_notification = pyqtSignal(object)
 
-    POLL_INTERVAL = 3000  # Poll interval for status polling [ms]
+    # Default status poll schedule (see PollSchedule)
+    POLLING = {'first': 1.0, 'factor': 1.5, 'max_interval': 60.0,
+               'jitter': 0.1, 'deadline': 12 * 3600.0}
 
-    def __init__(self, url):
+    def __init__(self, url, pool=None, polling=None, runner=None,
+                 fetch_hazard_curves=False):
         super(OQClient, self).__init__()
         self.url = url
+        self.http = pool or session_pool()
+        self.runner = runner or task_runner()
+        self.polling = PollSchedule(**dict(OQClient.POLLING,
+                                           **(polling or {})))
+        self.fetch_hazard_curves = fetch_hazard_curves
+        self.hazard_curves = None
         self.calc_id = None
+        self.busy = False
 
     def run_job(self, files, params=None):
         """
@@ -55,52 +83,135 @@ class OQClient(QObject):
         :param list files: Input files for hazard calculation
 
         """
-        if self.calc_id:
+        if self.busy:
             raise RuntimeError('Cannot run more than one job at a time')
+        self.busy = True
+        self.hazard_curves = None
         # start hazard calculation
-        r = self.post_job(files=files, params=params)
+        self.runner.submit(self.post_job, self._on_job_posted, files=files,
+                           params=params)
+
+    def _on_job_posted(self, future):
+        try:
+            r = future.result()
+        except (ConnectionError, Timeout) as ex:
+            log.error('Can''t connect to OpenQuake: {}'.format(repr(ex)))
+            self.busy = False
+            self.client_notification.emit(ErrorNotification())
+            return
+        except Exception as ex:
+            log.error('Failed to post OpenQuake job: {}'.format(repr(ex)))
+            self.busy = False
+            self.client_notification.emit(ErrorNotification())
+            return
         if r.status_code == 200:
-            content = json.loads(r.content)
-            self.calc_id = content['job_id']
+            try:
+                self.calc_id = json.loads(r.content)['job_id']
+            except (ValueError, KeyError, TypeError) as ex:
+                log.error('Invalid OpenQuake response: {}'.format(repr(ex)))
+                self.busy = False
+                self.client_notification.emit(ErrorNotification(response=r))
+                return
             notification = RunningNotification(self.calc_id, response=r)
-            QTimer.singleShot(OQClient.POLL_INTERVAL, self.poll_status)
+            self.polling.start()
+            self._schedule_poll()
             log.info('OpenQuake job with id {} started'.format(self.calc_id))
         else:
+            self.busy = False
             notification = ErrorNotification(response=r)
             log.error('Failed to start OpenQuake job: [{}] {}'
                       .format(r.status_code, r.content).strip('\n'))
         self.client_notification.emit(notification)
 
     def poll_status(self):
-        r = self.get_status()
+        self.runner.submit(self._fetch_status, self._on_status,
+                           self.calc_id)
+
+    def _fetch_status(self, calc_id):
+        """
+        Get the job status and, if the job is complete and requested, the
+        hazard curves (runs on a pool thread)
+
+        """
+        r = self.get_status(calc_id)
+        curves = None
+        if self.fetch_hazard_curves and r.status_code == 200 and \
+                r.json().get('status') == 'complete':
+            curves = self.get_hazard_curves(calc_id)
+        return r, curves
+
+    def _on_status(self, future):
+        try:
+            r, curves = future.result()
+        except (ConnectionError, Timeout) as ex:
+            log.warning('Failed to poll OpenQuake: {}'.format(repr(ex)))
+            notification = OtherNotification(self.calc_id)
+            if not self._schedule_poll():
+                notification = ErrorNotification(self.calc_id)
+                self._finish()
+            self.client_notification.emit(notification)
+            return
+        except Exception as ex:
+            log.error('Failed to poll OpenQuake: {}'.format(repr(ex)))
+            self._finish()
+            self.client_notification.emit(ErrorNotification(self.calc_id))
+            return
         if r.status_code == 200:
-            content = json.loads(r.content)
-            if content['status'] == 'executing':
-                QTimer.singleShot(OQClient.POLL_INTERVAL, self.poll_status)
-                return
-            elif content['status'] == 'failed':
+            try:
+                content = json.loads(r.content)
+                status = content['status']
+            except (ValueError, KeyError, TypeError) as ex:
+                log.error('Invalid OpenQuake status: {}'.format(repr(ex)))
+                status = 'failed'
+            if status in ('created', 'executing'):
+                if self._schedule_poll():
+                    return
+                notification = ErrorNotification(self.calc_id, response=r)
+                self._finish()
+            elif status == 'complete':
+                log.info('Hazard calculation {} complete'.format(self.calc_id))
+                self.hazard_curves = curves
+                notification = CompleteNotification(self.calc_id, response=r)
+                self._finish()
+            else:  # failed, aborted
                 log.error('Calculation {} failed: [{}] {}'
                           .format(self.calc_id, r.status_code,
                                   r.content).strip('\n'))
                 notification = ErrorNotification(self.calc_id, response=r)
-                self.calc_id = None
-            elif content['status'] == 'complete':
-                log.info('Hazard calculation {} complete'.format(self.calc_id))
-                notification = CompleteNotification(self.calc_id, response=r)
-                self.calc_id = None
+                self._finish()
         elif r.status_code == 500:
             log.error('Calculation failed: [{}] {}'
                       .format(r.status_code, r.content).strip('\n'))
             notification = ErrorNotification(self.calc_id, response=r)
-            self.calc_id = None
+            self._finish()
         else:  # other (e.g. not reachable), we keep polling
             log.warning('Unexpected OQ response: [{}] {}'
                         .format(r.status_code, r.content).strip('\n'))
             notification = OtherNotification(self.calc_id, response=r)
-            # TODO: define timeout?
-            QTimer.singleShot(OQClient.POLL_INTERVAL, self.poll_status)
+            if not self._schedule_poll():
+                notification = ErrorNotification(self.calc_id, response=r)
+                self._finish()
         self.client_notification.emit(notification)
 
+    def _finish(self):
+        self.calc_id = None
+        self.busy = False
+
+    def _schedule_poll(self):
+        """
+        Schedule the next status poll
+
+        :returns: False if the poll deadline has passed
+
+        """
+        interval = self.polling.next_interval_ms()
+        if interval is None:
+            log.error('Calculation {} did not complete within {:.0f} s. '
+                      'Giving up.'.format(self.calc_id, self.polling.elapsed))
+            return False
+        QTimer.singleShot(interval, self.poll_status)
+        return True
+
     def get_hazard_curves(self, calc_id):
         """ Return hazard curves of calc_id as zipped geojson files """
         hcurves_id = self.get_result_id('hcurves', calc_id)
@@ -123,16 +234,17 @@ class OQClient(QObject):
 
     # REST Client Methods
 
-    def get_status(self):
+    def get_status(self, calc_id=None):
         """ Get the calculation status from openquake """
-        end_point = '{}/calc/{}/status'.format(API_V, self.calc_id)
-        r = requests.get(urljoin(self.url, end_point))
+        calc_id = self.calc_id if calc_id is None else calc_id
+        end_point = '{}/calc/{}/status'.format(API_V, calc_id)
+        r = self.http.get(urljoin(self.url, end_point))
         log.debug('status response: {}'.format(r))
         return r
 
     def get_result_list(self, calc_id):
         end_point = '{}/calc/{}/results'.format(API_V, calc_id)
-        r = requests.get(urljoin(self.url, end_point))
+        r = self.http.get(urljoin(self.url, end_point))
         log.debug('get result list response: {}'.format(r))
         if r.status_code != 200:
             log.error('Failed to get result list for calculation {}: [{}] {}'
@@ -142,7 +254,7 @@ class OQClient(QObject):
 
     def get_result(self, result_id, params=None):
         end_point = '{}/calc/result/{}'.format(API_V, result_id)
-        r = requests.get(urljoin(self.url, end_point), params=params)
+        r = self.http.get(urljoin(self.url, end_point), params=params)
         log.debug('get result response: {}'.format(r))
         if r.status_code != 200:
             log.error('Failed to get result {}: [{}] {}'
@@ -152,8 +264,8 @@ class OQClient(QObject):
 
     def post_job(self, files, params):
         end_point = '{}/calc/run'.format(API_V)
-        r = requests.post(urljoin(self.url, end_point), files=files,
-                          params=params)
+        r = self.http.post(urljoin(self.url, end_point), files=files,
+                           params=params)
         log.debug('post job response: {}'.format(r))
         return r
 
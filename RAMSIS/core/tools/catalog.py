@@ -0,0 +1,156 @@
+# -*- encoding: utf-8 -*-
+"""
+Columnar representation of seismic catalogs
+
+Forecast models and the model clients mostly need a handful of event
+attributes as numeric arrays. Instead of walking the ORM event objects again
+for every model and every forecast, a :class:`CatalogColumns` instance is
+built once per catalog snapshot and shared.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import numpy as np
+from pymap3d import geodetic2ned
+
+from ramsis.workers.tools import catalog as worker_catalog
+
+
+class CatalogColumns(worker_catalog.CatalogColumns):
+    """
+    Contiguous float64 arrays for the event attributes of a seismic catalog
+
+    The columns of the workers (ramsis.workers.tools.catalog), extended by
+    local cartesian coordinates. These are usually not stored but computed
+    on demand for a given reference point and cached (see
+    :meth:`local_coordinates`). :meth:`from_events` takes the
+    *coordinate_cache* argument too.
+
+    :param LocalCoordinateCache coordinate_cache: cache to look up local
+        coordinates of previously converted events (optional)
+
+    """
+
+    def __init__(self, *args, coordinate_cache=None, **kwargs):
+        super(CatalogColumns, self).__init__(*args, **kwargs)
+        self.coordinate_cache = coordinate_cache
+        self._local = {}
+
+    def local_coordinates(self, ref):
+        """
+        Returns the local north, east, down coordinates of all events
+
+        Coordinates are converted in one vectorized call and cached per
+        reference point. If the columns have a coordinate cache, only events
+        that are not in the cache yet are converted.
+
+        :param dict ref: reference point with keys 'lat', 'lon' and 'h'
+        :returns: tuple of arrays (x, y, z)
+
+        """
+        key = (ref['lat'], ref['lon'], ref['h'])
+        if key not in self._local:
+            if self.coordinate_cache is not None:
+                self._local[key] = self.coordinate_cache.convert(self, key)
+            else:
+                self._local[key] = geodetic_to_local(self.lat, self.lon,
+                                                     self.depth, key)
+        return self._local[key]
+
+
+class LocalCoordinateCache:
+    """
+    Persistent cache of local event coordinates
+
+    Events are identified by their origin (time and location) since catalog
+    snapshots create new event rows for the same events. An event that is
+    relocated is therefore simply treated as a new event. Lookups are
+    vectorized (binary search on the sorted origins), so only events that
+    have not been seen before are converted.
+
+    The cache holds the events of the most recent catalog only, i.e. events
+    that disappear from the catalog are evicted. It is reset when a
+    different reference point is requested.
+
+    :ivar int hits: number of events served from the cache
+    :ivar int misses: number of events that had to be converted
+
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def __len__(self):
+        return self._keys.size
+
+    def clear(self):
+        """ Remove all cached coordinates """
+        self._ref = None
+        self._keys = _origin_keys(np.zeros((0, 4)))
+        self._local = np.zeros((0, 3))
+
+    def convert(self, columns, ref):
+        """
+        Returns the local coordinates for all events in columns
+
+        :param CatalogColumns columns: events to convert
+        :param tuple ref: reference point as (lat, lon, h)
+        :returns: tuple of arrays (x, y, z)
+
+        """
+        if ref != self._ref:
+            self.clear()
+            self._ref = ref
+        keys = _origin_keys(np.column_stack(
+            (columns.date_time, columns.lat, columns.lon, columns.depth)))
+        if self._keys.size:
+            pos = np.searchsorted(self._keys, keys)
+            pos = np.minimum(pos, self._keys.size - 1)
+            hit = self._keys[pos] == keys
+        else:
+            pos = np.zeros(len(columns), dtype=int)
+            hit = np.zeros(len(columns), dtype=bool)
+        local = np.empty((len(columns), 3))
+        local[hit] = self._local[pos[hit]]
+        miss = ~hit
+        if miss.any():
+            local[miss] = np.column_stack(geodetic_to_local(
+                columns.lat[miss], columns.lon[miss], columns.depth[miss],
+                ref))
+        # keep exactly the events of this catalog
+        self._keys, first = np.unique(keys, return_index=True)
+        self._local = local[first]
+        n_hits = int(hit.sum())
+        self.hits += n_hits
+        self.misses += len(columns) - n_hits
+        return local[:, 0], local[:, 1], local[:, 2]
+
+
+def _origin_keys(origins):
+    """
+    View each (t, lat, lon, depth) row as a single opaque value
+
+    Rows compare by their bytes, so equal origins match even if they
+    contain NaN.
+
+    """
+    origins = np.ascontiguousarray(origins, dtype=np.float64)
+    row_size = origins.dtype.itemsize * origins.shape[1]
+    return origins.view(np.dtype((np.void, row_size))).ravel()
+
+
+def geodetic_to_local(lat, lon, depth, ref):
+    """
+    Vectorized conversion of geodetic coordinates to local north, east,
+    down coordinates relative to ref (lat, lon, h)
+
+    """
+    if np.size(lat) == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty
+    x, y, z = geodetic2ned(lat, lon, depth, *ref)
+    return (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+            np.asarray(z, dtype=np.float64))
@@ -8,12 +8,17 @@ Copyright (C) 2013, ETH Zurich - Swiss Seismological Service SED
 
 import collections
 import numpy as np
-from math import log, log10, sqrt, exp
+from math import log, log10, sqrt
 from datetime import timedelta
 import bisect
 from PyQt5 import QtCore
 
+from ramsis.workers.tools.catalog import epoch_us
+
 GrParams = collections.namedtuple('GrParams', 'a b std_b')
+GR_DTYPE = np.dtype([('mc', 'f8'), ('n', 'i8'), ('a', 'f8'), ('b', 'f8'),
+                     ('std_b', 'f8')])
+RateHistoryChange = collections.namedtuple('RateHistoryChange', 'added reset')
 
 
 def estimate_gr_params(magnitudes, mc=None):
@@ -36,10 +41,263 @@ def estimate_gr_params(magnitudes, mc=None):
     m_mean = mags.mean()
     b = 1 / (log(10) * (m_mean - mc))
     a = log10(n) + b * mc
-    std_b = 2.3 * sqrt(sum((mags - m_mean) ** 2) / (n * (n - 1))) * b ** 2
+    std_b = 2.3 * sqrt(((mags - m_mean) ** 2).sum() / (n * (n - 1))) * b ** 2
     return GrParams(a, b, std_b)
 
 
+def estimate_gr_params_batch(magnitudes, mc):
+    """
+    Estimates the Gutenberg Richter parameters for many completeness
+    thresholds at once
+
+    The magnitudes are sorted once. Counts, sums and sums of squares above
+    each threshold are then read from suffix sums, so the cost is
+    O(n log n + k) for n magnitudes and k thresholds.
+
+    :param magnitudes: List or array of magnitudes
+    :param mc: Sequence of magnitudes of completeness
+    :returns: Structured array of dtype GR_DTYPE with one entry per mc.
+        Estimates with fewer than two events above mc are NaN.
+
+    """
+    mags = np.sort(np.asarray(magnitudes, dtype=float))
+    mc = np.atleast_1d(np.asarray(mc, dtype=float))
+    # Shift magnitudes to their mean to keep the variance numerically stable
+    shift = mags.mean() if mags.size else 0.0
+    x = mags - shift
+    s1 = _suffix_sum(x)
+    s2 = _suffix_sum(x * x)
+    idx = np.searchsorted(mags, mc, side='left')
+    n = mags.size - idx
+    return _gr_from_sums(mc, n, s1[..., idx], s2[..., idx], shift)
+
+
+def bootstrap_gr_params(magnitudes, mc, n_resamples, seed=None,
+                        max_elements=2 ** 22):
+    """
+    Bootstrap Gutenberg Richter parameter estimates for many completeness
+    thresholds
+
+    Resampling with replacement is expressed as multinomial weights on the
+    sorted magnitudes, so each resample only needs weighted suffix sums
+    instead of a new sort. Resamples are processed in chunks of at most
+    *max_elements* weights to bound memory.
+
+    :param magnitudes: List or array of magnitudes
+    :param mc: Magnitude of completeness or sequence thereof
+    :param int n_resamples: Number of bootstrap resamples
+    :param seed: Seed for the random number generator
+    :param int max_elements: Maximum number of resample weights held in
+        memory at once
+    :returns: Structured array of dtype GR_DTYPE and shape
+        (n_resamples, len(mc))
+
+    """
+    mags = np.sort(np.asarray(magnitudes, dtype=float))
+    mc = np.atleast_1d(np.asarray(mc, dtype=float))
+    rng = np.random.RandomState(seed)
+    result = np.empty((n_resamples, mc.size), dtype=GR_DTYPE)
+    if mags.size == 0:
+        result['mc'] = mc
+        result['n'] = 0
+        for name in ('a', 'b', 'std_b'):
+            result[name] = np.nan
+        return result
+    shift = mags.mean()
+    x = mags - shift
+    idx = np.searchsorted(mags, mc, side='left')
+    p = np.full(mags.size, 1.0 / mags.size)
+    chunk = max(1, max_elements // mags.size)
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        w = rng.multinomial(mags.size, p, size=size)
+        n = _suffix_sum(w)[:, idx]
+        s1 = _suffix_sum(w * x)[:, idx]
+        s2 = _suffix_sum(w * x * x)[:, idx]
+        result[start:start + size] = _gr_from_sums(mc, n, s1, s2, shift)
+    return result
+
+
+def _suffix_sum(a):
+    """ Sums over a[..., i:] for every i (with a trailing zero) """
+    s = np.cumsum(a[..., ::-1], axis=-1)[..., ::-1]
+    pad = np.zeros(a.shape[:-1] + (1,), dtype=s.dtype)
+    return np.concatenate((s, pad), axis=-1)
+
+
+def _gr_from_sums(mc, n, s1, s2, shift):
+    """
+    Computes GR estimates from counts and (shifted) sums of magnitudes
+    above mc. All arguments broadcast against each other.
+
+    """
+    n, mc = np.broadcast_arrays(n, mc)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = s1 / n
+        ss = np.maximum(s2 - s1 * mean_x, 0.0)
+        m_mean = mean_x + shift
+        b = 1 / (np.log(10) * (m_mean - mc))
+        a = np.log10(n) + b * mc
+        std_b = 2.3 * np.sqrt(ss / (n * (n - 1))) * b ** 2
+    invalid = (n < 2) | ~(m_mean > mc)
+    result = np.empty(n.shape, dtype=GR_DTYPE)
+    result['mc'] = mc
+    result['n'] = n
+    result['a'] = np.where(invalid, np.nan, a)
+    result['b'] = np.where(invalid, np.nan, b)
+    result['std_b'] = np.where(invalid, np.nan, std_b)
+    return result
+
+
+class GrEstimator:
+    """
+    Online Gutenberg Richter parameter estimator
+
+    Maintains the running count, mean and sum of squared deviations
+    (Welford's algorithm) of all magnitudes above each completeness
+    threshold, so events can be added and expired in O(1) per threshold and
+    the parameters are available at any time without rescanning the catalog.
+
+    If a *window* is given, events that are older than *window* with respect
+    to the most recently added event are expired automatically. In that case
+    events must be added in chronological order.
+
+    :param mc: magnitude of completeness or a sequence of completeness
+        thresholds to track simultaneously
+    :param timedelta window: length of the sliding time window (optional)
+
+    """
+
+    def __init__(self, mc, window=None):
+        self.mc = sorted(float(m) for m in np.atleast_1d(mc))
+        self.window = window
+        self._n = [0] * len(self.mc)
+        self._mean = [0.0] * len(self.mc)
+        self._m2 = [0.0] * len(self.mc)
+        self._events = collections.deque()
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, magnitude, t=None):
+        """
+        Add an event to the estimate
+
+        :param float magnitude: event magnitude
+        :param datetime t: event time, required for sliding windows
+
+        """
+        if self.window is not None:
+            if t is None:
+                raise ValueError('Sliding window estimates require t')
+            self._events.append((t, magnitude))
+            self.expire(t - self.window)
+        else:
+            self._events.append((t, magnitude))
+        for i, mc in enumerate(self.mc):
+            if magnitude < mc:
+                break
+            self._n[i] += 1
+            delta = magnitude - self._mean[i]
+            self._mean[i] += delta / self._n[i]
+            self._m2[i] += delta * (magnitude - self._mean[i])
+
+    def expire(self, t_min):
+        """ Remove all events that occurred before t_min """
+        events = self._events
+        while events and events[0][0] is not None and events[0][0] < t_min:
+            _, magnitude = events.popleft()
+            self._remove(magnitude)
+
+    def count(self, mc=None):
+        """ Number of events above mc (defaults to the lowest threshold) """
+        return self._n[self._mc_index(mc)]
+
+    def params(self, mc=None):
+        """
+        Returns the current Gutenberg Richter parameter estimates
+
+        :param mc: completeness threshold, must be one of the thresholds
+            passed on init. Defaults to the lowest threshold.
+        :returns: Gutenberg Richter parameter estimates as named tuple or None
+            if there are not enough events above mc for an estimate.
+
+        """
+        i = self._mc_index(mc)
+        mc = self.mc[i]
+        n, m_mean = self._n[i], self._mean[i]
+        if n < 2 or m_mean <= mc:
+            return None
+        b = 1 / (log(10) * (m_mean - mc))
+        a = log10(n) + b * mc
+        std_b = 2.3 * sqrt(max(self._m2[i], 0.0) / (n * (n - 1))) * b ** 2
+        return GrParams(a, b, std_b)
+
+    def _remove(self, magnitude):
+        for i, mc in enumerate(self.mc):
+            if magnitude < mc:
+                break
+            n = self._n[i] - 1
+            if n == 0:
+                self._n[i], self._mean[i], self._m2[i] = 0, 0.0, 0.0
+                continue
+            delta = magnitude - self._mean[i]
+            self._mean[i] -= delta / n
+            self._m2[i] -= delta * (magnitude - self._mean[i])
+            self._n[i] = n
+
+    def _mc_index(self, mc):
+        if mc is None:
+            return 0
+        try:
+            return self.mc.index(float(mc))
+        except ValueError:
+            raise ValueError('{} is not a tracked completeness threshold'
+                             .format(mc))
+
+
+def compute_rates(t_m, t_rates, t_bin):
+    """
+    Compute event counts, rates and probabilities for many time bins at once
+
+    Each bin spans *t_bin* backward from the respective bin end time in
+    *t_rates*. Bins are half open [t_end - t_bin, t_end) except for bins
+    ending at the last time in *t_rates*, which include their upper boundary.
+    The event times are converted to an epoch array once and all bin
+    boundaries are looked up with a single `np.searchsorted` call, so the
+    cost is O((n + k) log n) for n events and k bins.
+
+    :param t_m: sorted list of times (datetime) at which events occurred.
+        Callers that compute rates repeatedly on the same catalog should
+        pass a datetime64 array to avoid converting the event times again.
+    :param t_rates: list of bin end times (datetime)
+    :param timedelta t_bin: bin length
+    :returns: tuple of arrays (counts, rates, probabilities) with one entry
+        per bin. Rates are in events per hour.
+
+    """
+    t_events = epoch_us(t_m)
+    t_end = epoch_us(t_rates)
+    if t_end.size == 0:
+        empty = np.zeros(0)
+        return np.zeros(0, dtype=np.int64), empty, empty
+    dt = int(t_bin.total_seconds() * 1e6)
+    t_bin_h = t_bin.total_seconds() / 3600.0
+
+    # Lower boundaries are always inclusive. Upper boundaries are exclusive
+    # except for the last bin, which is why we search its end from the right
+    bounds = np.concatenate((t_end - dt, t_end))
+    idx = np.searchsorted(t_events, bounds, side='left')
+    idx_start, idx_end = idx[:t_end.size], idx[t_end.size:]
+    last = t_end == t_end[-1]
+    idx_end[last] = np.searchsorted(t_events, t_end[-1], side='right')
+
+    counts = idx_end - idx_start
+    rates = counts / t_bin_h
+    probabilities = 1 - np.exp(rates)
+    return counts, rates, probabilities
+
+
 class SeismicRate:
     def __init__(self, rate, p, t, dt):
         self.rate = rate
@@ -52,6 +310,14 @@ class SeismicRateHistory(QtCore.QObject):
     """
     Manages a history of seismic rates and computes new rates on request.
 
+    Rates are kept sorted by time. A dictionary maps each time to the
+    position of its rate, so lookups by time are O(1) and range queries on
+    the sorted times are O(log n). New rates are appended incrementally.
+
+    The *history_changed* signal carries a :class:`RateHistoryChange` with
+    only the rates that were added. *reset* is set if the history has been
+    replaced or cleared, in which case observers need to reload everything.
+
     """
 
     history_changed = QtCore.pyqtSignal(object)
@@ -65,6 +331,7 @@ class SeismicRateHistory(QtCore.QObject):
         self.t_bin = timedelta(hours=6)
         self._rates = []
         self.times = []
+        self._index = {}
 
     @property
     def rates(self):
@@ -72,21 +339,64 @@ class SeismicRateHistory(QtCore.QObject):
 
     @rates.setter
     def rates(self, value):
-        self._rates = value
-        self.times = [rate.t for rate in value]
-        self.history_changed.emit(self)
+        self._rates = sorted(value, key=lambda rate: rate.t)
+        self.times = [rate.t for rate in self._rates]
+        self._index = {}
+        self._reindex(0)
+        self.history_changed.emit(RateHistoryChange(self._rates, True))
 
     def lookup_rate(self, t):
-        if t in self.times:
-            idx = self.times.index(t)
-            return self._rates[idx]
-        else:
-            return None
+        idx = self._index.get(t)
+        return None if idx is None else self._rates[idx]
+
+    def rates_between(self, t_start, t_end):
+        """ Returns all rates with t_start <= t < t_end """
+        lo = bisect.bisect_left(self.times, t_start)
+        hi = bisect.bisect_left(self.times, t_end)
+        return self._rates[lo:hi]
+
+    def add(self, rates):
+        """
+        Add new rates to the history
+
+        Rates that are newer than the most recent rate in the history are
+        simply appended. Older rates are inserted at their position in time.
+
+        :param list[SeismicRate] rates: rates to add
+
+        """
+        for rate in rates:
+            self._add(rate)
+        self.history_changed.emit(RateHistoryChange(rates, False))
 
     def clear(self):
         self._rates = []
         self.times = []
-        self.history_changed.emit(self)
+        self._index = {}
+        self.history_changed.emit(RateHistoryChange([], True))
+
+    def _add(self, rate):
+        if not self.times or rate.t >= self.times[-1]:
+            self._index.setdefault(rate.t, len(self._rates))
+            self._rates.append(rate)
+            self.times.append(rate.t)
+        else:
+            idx = bisect.bisect_right(self.times, rate.t)
+            self._rates.insert(idx, rate)
+            self.times.insert(idx, rate.t)
+            self._reindex(idx)
+
+    def _reindex(self, start):
+        """ Rebuild the time index for all rates from position start """
+        seen = set()
+        for idx in range(start, len(self.times)):
+            t = self.times[idx]
+            if t in seen:
+                continue
+            seen.add(t)
+            # entries before start point to an earlier duplicate and are kept
+            if self._index.get(t, start) >= start:
+                self._index[t] = idx
 
     def compute_and_add(self, m, t_m, t_rates):
         """
@@ -100,28 +410,12 @@ class SeismicRateHistory(QtCore.QObject):
         :param t_m: list of time (datetime) at which m occurred
 
         """
-        m_np = np.array(m)
-
-        computed = []
-        for t_end in t_rates:
-            t_start = t_end - self.t_bin
-            t_bin_h = self.t_bin.total_seconds() / 3600.0
-
-            idx_t_start = bisect.bisect_left(t_m, t_start)
-            # ...including the upper boundary for the last bin
-            if t_end == t_rates[-1]:
-                idx_t_end = bisect.bisect_right(t_m, t_end)
-            else:
-                idx_t_end = bisect.bisect_left(t_m, t_end)
-
-            # Compute rates for all magnitude bins within this time bin
-            m_in_bin = np.array(m_np[idx_t_start:idx_t_end])
-            rate = len(m_in_bin) / t_bin_h
-            p = 1 - exp(rate)
-            computed.append(SeismicRate(rate, p, t_end, t_bin_h))
-
-        self._rates += computed
-        # Store the time and magnitude lower bin boundaries for reference
-        self.times.extend(t_rates)
-        self.history_changed.emit(self)
+        counts, rates, probabilities = compute_rates(t_m, t_rates, self.t_bin)
+        t_bin_h = self.t_bin.total_seconds() / 3600.0
+        computed = [SeismicRate(rate, p, t_end, t_bin_h)
+                    for rate, p, t_end in zip(rates.tolist(),
+                                              probabilities.tolist(),
+                                              t_rates)]
+
+        self.add(computed)
         return computed
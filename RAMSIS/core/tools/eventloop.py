@@ -0,0 +1,167 @@
+# -*- encoding: utf-8 -*-
+"""
+Helpers to keep the Qt event loop responsive
+
+* :class:`TaskRunner` runs blocking calls (e.g. HTTP requests) in a thread
+  pool and delivers the results back on the main thread.
+* :class:`StallMonitor` measures how long the main thread is blocked.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+
+log = logging.getLogger(__name__)
+
+
+class TaskRunner(QObject):
+    """
+    Runs blocking functions off the main thread
+
+    The callback receives the :class:`concurrent.futures.Future` of the
+    call and is invoked on the thread that owns the runner (i.e. the main
+    thread), so it can safely touch Qt and ORM objects. Exceptions raised
+    by the function are re-raised by ``future.result()``.
+
+    Functions must not access ORM objects since the database session is not
+    thread safe.
+
+    :param int max_workers: number of threads in the pool
+    :param bool synchronous: run functions directly on the calling thread
+        (the old, blocking behaviour, useful for debugging and testing)
+
+    """
+
+    _done = pyqtSignal(object, object)
+
+    def __init__(self, max_workers=8, synchronous=False):
+        super(TaskRunner, self).__init__()
+        self.synchronous = synchronous
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # queued, so the callback is never invoked from within submit (if
+        # the call completes before we add the done callback)
+        self._done.connect(self._on_done, Qt.QueuedConnection)
+
+    def submit(self, fn, callback, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) and pass the future to callback when done
+
+        """
+        if self.synchronous:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            callback(future)
+            return future
+        future = self._executor.submit(fn, *args, **kwargs)
+        # emitted from the pool thread, delivered on our thread
+        future.add_done_callback(lambda f: self._done.emit(f, callback))
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _on_done(self, future, callback):
+        callback(future)
+
+
+_default_runner = None
+
+
+def task_runner():
+    """ Returns the task runner shared by all clients """
+    global _default_runner
+    if _default_runner is None:
+        _default_runner = TaskRunner()
+    return _default_runner
+
+
+def configure_task_runner(settings):
+    """
+    Configure the shared runner from the application settings
+
+    :param AppSettings settings: application settings ('http/...' keys)
+
+    """
+    global _default_runner
+    if _default_runner is not None:
+        _default_runner.shutdown(wait=False)
+    _default_runner = TaskRunner(
+        max_workers=settings.value('http/max_workers'),
+        synchronous=not settings.value('http/async'))
+
+
+class StallMonitor(QObject):
+    """
+    Measures main thread stalls
+
+    A timer fires every *interval* ms on the main thread. Any delay beyond
+    the interval is time during which the event loop was blocked.
+
+    :param int interval: sampling interval [ms]
+    :param float threshold: delays above this are counted as stalls [s]
+    :param float report_interval: log a summary this often [s], 0 to
+        disable
+    :param clock: function returning the current (monotonic) time [s]
+
+    :ivar int stalls: number of stalls
+    :ivar float total_stall: accumulated stall time [s]
+    :ivar float max_stall: longest stall [s]
+
+    """
+
+    def __init__(self, interval=50, threshold=0.1, report_interval=60.0,
+                 clock=time.monotonic):
+        super(StallMonitor, self).__init__()
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self._clock = clock
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._on_timeout)
+        self.reset()
+
+    def reset(self):
+        """ Reset the statistics """
+        self.stalls = 0
+        self.total_stall = 0.0
+        self.max_stall = 0.0
+        self._t_last = self._t_report = self._clock()
+
+    def start(self):
+        self.reset()
+        self._timer.start(self.interval)
+
+    def stop(self):
+        self._timer.stop()
+
+    def sample(self):
+        """ Record the delay since the last sample """
+        now = self._clock()
+        delay = now - self._t_last - self.interval / 1000.0
+        self._t_last = now
+        if delay > self.threshold:
+            self.stalls += 1
+            self.total_stall += delay
+            self.max_stall = max(self.max_stall, delay)
+        return delay
+
+    def stats(self):
+        return {'stalls': self.stalls, 'total_stall': self.total_stall,
+                'max_stall': self.max_stall}
+
+    def _on_timeout(self):
+        self.sample()
+        now = self._clock()
+        if self.report_interval and \
+                now - self._t_report >= self.report_interval:
+            self._t_report = now
+            log.info('Main thread stalls: {stalls}, total {total_stall:.2f} '
+                     's, max {max_stall:.2f} s'.format(**self.stats()))
@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+"""
+Shared HTTP session pool for the remote clients
+
+The model and OpenQuake clients poll their workers every couple of seconds.
+Instead of opening a new connection for every request, all clients share
+a :class:`SessionPool` that keeps connections alive, limits the number of
+connections per host and retries failed requests with exponential backoff.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from collections import defaultdict
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Server errors that are retried (for idempotent requests only)
+RETRY_STATUS = (502, 503, 504)
+
+
+class SessionPool:
+    """
+    A keep-alive requests session with per host connection pools
+
+    Connection errors are retried for all requests. Read errors and the
+    server errors in RETRY_STATUS are only retried for idempotent requests
+    (GET etc.) since the worker might have accepted a POST already.
+
+    :param int pool_connections: number of hosts to keep connection pools
+        for
+    :param int pool_maxsize: max. number of connections kept per host
+    :param int retries: max. number of retries per request
+    :param float backoff_factor: retry n waits backoff_factor * 2^(n-1)
+        seconds
+
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=4, retries=3,
+                 backoff_factor=0.5):
+        self._lock = Lock()
+        self._session = None
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self.configure(pool_connections, pool_maxsize, retries,
+                       backoff_factor)
+
+    def configure(self, pool_connections=10, pool_maxsize=4, retries=3,
+                  backoff_factor=0.5):
+        """
+        (Re)configure the pool. Open connections are closed.
+
+        """
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with self._lock:
+            old, self._session = self._session, session
+            self._adapter = adapter
+        if old is not None:
+            old.close()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pool (see :meth:`requests.Session.request`)
+
+        """
+        host = urlsplit(url).netloc
+        try:
+            r = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._count(host, 'errors')
+            raise
+        retries = getattr(r.raw, 'retries', None)
+        self._count(host, 'requests')
+        if retries is not None and retries.history:
+            self._count(host, 'retries', len(retries.history))
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        Returns usage statistics per host
+
+        For each host (netloc) the dict contains the number of successful
+        *requests*, failed requests (*errors*), *retries*, the number of
+        *connections* opened so far and the number of connections currently
+        *idle* in the pool.
+
+        """
+        with self._lock:
+            stats = {host: dict(counts) for host, counts
+                     in self._counts.items()}
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                host = '{}:{}'.format(key.key_host, key.key_port)
+                if host not in stats:
+                    host = key.key_host
+                entry = stats.setdefault(host, {})
+                entry['connections'] = pool.num_connections
+                # the queue is padded with None up to pool_maxsize
+                idle = list(pool.pool.queue) if pool.pool else []
+                entry['idle'] = sum(c is not None for c in idle)
+        for entry in stats.values():
+            for name in ('requests', 'errors', 'retries', 'connections',
+                         'idle'):
+                entry.setdefault(name, 0)
+        return stats
+
+    def close(self):
+        """ Close all connections """
+        self._session.close()
+
+    def _count(self, host, name, n=1):
+        with self._lock:
+            self._counts[host][name] += n
+
+
+_default_pool = None
+
+
+def session_pool():
+    """ Returns the session pool shared by all clients """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = SessionPool()
+    return _default_pool
+
+
+def configure_session_pool(settings):
+    """
+    Configure the shared pool from the application settings
+
+    :param AppSettings settings: application settings ('http/...' keys)
+
+    """
+    session_pool().configure(
+        pool_connections=settings.value('http/pool_connections'),
+        pool_maxsize=settings.value('http/pool_maxsize'),
+        retries=settings.value('http/retries'),
+        backoff_factor=settings.value('http/backoff_factor'))
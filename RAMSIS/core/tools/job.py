@@ -3,6 +3,7 @@
 Base classes for parallel or serial execution of work work_units
 
 Jobs can be nested or, i.e. a job can act as a work_unit for another job.
+A :class:`DagJob` runs its work units in dependency order instead.
 Jobs and work units emit status_changed signals when something changes.
 All notifications must be fowarded up the job chain and carry the respective
 *Status* payload.
@@ -11,8 +12,13 @@ Copyright (c) 2017, Swiss Seismological Service, ETH Zurich
 
 """
 
+import logging
+from collections import defaultdict, deque
+
 from PyQt5.QtCore import QObject, pyqtSignal
 
+log = logging.getLogger(__name__)
+
 
 class JobStatus:
     """ 
@@ -49,6 +55,7 @@ class Job(QObject):
         super(Job, self).__init__()
         self.job_id = job_id
         self._work_units = []
+        self._unit_set = set()
 
     @property
     def work_units(self):
@@ -57,6 +64,8 @@ class Job(QObject):
     @work_units.setter
     def work_units(self, work_units):
         self._work_units = work_units
+        # for O(1) membership tests on status notifications
+        self._unit_set = set(work_units)
         for unit in work_units:
             unit.status_changed.connect(self.on_status_changed)
 
@@ -78,61 +87,299 @@ class SerialJob(Job):
     The next unit is only started when the previous unit has
     sent a *status_change* signal with finished=True. The serial jobs own
     status_changed signal is emitted after the last unit has completed.
+    Repeated finished notifications of a unit are ignored.
 
     """
 
     def __init__(self, job_id):
         super(SerialJob, self).__init__(job_id)
         self._iter = None
+        self._current = None
+        self._starter = _Starter(self._start_next)
 
     def run(self):
         self._iter = iter(self.work_units)
+        self._current = None
         self.pre_process()
-        self._run_next()
+        self._starter.request()
 
     def on_status_changed(self, status):
         super(SerialJob, self).on_status_changed(status)
-        if status.sender in self.work_units and status.finished:
-            self._run_next()
+        if status.finished and status.sender is self._current:
+            self._current = None
+            self._starter.request()
 
-    def _run_next(self):
-        try:
-            work_unit = next(self._iter)
-        except StopIteration:
+    def _start_next(self):
+        work_unit = next(self._iter, None)
+        if work_unit is None:
             self._iter = None
             self.post_process()
             self.status_changed.emit(JobStatus(self, finished=True))
-        else:
-            work_unit.run()
+            return False
+        self._current = work_unit
+        work_unit.run()
+        return True
 
 
 class ParallelJob(Job):
     """
     A job that executes its work units in parallel
 
-    All work units are started concurrently. The job's *status_changed*
-    signal is emitted with finished=True when all work units have sent their 
-    finished signal.
+    All work units are started concurrently, or at most *max_concurrent*
+    at a time if given. The job's *status_changed* signal is emitted with
+    finished=True when all work units have sent their finished signal.
+    Repeated finished notifications of a unit are ignored.
+
+    :param int max_concurrent: max. number of units running at the same
+        time (None for no limit)
 
     """
 
-    def __init__(self, job_id):
+    def __init__(self, job_id, max_concurrent=None):
         super(ParallelJob, self).__init__(job_id)
-        self._completed_units = []
+        self.max_concurrent = max_concurrent
+        self._completed_units = set()
+        self._pending = iter([])
+        self._starter = _Starter(self._start_next)
 
     def run(self):
-        self._completed_units = []
+        self._completed_units = set()
+        self._pending = iter(self.work_units)
         self.pre_process()
-        for unit in self.work_units:
-            unit.run()
+        if not self.work_units:
+            self.post_process()
+            self.status_changed.emit(JobStatus(self, finished=True))
+            return
+        self._starter.request(self.max_concurrent or len(self.work_units))
 
     def on_status_changed(self, status):
         super(ParallelJob, self).on_status_changed(status)
-        if status.sender in self.work_units and status.finished:
-            self._completed_units.append(status.sender)
-            if len(self.work_units) == len(self._completed_units):
-                self.post_process()
-                self.status_changed.emit(JobStatus(self, finished=True))
+        sender = status.sender
+        if not status.finished or sender not in self._unit_set or \
+                sender in self._completed_units:
+            return
+        self._completed_units.add(sender)
+        if len(self._completed_units) == len(self._unit_set):
+            self.post_process()
+            self.status_changed.emit(JobStatus(self, finished=True))
+        else:
+            self._starter.request()
+
+    def _start_next(self):
+        work_unit = next(self._pending, None)
+        if work_unit is None:
+            return False
+        work_unit.run()
+        return True
+
+
+class _Starter:
+    """
+    Starts work units without recursion
+
+    Units may finish synchronously within their run method, which requests
+    the next start from within the current one. Instead of recursing (which
+    fails for jobs with thousands of such units), nested requests are only
+    counted and served by the outermost call.
+
+    :param start: function that starts the next unit, returns False if
+        there are no more units
+
+    """
+
+    def __init__(self, start):
+        self._start = start
+        self._requested = 0
+        self._active = False
+
+    def request(self, n=1):
+        self._requested += n
+        if self._active:
+            return
+        self._active = True
+        try:
+            while self._requested > 0:
+                self._requested -= 1
+                if not self._start():
+                    self._requested = 0
+        finally:
+            self._active = False
+
+
+class ResourceLimiter:
+    """
+    Limits the number of concurrent users of shared resources
+
+    Resources are identified by a key (e.g. a worker url). Work units
+    :meth:`acquire` a slot before they use a resource and :meth:`release`
+    it when done. If all slots are taken, the start callback is queued and
+    invoked as soon as a slot becomes available (first come, first served).
+
+    :param int default_limit: number of slots for resources without an
+        explicit limit (None for no limit)
+
+    """
+
+    def __init__(self, default_limit=None):
+        self.default_limit = default_limit
+        self.limits = {}
+        self._active = defaultdict(int)
+        self._waiting = defaultdict(deque)
+
+    def set_limit(self, key, limit):
+        """ Set the number of slots for resource key """
+        self.limits[key] = limit
+
+    def limit(self, key):
+        return self.limits.get(key, self.default_limit)
+
+    def active(self, key):
+        """ Number of slots in use for key """
+        return self._active[key]
+
+    def waiting(self, key):
+        """ Number of callbacks waiting for a slot for key """
+        return len(self._waiting[key])
+
+    def acquire(self, key, callback):
+        """
+        Invoke callback as soon as a slot for key is available
+
+        The slot is held until :meth:`release` is called.
+
+        """
+        limit = self.limit(key)
+        if limit is None or self._active[key] < limit:
+            self._active[key] += 1
+            callback()
+        else:
+            self._waiting[key].append(callback)
+
+    def release(self, key):
+        """
+        Release a slot for key and hand it to the next waiting user
+
+        Releasing more slots than were acquired (e.g. a unit that releases
+        on error and again on finish) is ignored, so it can't raise the
+        effective limit.
+
+        """
+        if self._active[key] <= 0:
+            log.warning('Released a slot of {} that was not acquired'
+                        .format(key))
+            return
+        if self._waiting[key]:
+            callback = self._waiting[key].popleft()
+            callback()
+        else:
+            self._active[key] -= 1
+
+
+class _DagNode:
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.depends_on = []
+        self.dependents = []
+        self.remaining = 0
+        self.done = False
+
+
+class DagJob(Job):
+    """
+    A job that executes its work units in dependency order
+
+    Work units are added with :meth:`add_unit` together with the units they
+    depend on. A unit is started as soon as all units it depends on have
+    finished (successful or not), so independent chains of units overlap.
+    Units that declare a *resource* additionally wait for a slot from the
+    job's :class:`ResourceLimiter`. The job's *status_changed* signal is
+    emitted with finished=True when all work units have finished.
+
+    :param ResourceLimiter limiter: limits concurrent units per resource
+
+    """
+
+    def __init__(self, job_id, limiter=None):
+        super(DagJob, self).__init__(job_id)
+        self.limiter = limiter or ResourceLimiter()
+        self._nodes = {}
+        self._n_done = 0
+        self._finished = False
+
+    def add_unit(self, unit, depends_on=(), resource=None):
+        """
+        Add a work unit
+
+        :param WorkUnit unit: the work unit (or job)
+        :param depends_on: units that must finish before unit starts. They
+            must have been added before, which keeps the graph acyclic.
+        :param resource: key of the resource the unit uses (optional)
+
+        """
+        node = _DagNode(resource)
+        for dependency in depends_on:
+            if dependency not in self._nodes:
+                raise ValueError('Unknown dependency {}'
+                                 .format(dependency.job_id))
+            node.depends_on.append(dependency)
+            self._nodes[dependency].dependents.append(unit)
+        self._nodes[unit] = node
+        self._work_units.append(unit)
+        self._unit_set.add(unit)
+        unit.status_changed.connect(self.on_status_changed)
+
+    def dependencies(self, unit):
+        """ Returns the units that unit depends on """
+        return list(self._nodes[unit].depends_on)
+
+    def run(self):
+        for node in self._nodes.values():
+            node.remaining = len(node.depends_on)
+            node.done = False
+        self._n_done = 0
+        self._finished = False
+        self.pre_process()
+        ready = [u for u in self.work_units if not self._nodes[u].remaining]
+        for unit in ready:
+            self._start(unit)
+        self._check_finished()
+
+    def on_status_changed(self, status):
+        node = self._nodes.get(status.sender)
+        first_finish = status.finished and node is not None and not node.done
+        if first_finish:
+            # update the state first, so it's current for observers
+            node.done = True
+            self._n_done += 1
+        super(DagJob, self).on_status_changed(status)
+        if not first_finish:
+            return
+        if node.resource is not None:
+            self.limiter.release(node.resource)
+        for unit in node.dependents:
+            dependent = self._nodes[unit]
+            dependent.remaining -= 1
+            if dependent.remaining == 0:
+                self._start(unit)
+        self._check_finished()
+
+    def is_done(self, unit):
+        """ True if unit has finished """
+        return self._nodes[unit].done
+
+    def _start(self, unit):
+        resource = self._nodes[unit].resource
+        if resource is None:
+            unit.run()
+        else:
+            self.limiter.acquire(resource, unit.run)
+
+    def _check_finished(self):
+        if not self._finished and self._n_done == len(self._nodes):
+            self._finished = True
+            self.post_process()
+            self.status_changed.emit(JobStatus(self, finished=True))
 
 
 class WorkUnit(QObject):
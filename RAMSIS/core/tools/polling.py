@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+"""
+Adaptive poll scheduling for remote jobs
+
+Remote model runs take anything from milliseconds (RJ) to hours (OpenQuake).
+Instead of polling at a fixed interval, clients poll soon after starting a
+job and then back off exponentially up to a maximum interval. Random jitter
+keeps clients that started at the same time from polling in lockstep and a
+deadline limits the total time we wait for a job.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import random
+import time
+
+
+class PollSchedule:
+    """
+    Exponential backoff schedule for status polls
+
+    :param float first: interval before the first poll [s]
+    :param float factor: each interval is factor times the previous one
+    :param float max_interval: upper limit for the interval [s]
+    :param float jitter: relative random variation of each interval, e.g.
+        0.1 for +/- 10 %
+    :param float deadline: max. total time to poll [s], None for no limit
+    :param clock: function returning the current (monotonic) time [s]
+
+    """
+
+    def __init__(self, first=0.5, factor=2.0, max_interval=30.0, jitter=0.1,
+                 deadline=None, clock=time.monotonic):
+        self.first = first
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.deadline = deadline
+        self._clock = clock
+        self._random = random.Random()
+        self.start()
+
+    def start(self):
+        """ (Re)start the schedule, e.g. when a new job is submitted """
+        self.polls = 0
+        self._t_start = self._clock()
+        self._interval = self.first
+
+    @property
+    def elapsed(self):
+        """ Time since the schedule was started [s] """
+        return self._clock() - self._t_start
+
+    @property
+    def expired(self):
+        """ True if the deadline has passed """
+        return self.deadline is not None and self.elapsed >= self.deadline
+
+    def next_interval(self):
+        """
+        Returns the time to wait before the next poll [s]
+
+        The interval never extends past the deadline. Returns None if the
+        deadline has passed, i.e. the caller should give up.
+
+        """
+        if self.expired:
+            return None
+        interval = self._interval
+        self._interval = min(self._interval * self.factor, self.max_interval)
+        if self.jitter:
+            interval *= 1 + self.jitter * self._random.uniform(-1, 1)
+        if self.deadline is not None:
+            interval = min(interval, self.deadline - self.elapsed)
+        self.polls += 1
+        return interval
+
+    def next_interval_ms(self):
+        """ Same as :meth:`next_interval` in ms (for QTimer) """
+        interval = self.next_interval()
+        return None if interval is None else int(round(interval * 1000))
@@ -44,6 +44,21 @@ known_settings = {
     'engine/fc_bin_size': 6.0,
     # Rate computation interval [minutes]
     'engine/rt_interval': 1.0,
+    # Log how long the main thread is blocked (for profiling)
+    'engine/stall_monitor': False,
+    # Max. number of scenarios running their models at the same time (0 for
+    # no limit)
+    'engine/max_parallel_scenarios': 1,
+    # Max. number of concurrent model runs per worker (0 for no limit)
+    'engine/max_runs_per_worker': 4,
+    # Max. number of forecasts running at the same time (0 for no limit). A
+    # forecast starts only once the models of the running forecasts have
+    # completed, i.e. it overlaps with their hazard and risk stages. 1 runs
+    # forecasts one after the other.
+    'engine/max_forecasts': 2,
+    # What to do with forecasts that are due while the engine is busy:
+    # 'queue', 'coalesce' (keep only the latest) or 'drop' (skip them)
+    'engine/forecast_queue_policy': 'coalesce',
 
     # Lab mode settings
 
@@ -84,6 +99,21 @@ known_settings = {
     # Amount of data [minutes] to fetch
     'data_acquisition/hydws_length': 30,
 
+    # HTTP client settings (shared by all remote clients)
+
+    # Number of hosts to keep connection pools for
+    'http/pool_connections': 10,
+    # Max. number of connections kept alive per host
+    'http/pool_maxsize': 4,
+    # Max. number of retries for failed requests
+    'http/retries': 3,
+    # Retry n waits backoff_factor * 2^(n-1) seconds
+    'http/backoff_factor': 0.5,
+    # Send requests from a thread pool instead of the main thread
+    'http/async': True,
+    # Number of threads for requests
+    'http/max_workers': 8,
+
     # Worker settings
 
     # Rj server URLs
@@ -0,0 +1,10 @@
+# -*- encoding: utf-8 -*-
+"""
+Performance benchmarks
+
+The modules in this package are not unit tests. Run them as scripts from the
+RAMSIS directory, e.g. ``python -m test.benchmarks.benchrates``
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+"""
+Benchmarks the vectorized seismic rate computation against the original
+per-bin loop
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import bisect
+import timeit
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from core.tools.eqstats import compute_rates
+
+
+def loop_rates(m, t_m, t_rates, t_bin):
+    """ Reference implementation (per-bin bisection as used previously) """
+    m_np = np.array(m)
+    t_bin_h = t_bin.total_seconds() / 3600.0
+    rates = []
+    for t_end in t_rates:
+        idx_t_start = bisect.bisect_left(t_m, t_end - t_bin)
+        if t_end == t_rates[-1]:
+            idx_t_end = bisect.bisect_right(t_m, t_end)
+        else:
+            idx_t_end = bisect.bisect_left(t_m, t_end)
+        m_in_bin = np.array(m_np[idx_t_start:idx_t_end])
+        rates.append(len(m_in_bin) / t_bin_h)
+    return rates
+
+
+def make_catalog(num_events, years=2, seed=0):
+    """ Random catalog with *num_events* sorted event times """
+    rng = np.random.RandomState(seed)
+    t0 = datetime(2006, 12, 2)
+    offsets = np.sort(rng.uniform(0, years * 365 * 86400, num_events))
+    return [t0 + timedelta(seconds=s) for s in offsets.tolist()]
+
+
+def main(num_events=100000, num_bins=10000, repeat=3):
+    t_m = make_catalog(num_events)
+    m = np.random.RandomState(1).uniform(0.5, 3.5, num_events).tolist()
+    dt = (t_m[-1] - t_m[0]) / num_bins
+    t_rates = [t_m[0] + (i + 1) * dt for i in range(num_bins)]
+    t_bin = timedelta(hours=6)
+
+    expected = loop_rates(m, t_m, t_rates, t_bin)
+    _, rates, _ = compute_rates(t_m, t_rates, t_bin)
+    assert np.allclose(rates, expected)
+
+    t_loop = min(timeit.repeat(lambda: loop_rates(m, t_m, t_rates, t_bin),
+                               number=1, repeat=repeat))
+    t_vec = min(timeit.repeat(lambda: compute_rates(t_m, t_rates, t_bin),
+                              number=1, repeat=repeat))
+    # same, but with event times that have been converted beforehand
+    t_m64 = np.array(t_m, dtype='datetime64[us]')
+    t_pre = min(timeit.repeat(lambda: compute_rates(t_m64, t_rates, t_bin),
+                              number=1, repeat=repeat))
+    print('{} events, {} bins'.format(num_events, num_bins))
+    print('loop:                 {:8.4f} s'.format(t_loop))
+    print('vectorized:           {:8.4f} s ({:.1f}x)'
+          .format(t_vec, t_loop / t_vec))
+    print('vectorized (cached):  {:8.4f} s ({:.1f}x)'
+          .format(t_pre, t_loop / t_pre))
+
+
+if __name__ == '__main__':
+    main(num_bins=1000)
+    main(num_bins=100000)
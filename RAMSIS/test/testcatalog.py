@@ -0,0 +1,118 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the columnar catalog representation
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from core.tools.catalog import (CatalogColumns, LocalCoordinateCache,
+                                geodetic_to_local)
+from ramsis.workers.tools import catalog as worker_catalog
+
+Event = namedtuple('Event', 'date_time lat lon depth magnitude')
+
+
+class CatalogColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        t0 = datetime(2006, 12, 2, 18)
+        self.events = [Event(t0 + timedelta(hours=i), 47.58 + i * 0.001,
+                             7.58, 4000.0 + i, 0.5 + i)
+                       for i in range(5)]
+        self.ref = {'lat': 47.58, 'lon': 7.58, 'h': 0}
+
+    def test_from_events(self):
+        """ Columns hold the event attributes in order """
+        columns = CatalogColumns.from_events(self.events)
+        self.assertEqual(len(columns), 5)
+        self.assertEqual(columns.magnitude.tolist(),
+                         [e.magnitude for e in self.events])
+        t = self.events[0].date_time + timedelta(hours=2)
+        self.assertEqual(columns.hours_before(t).tolist(),
+                         [2.0, 1.0, 0.0, -1.0, -2.0])
+        self.assertEqual(len(CatalogColumns.from_events(None)), 0)
+
+    def test_worker_columns(self):
+        """ Client and worker columns are built the same way """
+        WorkerColumns = worker_catalog.CatalogColumns
+        self.assertEqual(CatalogColumns.fields, WorkerColumns.fields)
+        client = CatalogColumns.from_events(self.events)
+        worker = WorkerColumns.from_events(self.events)
+        for name in CatalogColumns.fields:
+            self.assertEqual(np.asarray(getattr(client, name)).tolist(),
+                             np.asarray(getattr(worker, name)).tolist())
+        columns = WorkerColumns(*(getattr(client, name) for name
+                                  in CatalogColumns.fields))
+        self.assertEqual(columns.date_time.tolist(),
+                         client.date_time.tolist())
+        self.assertIsNone(columns.x)
+        self.assertIsInstance(client, WorkerColumns)
+        self.assertIsNone(client.coordinate_cache)
+
+    def test_epoch(self):
+        """ Seconds and microseconds use the same (UTC) epoch """
+        times = [e.date_time for e in self.events]
+        seconds = [worker_catalog.epoch_seconds(t) for t in times]
+        us = worker_catalog.epoch_us(times)
+        self.assertEqual((us // 10 ** 6).tolist(), seconds)
+        np.testing.assert_array_equal(
+            worker_catalog.epoch_us(np.array(times, dtype='datetime64[us]')),
+            us)
+        aware = [t.replace(tzinfo=timezone.utc) for t in times]
+        np.testing.assert_array_equal(worker_catalog.epoch_us(aware), us)
+
+    def test_coordinate_cache(self):
+        """ Only events that are not cached yet get converted """
+        cache = LocalCoordinateCache()
+        first = CatalogColumns.from_events(self.events[:3],
+                                           coordinate_cache=cache)
+        first.local_coordinates(self.ref)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        second = CatalogColumns.from_events(self.events,
+                                            coordinate_cache=cache)
+        x, y, z = second.local_coordinates(self.ref)
+        self.assertEqual((cache.hits, cache.misses), (3, 5))
+        expected = geodetic_to_local(second.lat, second.lon, second.depth,
+                                     (47.58, 7.58, 0))
+        for actual, e in zip((x, y, z), expected):
+            self.assertTrue(np.allclose(actual, e))
+
+        # a different reference point invalidates the cache
+        second = CatalogColumns.from_events(self.events,
+                                            coordinate_cache=cache)
+        second.local_coordinates({'lat': 47.0, 'lon': 7.0, 'h': 0})
+        self.assertEqual(cache.misses, 10)
+
+    def test_coordinate_cache_duplicates(self):
+        """ Events with equal times or NaN coordinates are cached once """
+        t0 = self.events[0].date_time
+        events = self.events + [Event(t0, 47.59, 7.59, 3000.0, 1.0),
+                                Event(t0, 47.59, 7.59, 3000.0, 1.0),
+                                Event(t0, float('nan'), 7.58, 4000.0, 1.0)]
+        cache = LocalCoordinateCache()
+        for _ in range(3):
+            columns = CatalogColumns.from_events(events,
+                                                 coordinate_cache=cache)
+            x, y, z = columns.local_coordinates(self.ref)
+            self.assertEqual(len(cache), 7)
+        self.assertEqual(cache.misses, 8)
+        self.assertEqual(cache.hits, 16)
+        self.assertEqual(x[5], x[6])
+
+        # events that are no longer in the catalog are evicted
+        columns = CatalogColumns.from_events(self.events[:2],
+                                             coordinate_cache=cache)
+        columns.local_coordinates(self.ref)
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
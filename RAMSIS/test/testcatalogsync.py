@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for catalog delta uploads (client session and worker cache)
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from core.engine.catalogsync import CatalogSession
+from core.tools.catalog import CatalogColumns
+from ramsis.workers.tools import catalog as worker_catalog
+from ramsis.workers.tools.catalogcache import CatalogCache, VersionMismatch
+
+Event = namedtuple('Event', 'date_time lat lon depth magnitude')
+
+T0 = datetime(2006, 12, 2, 18)
+
+
+def make_events(indices):
+    return [Event(T0 + timedelta(hours=i), 47.58, 7.58, 4000.0 + i,
+                  0.5 + i * 0.1) for i in indices]
+
+
+def upload(delta, events):
+    """ The events the client sends for delta (as the worker sees them) """
+    columns = worker_catalog.CatalogColumns.from_events(events)
+    if delta.full:
+        return columns
+    mask = delta.added
+    return worker_catalog.CatalogColumns(
+        **{name: getattr(columns, name)[mask]
+           for name in ('date_time', 'lat', 'lon', 'depth', 'magnitude')})
+
+
+class CatalogSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = CatalogSession('client/1')
+        self.cache = CatalogCache()
+
+    def sync(self, events):
+        """ Upload events like the client does, returns the worker catalog """
+        delta = self.session.delta(CatalogColumns.from_events(events))
+        catalog = self.cache.apply(delta.sync, upload(delta, events))
+        self.session.commit(delta)
+        return delta, catalog
+
+    def test_full_upload(self):
+        events = make_events(range(5))
+        delta, catalog = self.sync(events)
+        self.assertTrue(delta.full)
+        self.assertIsNone(delta.sync['base_version'])
+        self.assertEqual(catalog.magnitude.tolist(),
+                         [e.magnitude for e in events])
+        self.assertEqual(self.session.version, delta.sync['version'])
+
+    def test_delta(self):
+        """ Test if added and removed events are applied on the worker """
+        self.sync(make_events(range(5)))
+        events = make_events([1, 2, 4, 5, 6])
+        delta, catalog = self.sync(events)
+        self.assertFalse(delta.full)
+        self.assertEqual(delta.added.tolist(),
+                         [False, False, False, True, True])
+        self.assertEqual(len(delta.sync['removed']), 2)
+        expected = CatalogColumns.from_events(events)
+        self.assertEqual(catalog.date_time.tolist(),
+                         expected.date_time.tolist())
+        self.assertEqual(catalog.magnitude.tolist(),
+                         expected.magnitude.tolist())
+        # the version only depends on the catalog content
+        self.assertEqual(delta.sync['version'],
+                         CatalogSession('other').delta(expected)
+                         .sync['version'])
+
+    def test_version_mismatch(self):
+        """ Test if a delta on an unknown base version is rejected """
+        self.sync(make_events(range(5)))
+        events = make_events(range(6))
+        delta = self.session.delta(CatalogColumns.from_events(events))
+        with self.assertRaises(VersionMismatch):
+            CatalogCache().apply(delta.sync, upload(delta, events))
+        self.session.reset()
+        delta, catalog = self.sync(events)
+        self.assertTrue(delta.full)
+        self.assertEqual(len(catalog), 6)
+
+    def test_current_version(self):
+        """ Test if an upload of the version the worker holds is skipped """
+        events = make_events(range(5))
+        _, first = self.sync(events)
+        delta, second = self.sync(events)
+        self.assertFalse(delta.added.any())
+        self.assertIs(second, first)
+        # also if the client's base version is outdated
+        delta.sync['base_version'] = 'outdated'
+        self.assertIs(self.cache.apply(delta.sync, upload(delta, events)),
+                      first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the engine's forecast concurrency settings
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from mock import MagicMock
+
+from core.engine.engine import Engine
+from core.engine import forecastjob
+from ramsissettings import known_settings
+
+
+class Settings:
+
+    def __init__(self, **values):
+        self.values = dict(known_settings, **values)
+
+    def value(self, key):
+        return self.values[key]
+
+
+class EngineTest(unittest.TestCase):
+
+    def tearDown(self):
+        forecastjob.endpoint_limiter.default_limit = None
+
+    def test_defaults(self):
+        """ Test if the shipped settings match the engine defaults """
+        engine = Engine(MagicMock())
+        configured = Engine(MagicMock(), Settings())
+        self.assertEqual(configured.max_forecasts, engine.max_forecasts)
+        self.assertEqual(configured.queue.policy, engine.queue.policy)
+
+    def test_overlap(self):
+        """ Test if a forecast starts during the hazard stage by default """
+        engine = Engine(MagicMock(), Settings())
+        engine._forecast_jobs = [MagicMock(models_done=False)]
+        self.assertFalse(engine._can_start())
+        # forecasts due while the models run wait instead of being skipped
+        self.assertEqual(engine.queue.put('a', 0, busy=True), [])
+        self.assertEqual(engine.queue.put('b', 1, busy=True), ['a'])
+        engine._forecast_jobs[0].models_done = True
+        self.assertTrue(engine._can_start())
+
+    def test_no_limit(self):
+        """ Test if 0 or None allow any number of forecasts """
+        for limit in (0, None):
+            engine = Engine(MagicMock(),
+                            Settings(**{'engine/max_forecasts': limit}))
+            engine._forecast_jobs = [MagicMock(models_done=True)
+                                     for _ in range(5)]
+            self.assertTrue(engine._can_start())
+            engine._forecast_jobs[0].models_done = False
+            self.assertFalse(engine._can_start())
+
+    def test_limit(self):
+        engine = Engine(MagicMock(), Settings(**{'engine/max_forecasts': 2}))
+        engine._forecast_jobs = [MagicMock(models_done=True)]
+        self.assertTrue(engine._can_start())
+        engine._forecast_jobs.append(MagicMock(models_done=True))
+        self.assertFalse(engine._can_start())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for parameter ensembles
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from core.engine.ensemble import (parameter_sets, batches, summarize,
+                                  sample_parameters)
+
+
+class EnsembleTest(unittest.TestCase):
+
+    def test_grid(self):
+        """ Test if a grid expands to all combinations """
+        config = {'grid': {'a': [1, 2], 'p': [3, 4, 5]}}
+        sets = parameter_sets(config, base={'a': 0, 'c': 6})
+        self.assertEqual(len(sets), 6)
+        self.assertEqual(sets[0], {'a': 1, 'p': 3, 'c': 6})
+        self.assertEqual(sets[-1], {'a': 2, 'p': 5, 'c': 6})
+
+    def test_samples(self):
+        """ Test if seeded samples are reproducible and within bounds """
+        config = {'samples': 20, 'seed': 1,
+                  'distributions': {'p': ['uniform', 1.0, 1.2]}}
+        sets = parameter_sets(config, base={'c': 0.1})
+        self.assertEqual(sets, parameter_sets(config, base={'c': 0.1}))
+        self.assertEqual(len(sets), 20)
+        self.assertTrue(all(1.0 <= s['p'] <= 1.2 for s in sets))
+        self.assertTrue(all(s['c'] == 0.1 for s in sets))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parameter_sets({})
+        with self.assertRaises(ValueError):
+            sample_parameters({'p': ['cauchy', 0, 1]}, 10)
+
+    def test_batches(self):
+        self.assertEqual(batches(list(range(5)), 2), [[0, 1], [2, 3], [4]])
+
+    def test_summarize(self):
+        """ Test if failed runs are excluded from the summary """
+        results = [(1.0, 1.0, 0.1), None, (2.0, 1.0, 0.2), (3.0, 1.0, 0.3)]
+        summary = summarize(results, quantiles=(0.0, 0.5, 1.0))
+        self.assertEqual(summary['n'], 3)
+        self.assertEqual(summary['failed'], 1)
+        self.assertAlmostEqual(summary['mean'][0], 2.0)
+        self.assertEqual(summary['quantiles'],
+                         {'0': 1.0, '0.5': 2.0, '1': 3.0})
+        self.assertIsNone(summarize([None, None]))
+
+
+if __name__ == '__main__':
+    unittest.main()
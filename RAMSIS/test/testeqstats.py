@@ -10,7 +10,10 @@ Copyright (C) 2013, ETH Zurich - Swiss Seismological Service SED
 
 import unittest
 from datetime import datetime, timedelta
-from core.tools.eqstats import SeismicRateHistory
+from core.tools.eqstats import (SeismicRateHistory, SeismicRate,
+                                GrEstimator, compute_rates,
+                                estimate_gr_params, estimate_gr_params_batch,
+                                bootstrap_gr_params)
 
 
 class RateComputationTest(unittest.TestCase):
@@ -83,6 +86,136 @@ class RateComputationTest(unittest.TestCase):
         self.assertEqual(rate_history.rates, [])
         self.assertEqual(rate_history.times, [])
 
+    def test_incremental_add(self):
+        """ Test appending and inserting rates and the change payload """
+        rate_history = SeismicRateHistory()
+        changes = []
+        rate_history.history_changed.connect(changes.append)
+        t0 = datetime(2013, 11, 27, 9)
+        dt = timedelta(hours=1)
+        rates = [SeismicRate(i, 0, t0 + i * dt, 1.0) for i in range(4)]
+        rate_history.add([rates[0], rates[2]])
+        rate_history.add([rates[3], rates[1]])
+
+        self.assertEqual(rate_history.times, [r.t for r in rates])
+        for r in rates:
+            self.assertIs(rate_history.lookup_rate(r.t), r)
+        self.assertIsNone(rate_history.lookup_rate(t0 - dt))
+        self.assertEqual(rate_history.rates_between(rates[1].t, rates[3].t),
+                         rates[1:3])
+        self.assertEqual(changes[-1].added, [rates[3], rates[1]])
+        self.assertFalse(changes[-1].reset)
+
+
+class VectorizedRateTest(unittest.TestCase):
+    """ Tests the vectorized multi-bin rate computation """
+
+    def setUp(self):
+        start = datetime(2013, 11, 27, 9, 15)
+        dt = timedelta(hours=1)
+        self.times = [start + i * dt for i in range(5)]
+
+    def test_counts(self):
+        """ Bins are half open except for the last one """
+        start = datetime(2013, 11, 27, 9)
+        dt = timedelta(hours=1)
+        t_range = [start + i * dt for i in range(1, 6)]
+        counts, rates, _ = compute_rates(self.times, t_range, dt)
+        self.assertEqual(counts.tolist(), [1, 1, 1, 1, 1])
+        self.assertEqual(rates.tolist(), [1.0] * 5)
+
+        # the upper boundary of the last bin is inclusive
+        t_range = [self.times[-2], self.times[-1]]
+        counts, _, _ = compute_rates(self.times, t_range, dt)
+        self.assertEqual(counts.tolist(), [1, 2])
+
+    def test_no_bins(self):
+        """ An empty list of bins yields empty results """
+        counts, rates, probabilities = compute_rates(self.times, [],
+                                                     timedelta(hours=1))
+        self.assertEqual(counts.size, 0)
+        self.assertEqual(rates.size, 0)
+        self.assertEqual(probabilities.size, 0)
+
+
+class GrEstimatorTest(unittest.TestCase):
+    """ Tests the online Gutenberg Richter estimator """
+
+    def setUp(self):
+        start = datetime(2013, 11, 27, 9)
+        self.magnitudes = [1.2, 0.9, 2.3, 1.0, 1.7, 0.95, 3.1, 1.4]
+        self.times = [start + timedelta(hours=i)
+                      for i in range(len(self.magnitudes))]
+
+    def assertParamsAlmostEqual(self, actual, expected):
+        for a, e in zip(actual, expected):
+            self.assertAlmostEqual(a, e)
+
+    def test_matches_batch_estimate(self):
+        """ Online estimates match the batch estimate for each mc """
+        estimator = GrEstimator([0.9, 1.1])
+        for m, t in zip(self.magnitudes, self.times):
+            estimator.add(m, t)
+        for mc in (0.9, 1.1):
+            self.assertParamsAlmostEqual(
+                estimator.params(mc),
+                estimate_gr_params(self.magnitudes, mc=mc))
+        self.assertEqual(estimator.count(1.1), 5)
+
+    def test_sliding_window(self):
+        """ Expired events no longer contribute to the estimate """
+        estimator = GrEstimator(0.9, window=timedelta(hours=4))
+        for m, t in zip(self.magnitudes, self.times):
+            estimator.add(m, t)
+        # events within [t_last - 4h, t_last] remain
+        self.assertEqual(len(estimator), 5)
+        self.assertParamsAlmostEqual(
+            estimator.params(),
+            estimate_gr_params(self.magnitudes[-5:], mc=0.9))
+
+    def test_insufficient_data(self):
+        """ No estimate without at least two events """
+        estimator = GrEstimator(0.9)
+        self.assertIsNone(estimator.params())
+        estimator.add(1.5)
+        self.assertIsNone(estimator.params())
+        with self.assertRaises(ValueError):
+            estimator.params(2.0)
+
+
+class BatchGrEstimateTest(unittest.TestCase):
+    """ Tests batched and bootstrapped Gutenberg Richter estimates """
+
+    def setUp(self):
+        self.magnitudes = [1.2, 0.9, 2.3, 1.0, 1.7, 0.95, 3.1, 1.4]
+
+    def test_batch_matches_single(self):
+        """ Batched estimates match one estimate_gr_params call per mc """
+        mcs = [0.9, 1.0, 1.3]
+        result = estimate_gr_params_batch(self.magnitudes, mcs)
+        self.assertEqual(result.shape, (3,))
+        for row, mc in zip(result, mcs):
+            expected = estimate_gr_params(self.magnitudes, mc=mc)
+            self.assertAlmostEqual(row['a'], expected.a)
+            self.assertAlmostEqual(row['b'], expected.b)
+            self.assertAlmostEqual(row['std_b'], expected.std_b)
+
+    def test_batch_insufficient_data(self):
+        """ Thresholds with less than two events yield NaN """
+        result = estimate_gr_params_batch(self.magnitudes, [3.0, 4.0])
+        self.assertEqual(result['n'].tolist(), [1, 0])
+        self.assertTrue(all(b != b for b in result['b']))
+
+    def test_bootstrap(self):
+        """ Bootstrap returns one estimate per resample and mc """
+        result = bootstrap_gr_params(self.magnitudes, [0.9, 1.0], 50,
+                                     seed=42, max_elements=64)
+        self.assertEqual(result.shape, (50, 2))
+        self.assertTrue((result['n'][:, 0] == len(self.magnitudes)).all())
+        again = bootstrap_gr_params(self.magnitudes, [0.9, 1.0], 50,
+                                    seed=42, max_elements=64)
+        self.assertEqual(result['b'].tolist(), again['b'].tolist())
+
 
 if __name__ == '__main__':
     unittest.main()
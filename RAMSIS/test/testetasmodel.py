@@ -0,0 +1,76 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the rates of the ETAS worker
+
+The Omori-Utsu kernel itself is tested in testomori.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+import numpy as np
+
+from ramsis.workers.etas.model.etas import etas_rates
+from ramsis.workers.tools.injection import InjectionHistory
+from ramsis.workers.tools.omori import omori_rates
+
+from .testinjection import reference_volume
+
+
+class EtasRatesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.event_times = np.sort(rng.uniform(0, 48 * 3600.0, 25))
+        self.magnitudes = rng.uniform(0.5, 3.0, 25)
+        self.forecast_times = np.arange(0, 60 * 3600.0, 3 * 3600.0)
+        self.bin_sizes = rng.uniform(1.0, 12.0, self.forecast_times.size)
+        self.injection = InjectionHistory(
+            np.sort(rng.uniform(-12 * 3600.0, 50 * 3600.0, 30)),
+            rng.uniform(0, 40, 30))
+        self.params = dict(alpha=0.8, k=0.02, p=1.2, c=0.05, mu=0.01,
+                           cf=1e-3, m_min=0.5, m_max=4.0)
+
+    def aftershock_rates(self):
+        """ Kernel rates with the ETAS magnitude weights """
+        p = self.params
+        m = self.magnitudes
+        m_low = 10 ** p['alpha'] * (m - p['m_min'])
+        m_high = 10 ** p['alpha'] * (m - p['m_max'])
+        weights = p['k'] * (m_low - m_high)
+        return omori_rates(self.event_times, weights, self.forecast_times,
+                           self.bin_sizes, p['p'], p['c'])
+
+    def test_background(self):
+        """ Test if the background rate mu is added to each window """
+        rates, probabilities = etas_rates(
+            self.event_times, self.magnitudes, self.forecast_times,
+            self.bin_sizes, **self.params)
+        np.testing.assert_allclose(rates,
+                                   self.aftershock_rates() + 0.01)
+        np.testing.assert_allclose(probabilities, 1 - np.exp(-rates))
+
+    def test_injection(self):
+        """ Test if the injected volume of each window is scaled by cf """
+        rates, _ = etas_rates(self.event_times, self.magnitudes,
+                              self.forecast_times, self.bin_sizes,
+                              injection=self.injection, **self.params)
+        volumes = [reference_volume(self.injection.times,
+                                    self.injection.flows, t,
+                                    t + bin_size * 3600.0)
+                   for t, bin_size in zip(self.forecast_times,
+                                          self.bin_sizes)]
+        np.testing.assert_allclose(
+            rates, self.aftershock_rates() + 0.01 + 1e-3 * np.array(volumes),
+            rtol=1e-10)
+
+    def test_no_events(self):
+        rates, _ = etas_rates([], [], [0.0, 3600.0], 6.0, 0.8, 0.02, 1.2,
+                              0.05, 0.01, 1e-3, 0.5, 4.0)
+        self.assertEqual(rates.tolist(), [0.01, 0.01])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the event loop helpers
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import threading
+import unittest
+
+from PyQt5.QtCore import QCoreApplication, QEventLoop, QTimer
+
+from core.tools.eventloop import StallMonitor, TaskRunner
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+class TaskRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = TaskRunner(max_workers=2)
+        self.loop = QEventLoop()
+        self.results = []
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def _callback(self, future):
+        self.results.append((threading.current_thread(), future))
+        self.loop.quit()
+
+    def _run_loop(self):
+        QTimer.singleShot(5000, self.loop.quit)  # safety net
+        self.loop.exec_()
+
+    def test_result_on_main_thread(self):
+        """ Test if results are delivered on the main thread """
+        worker_threads = []
+
+        def work(x):
+            worker_threads.append(threading.current_thread())
+            return 2 * x
+
+        self.runner.submit(work, self._callback, 21)
+        self._run_loop()
+        thread, future = self.results[0]
+        self.assertEqual(future.result(), 42)
+        self.assertIs(thread, threading.main_thread())
+        self.assertIsNot(worker_threads[0], threading.main_thread())
+
+    def test_exception(self):
+        """ Test if exceptions are passed to the callback """
+        def work():
+            raise ValueError('failed')
+
+        self.runner.submit(work, self._callback)
+        self._run_loop()
+        with self.assertRaises(ValueError):
+            self.results[0][1].result()
+
+    def test_synchronous(self):
+        """ Test if the synchronous mode runs on the calling thread """
+        runner = TaskRunner(synchronous=True)
+        runner.submit(lambda: 1, self._callback)
+        thread, future = self.results[0]
+        self.assertEqual(future.result(), 1)
+        self.assertIs(thread, threading.main_thread())
+
+
+class StallMonitorTest(unittest.TestCase):
+
+    def test_stalls(self):
+        """ Test if delays beyond the interval are counted as stalls """
+        now = [0.0]
+        monitor = StallMonitor(interval=100, threshold=0.05,
+                               clock=lambda: now[0])
+        for dt in (0.1, 0.12, 0.6, 0.1, 1.1):
+            now[0] += dt
+            monitor.sample()
+        stats = monitor.stats()
+        self.assertEqual(stats['stalls'], 2)
+        self.assertAlmostEqual(stats['total_stall'], 1.5)
+        self.assertAlmostEqual(stats['max_stall'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for remote work units and ensemble forecasts
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from mock import MagicMock
+
+from core.engine import forecastjob
+from core.engine.forecastjob import EnsembleForecast, RemoteWorkUnit
+from core.tools.job import JobStatus
+
+
+class DummyRemoteUnit(RemoteWorkUnit):
+
+    def __init__(self, job_id, log):
+        super(DummyRemoteUnit, self).__init__(job_id, 'http://worker')
+        self.log = log
+        self.status_changed.connect(self.on_status)
+
+    def start(self):
+        self.log.append(('start', self.job_id))
+
+    def on_status(self, status):
+        if status.finished:
+            self.log.append(('finished', self.job_id))
+
+    def finish(self):
+        self.emit_status(JobStatus(self, finished=True))
+
+
+class RemoteWorkUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        forecastjob.endpoint_limiter.set_limit('http://worker', 1)
+
+    def tearDown(self):
+        del forecastjob.endpoint_limiter.limits['http://worker']
+
+    def test_slot_order(self):
+        """ Test if the next unit starts after the finished status """
+        log = []
+        a = DummyRemoteUnit('a', log)
+        b = DummyRemoteUnit('b', log)
+        a.run()
+        b.run()
+        self.assertEqual(log, [('start', 'a')])
+        a.finish()
+        a.finish()  # the slot is only released once
+        self.assertEqual(log, [('start', 'a'), ('finished', 'a'),
+                               ('start', 'b'), ('finished', 'a')])
+        b.finish()
+        self.assertEqual(
+            forecastjob.endpoint_limiter.active('http://worker'), 0)
+
+
+class EnsembleForecastTest(unittest.TestCase):
+
+    def setUp(self):
+        config = {'url': 'http://worker', 'parameters': {'a': 0},
+                  'ensemble': {'grid': {'a': [1, 2, 3, 4]}, 'batch_size': 1,
+                               'max_concurrent': 3}}
+        self.job = EnsembleForecast(MagicMock(), 'rj', config)
+        self.started = []
+        for member in self.job.work_units:
+            member.start = lambda m=member: self.started.append(m)
+
+    def running(self, member, job_id=None):
+        if job_id is not None:
+            member.client.result_url = member.client.url + '/' + job_id
+        member.emit_status(JobStatus(member))
+
+    def test_single_result_worker(self):
+        """ Test if batches run one by one on workers without job ids """
+        self.job.run()
+        first = self.job.work_units[0]
+        self.assertEqual(self.started, [first])
+        self.running(first)
+        self.assertEqual(len(self.started), 1)
+        first.emit_status(JobStatus(first, finished=True))
+        self.assertEqual(len(self.started), 2)
+
+    def test_job_worker(self):
+        """ Test if batches run concurrently once the worker sent a job id """
+        self.job.run()
+        self.running(self.job.work_units[0], 'job0')
+        self.assertEqual(self.started, self.job.work_units[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
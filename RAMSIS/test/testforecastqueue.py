@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the forecast queue
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from core.engine.forecastqueue import ForecastQueue
+
+
+class ForecastQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+
+    def _queue(self, policy):
+        return ForecastQueue(policy, clock=lambda: self.now)
+
+    def test_queue(self):
+        """ Test if the queue policy keeps all forecasts in order """
+        queue = self._queue('queue')
+        for i in range(3):
+            self.assertEqual(queue.put('f{}'.format(i), i, busy=True), [])
+        self.assertEqual(len(queue), 3)
+        self.now = 5.0
+        self.assertEqual(queue.pop(), ('f0', 0))
+        self.assertEqual(queue.metrics()['max_depth'], 3)
+        self.assertEqual(queue.metrics()['last_lag'], 5.0)
+
+    def test_coalesce(self):
+        """ Test if only the latest waiting forecast is kept """
+        queue = self._queue('coalesce')
+        queue.put('f0', 0, busy=True)
+        self.assertEqual(queue.put('f1', 1, busy=True), ['f0'])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.pop(), ('f1', 1))
+        self.assertEqual(queue.metrics()['skipped'], 1)
+
+    def test_drop(self):
+        """ Test if forecasts are skipped while busy """
+        queue = self._queue('drop')
+        self.assertEqual(queue.put('f0', 0, busy=True), ['f0'])
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.put('f1', 1, busy=False), [])
+        self.assertEqual(queue.pop(), ('f1', 1))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ForecastQueue('lifo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the worker host endpoints
+
+The host serves a dummy model that runs in a thread, so the tests can
+block its runs.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import threading
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from mock import MagicMock, patch
+
+from ramsis.workers.host import ModelPlugin, WorkerHost
+from ramsis.workers.ollinger.plugin import OllingerPlugin
+from ramsis.workers.shapiro.plugin import ShapiroPlugin
+from ramsis.workers.tools.catalog import CatalogColumns
+from ramsis.workers.tools.resultcache import ResultCache
+
+
+class DummyPlugin(ModelPlugin):
+
+    name = 'dummy'
+    executor = 'thread'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+
+    def prepare(self, forecast, catalog, data):
+        if data.get('invalid'):
+            raise ValueError('invalid input')
+        return self.release
+
+    @staticmethod
+    def run(args, parameters):
+        args.wait(timeout=5)
+        return parameters['rate'], 1.0, 0.5
+
+
+class CachedPlugin(ModelPlugin):
+
+    name = 'cached'
+    executor = 'thread'
+    deterministic = True
+    runs = []
+
+    def prepare(self, forecast, catalog, data):
+        return data['input']
+
+    @staticmethod
+    def run(args, parameters):
+        CachedPlugin.runs.append(args)
+        return args, parameters['rate'], 0.5
+
+
+class WorkerHostTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('ramsis.workers.host.ForecastSchema')
+        patcher.start().return_value.load.return_value = MagicMock()
+        self.addCleanup(patcher.stop)
+        self.plugin = DummyPlugin()
+        self.host = WorkerHost([self.plugin], max_pending=1)
+        self.client = self.host.create_app().test_client()
+
+    def tearDown(self):
+        self.plugin.release.set()
+        self.host.shutdown()
+
+    def post(self, url='/dummy/run', **data):
+        body = dict({'forecast': {}, 'parameters': {'rate': 2.0}}, **data)
+        return self.client.post(url, json=body)
+
+    def test_run(self):
+        """ Test a run and fetching its result """
+        response = self.post()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        response = self.client.get('/dummy/run/{}?wait=5'.format(job_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {'status': 'complete',
+                          'result': {'rate_prediction': [2.0, 1.0, 0.5]}})
+        # the most recent run, also without the model prefix
+        for url in ('/dummy/run', '/run'):
+            response = self.client.get(url)
+            self.assertEqual(response.get_json()['status'], 'complete')
+
+    def test_running(self):
+        self.plugin.release.clear()
+        job_id = self.post().get_json()['job_id']
+        response = self.client.get('/dummy/run/{}'.format(job_id))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json(), {'status': 'running'})
+
+    def test_unknown(self):
+        """ Test if unknown models and jobs are not found """
+        self.assertEqual(self.post('/other/run').status_code, 404)
+        self.assertEqual(self.client.get('/other/run').status_code, 404)
+        self.assertEqual(self.client.get('/other/run/1').status_code, 404)
+        self.assertEqual(self.client.get('/dummy/run/1').status_code, 404)
+        self.assertEqual(self.client.get('/dummy/run').status_code, 204)
+
+    def test_invalid(self):
+        self.assertEqual(self.post(invalid=True).status_code, 400)
+
+    def test_queue_full(self):
+        """ Test if runs are rejected while the queue is full """
+        self.plugin.release.clear()
+        self.assertEqual(self.post().status_code, 202)
+        self.assertEqual(self.post().status_code, 503)
+
+    def test_broken_executor(self):
+        queue = self.host.queues['thread']
+        executor = queue.executor
+        queue.executor = MagicMock()
+        queue.executor.submit.side_effect = BrokenProcessPool()
+        try:
+            self.assertEqual(self.post().status_code, 503)
+        finally:
+            queue.executor = executor
+
+    def test_metrics(self):
+        """ Test the job counts of the metrics """
+        self.plugin.release.clear()
+        job_id = self.post().get_json()['job_id']
+        self.post()
+        metrics = self.client.get('/metrics').get_json()
+        self.assertEqual(metrics['models']['dummy'],
+                         {'submitted': 1, 'rejected': 1, 'running': 1})
+        self.assertEqual(metrics['queues']['thread'],
+                         {'pending': 1, 'max_pending': 1})
+        self.plugin.release.set()
+        self.client.get('/dummy/run/{}?wait=5'.format(job_id))
+        self.host.queues['thread'].executor.shutdown()
+        metrics = self.client.get('/metrics').get_json()
+        self.assertEqual(metrics['models']['dummy'],
+                         {'submitted': 1, 'rejected': 1, 'completed': 1,
+                          'running': 0})
+        self.assertEqual(self.client.get('/health').get_json(),
+                         {'status': 'ok', 'models': ['dummy']})
+
+
+class CachedRunTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('ramsis.workers.host.ForecastSchema')
+        patcher.start().return_value.load.return_value = MagicMock()
+        self.addCleanup(patcher.stop)
+        CachedPlugin.runs = []
+        self.plugin = CachedPlugin()
+        self.cache = ResultCache()
+        self.host = WorkerHost([self.plugin], cache=self.cache)
+        self.client = self.host.create_app().test_client()
+
+    def tearDown(self):
+        self.host.shutdown()
+
+    def run_model(self, value, rate=2.0):
+        body = {'forecast': {}, 'parameters': {'rate': rate},
+                'input': value}
+        response = self.client.post('/run', json=body)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        response = self.client.get('/run/{}?wait=5'.format(job_id))
+        # the result is cached once the job's callbacks ran
+        deadline = time.time() + 5
+        while len(self.cache) < len(CachedPlugin.runs) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        return response.get_json()
+
+    def test_cached(self):
+        """ Test if an identical run is answered from the cache """
+        first = self.run_model([1, 2])
+        self.assertEqual(first['status'], 'complete')
+        self.assertEqual(self.run_model([1, 2]), first)
+        self.assertEqual(CachedPlugin.runs, [[1, 2]])
+        counts = self.host.metrics()['models']['cached']
+        self.assertEqual((counts['submitted'], counts['cached']), (1, 1))
+        # different input, parameters or model version
+        self.run_model([1, 3])
+        self.run_model([1, 2], rate=3.0)
+        self.plugin.version = '2'
+        self.run_model([1, 2])
+        self.assertEqual(len(CachedPlugin.runs), 4)
+        self.assertEqual(self.host.metrics()['cache']['hits'], 1)
+
+
+class PluginInputTest(unittest.TestCase):
+
+    def test_shapiro_parameter_sets(self):
+        """ Test if shapiro rejects parameter sets it would ignore """
+        with self.assertRaises(ValueError):
+            ShapiroPlugin().prepare(MagicMock(), None,
+                                    {'parameters': {},
+                                     'parameter_sets': [{'a': 1}]})
+
+    def test_shapiro_input(self):
+        """ Test if shapiro gets the catalog columns, well and flow """
+        t_run = datetime(2018, 1, 1)
+
+        def sample(hours, flow):
+            return SimpleNamespace(data_attrs=('date_time', 'flow_xt'),
+                                   date_time=t_run + timedelta(hours=hours),
+                                   flow_xt=flow)
+
+        plan = SimpleNamespace(samples=[sample(-1, 50), sample(0, 100),
+                                        sample(6, 100), sample(7, 300)])
+        scenario = SimpleNamespace(id=3, injection_plan=plan)
+        forecast = SimpleNamespace(
+            forecast_time=t_run, forecast_interval=6, m_min=0, m_max=6,
+            input=SimpleNamespace(scenarios=[scenario]))
+        event = SimpleNamespace(date_time=t_run - timedelta(hours=2),
+                                magnitude=1.5, x=1.0, y=2.0, z=3.0)
+        catalog = CatalogColumns.from_events([event])
+        well = {'well_tip_x': 10.0, 'well_tip_y': 20.0, 'well_tip_z': 30.0}
+        data = {'parameters': {}, 'scenario id': 3, 'injection_well': well}
+        columns = ShapiroPlugin().prepare(forecast, catalog, data).columns()
+        self.assertEqual(list(columns['seismic_events_x']), [1.0])
+        self.assertEqual(list(columns['injection_well_well_tip_z']), [30.0])
+        self.assertEqual(list(columns['expected_flow']), [100.0])
+        self.assertEqual(len(columns['hydraulic_events_flow_xt']), 4)
+        # the model can't run without the well
+        del data['injection_well']
+        self.assertRaises(ValueError, ShapiroPlugin().prepare, forecast,
+                          catalog, data)
+        data['injection_well'] = {'well_tip_x': 10.0}
+        self.assertRaises(ValueError, ShapiroPlugin().prepare, forecast,
+                          catalog, data)
+
+    def test_ollinger_catalog(self):
+        """ Test if ollinger validates the catalog before queueing """
+        event = {'date_time': '2018-01-01T12:00:00+00:00', 'x': 1.0,
+                 'y': 2.0, 'z': 3.0, 'magnitude': 1.5}
+
+        def request(events):
+            catalog = {'seismic_events': events}
+            return {'forecast': {'input': {'input_catalog': catalog}}}
+
+        plugin = OllingerPlugin()
+        self.assertEqual(plugin.prepare(None, None, request([event])),
+                         [['01.01.2018 12:00:00.0000', 1.0, 2.0, 3.0, 1.5]])
+        self.assertRaises(ValueError, plugin.prepare, None, None,
+                          request(None))
+        self.assertRaises(ValueError, plugin.prepare, None, None,
+                          request([dict(event, date_time='yesterday')]))
+        self.assertRaises(KeyError, plugin.prepare, None, None,
+                          request([{'date_time': event['date_time']}]))
+        self.assertRaises(KeyError, plugin.prepare, None, None, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the shared HTTP session pool
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from core.tools.httpsession import SessionPool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        status = 503 if self.path == '/unavailable' else 200
+        body = b'{"status": "running"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.host = '127.0.0.1:{}'.format(self.server.server_port)
+        self.pool = SessionPool(retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.pool.close()
+        self._stop_server()
+
+    def _stop_server(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.server.server_close()
+
+    def test_keep_alive(self):
+        """ Test if consecutive polls reuse the same connection """
+        for _ in range(5):
+            r = self.pool.get('http://{}/run'.format(self.host))
+            self.assertEqual(r.status_code, 200)
+        stats = self.pool.stats()[self.host]
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_retries(self):
+        """ Test if server errors are retried and counted """
+        r = self.pool.get('http://{}/unavailable'.format(self.host))
+        self.assertEqual(r.status_code, 503)
+        stats = self.pool.stats()[self.host]
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['retries'], 2)
+
+    def test_errors(self):
+        """ Test if failed requests are counted """
+        self._stop_server()
+        with self.assertRaises(requests.ConnectionError):
+            self.pool.get('http://{}/run'.format(self.host))
+        self.assertEqual(self.pool.stats()[self.host]['errors'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
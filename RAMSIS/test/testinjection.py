@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the indexed injection history of the workers
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from ramsis.workers.tools.injection import InjectionHistory, \
+    expected_flow, representative_flow
+
+
+def reference_volume(times, flows, t_min, t_max):
+    """ Trapezoid integral [flow unit * h] over the samples in a window """
+    # no flow before the first sample, held after the last one
+    t_min = max(t_min, times[0])
+    if t_max <= t_min:
+        return 0.0
+    inside = (times > t_min) & (times < t_max)
+    t = np.concatenate(([t_min], times[inside], [t_max]))
+    f = np.interp(t, times, flows)
+    return np.trapezoid(f, t / 3600.0)
+
+
+class InjectionHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        # irregular sampling with some dense bursts
+        self.times = np.sort(np.concatenate((
+            rng.uniform(0, 48 * 3600.0, 40),
+            rng.uniform(10 * 3600.0, 11 * 3600.0, 20))))
+        self.flows = rng.uniform(0, 50, self.times.size)
+        self.history = InjectionHistory(self.times, self.flows)
+
+    def test_volume(self):
+        """ Test the cumulative volume against a numeric integral """
+        rng = np.random.RandomState(8)
+        t_min = rng.uniform(-6 * 3600.0, 54 * 3600.0, 200)
+        t_max = t_min + rng.uniform(0, 12 * 3600.0, 200)
+        expected = [reference_volume(self.times, self.flows, a, b)
+                    for a, b in zip(t_min, t_max)]
+        np.testing.assert_allclose(self.history.volume(t_min, t_max),
+                                   expected, rtol=1e-9, atol=1e-9)
+
+    def test_volume_edges(self):
+        """ Test windows before, across and after the sampled period """
+        first, last = self.times[0], self.times[-1]
+        self.assertEqual(self.history.volume(first - 7200, first), 0)
+        self.assertAlmostEqual(
+            float(self.history.volume(last, last + 7200)),
+            2 * self.flows[-1])
+        self.assertAlmostEqual(
+            float(self.history.volume(first - 7200, last)),
+            reference_volume(self.times, self.flows, first, last))
+
+    def test_unsorted(self):
+        """ Test if samples are sorted by time first """
+        order = np.random.RandomState(9).permutation(self.times.size)
+        history = InjectionHistory(self.times[order], self.flows[order])
+        t = np.array([0.0, 5 * 3600.0, 30 * 3600.0])
+        np.testing.assert_allclose(history.volume(t, t + 3600.0),
+                                   self.history.volume(t, t + 3600.0))
+
+    def test_empty(self):
+        history = InjectionHistory([], [])
+        self.assertEqual(history.volume([0.0, 1.0], [3600.0, 7200.0])
+                         .tolist(), [0.0, 0.0])
+
+    def test_flow_fuzz(self):
+        """ Test the flow queries against a brute force scan """
+        rng = np.random.RandomState(10)
+        for n in (1, 2, 3, 5, 8, 17, 64, 100):
+            # integer times produce duplicate samples and exact hits
+            times = rng.randint(0, 3 * n, n).astype(float)
+            flows = rng.uniform(-10, 50, n)
+            history = InjectionHistory(times, flows)
+            t_min = rng.randint(-2, 3 * n + 2, 50).astype(float)
+            t_max = t_min + rng.randint(0, 2 * n, 50)
+            expected = []
+            for a, b in zip(t_min, t_max):
+                inside = flows[(times >= a) & (times < b)]
+                expected.append(inside.max() if inside.size else np.nan)
+            np.testing.assert_array_equal(history.max_flow(t_min, t_max),
+                                          expected)
+            # scalar queries
+            for a, b, flow in zip(t_min, t_max, expected):
+                np.testing.assert_array_equal(history.max_flow(a, b), flow)
+
+            # distinct times for an unambiguous interpolation
+            times = np.sort(rng.choice(np.arange(0.0, 10 * n), n,
+                                       replace=False)) * 3600.0
+            history = InjectionHistory(times, flows)
+            t = rng.uniform(-3600.0, times[-1] + 3600.0, 50)
+            np.testing.assert_allclose(
+                history.flow_at(t),
+                np.where(t < times[0], 0, np.interp(t, times, flows)))
+            t_max = t + rng.uniform(0, 6 * 3600.0, 50)
+            hours = (t_max - t) / 3600.0
+            mean = [reference_volume(times, flows, a, b) / h
+                    for a, b, h in zip(t, t_max, hours)]
+            np.testing.assert_allclose(history.mean_flow(t, t_max), mean,
+                                       rtol=1e-9, atol=1e-9)
+
+
+class FlowHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.t0 = datetime(2018, 1, 1, tzinfo=timezone.utc).timestamp()
+
+    def sample(self, hours, flow):
+        date_time = datetime.fromtimestamp(self.t0 + hours * 3600.0,
+                                           tz=timezone.utc)
+        return SimpleNamespace(date_time=date_time, flow_xt=flow,
+                               flow_dh=flow)
+
+    def date(self, hours):
+        return datetime.fromtimestamp(self.t0 + hours * 3600.0,
+                                      tz=timezone.utc)
+
+    def test_expected_flow(self):
+        """ Test if the expected flow is weighted by time """
+        self.assertEqual(expected_flow([]), 0)
+        self.assertEqual(expected_flow(None), 0)
+        self.assertEqual(expected_flow([self.sample(0, 5)]), 5)
+        # 10 for an hour, then a dense burst of 40s for a minute
+        samples = [self.sample(0, 10), self.sample(1, 10)] + \
+            [self.sample(1 + i / 600.0, 40) for i in range(1, 11)]
+        self.assertLess(expected_flow(samples), 12)
+
+    def test_representative_flow(self):
+        """ Test the max. flow and its fall backs """
+        history = InjectionHistory.from_samples(
+            [self.sample(h, f) for h, f in ((0, 10), (1, 30), (2, 20))])
+        self.assertEqual(
+            representative_flow(history, self.date(0), self.date(3)), 30)
+        self.assertEqual(
+            representative_flow(history, self.date(1.5), self.date(3)), 20)
+        # no samples in the interval
+        self.assertEqual(
+            representative_flow(history, self.date(5), self.date(6)), 20)
+        self.assertEqual(representative_flow(
+            InjectionHistory.from_samples(None), self.date(0),
+            self.date(1)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
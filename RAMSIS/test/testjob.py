@@ -0,0 +1,227 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the job module
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from core.tools.job import (ParallelJob, SerialJob, DagJob, WorkUnit,
+                            JobStatus, ResourceLimiter)
+
+
+class DummyUnit(WorkUnit):
+    """ A work unit that finishes when told to """
+
+    def __init__(self, job_id, log):
+        super(DummyUnit, self).__init__(job_id)
+        self.log = log
+
+    def run(self):
+        self.log.append(('start', self.job_id))
+
+    def finish(self):
+        self.log.append(('finish', self.job_id))
+        self.status_changed.emit(JobStatus(self, finished=True))
+
+
+class InstantUnit(WorkUnit):
+    """ A work unit that finishes within run """
+
+    def run(self):
+        self.status_changed.emit(JobStatus(self, finished=True))
+
+
+class SerialJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.finished = []
+
+    def _create_job(self, units):
+        job = SerialJob('job')
+        job.work_units = units
+        job.status_changed.connect(
+            lambda s: s.sender is job and self.finished.append(s))
+        return job
+
+    def test_repeated_finish(self):
+        """ Test if repeated finished notifications are ignored """
+        units = [DummyUnit(i, self.log) for i in range(3)]
+        self._create_job(units).run()
+        units[0].finish()
+        units[0].finish()
+        self.assertEqual(self.log.count(('start', 1)), 1)
+        self.assertNotIn(('start', 2), self.log)
+        units[1].finish()
+        units[2].finish()
+        self.assertEqual(len(self.finished), 1)
+
+    def test_many_units(self):
+        """ Test if many units finishing synchronously don't recurse """
+        self._create_job([InstantUnit(i) for i in range(5000)]).run()
+        self.assertEqual(len(self.finished), 1)
+
+
+class ParallelJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.units = [DummyUnit(i, self.log) for i in range(4)]
+        self.finished = []
+
+    def _create_job(self, max_concurrent=None):
+        job = ParallelJob('job', max_concurrent=max_concurrent)
+        job.work_units = self.units
+        job.status_changed.connect(
+            lambda s: s.sender is job and self.finished.append(s))
+        return job
+
+    def test_unlimited(self):
+        """ Test if all units start immediately without a limit """
+        self._create_job().run()
+        self.assertEqual(self.log, [('start', i) for i in range(4)])
+
+    def test_max_concurrent(self):
+        """ Test if no more than max_concurrent units run at a time """
+        self._create_job(max_concurrent=2).run()
+        self.assertEqual(self.log, [('start', 0), ('start', 1)])
+        self.units[1].finish()
+        self.assertEqual(self.log[-1], ('start', 2))
+        self.units[0].finish()
+        self.assertEqual(self.log[-1], ('start', 3))
+        self.units[2].finish()
+        self.assertEqual(self.finished, [])
+        self.units[3].finish()
+        self.assertEqual(len(self.finished), 1)
+
+    def test_empty(self):
+        """ Test if a job without units finishes right away """
+        self.units = []
+        self._create_job(max_concurrent=2).run()
+        self.assertEqual(len(self.finished), 1)
+
+    def test_repeated_finish(self):
+        """ Test if repeated finished notifications are counted once """
+        self._create_job().run()
+        for _ in range(4):
+            self.units[0].finish()
+        self.assertEqual(self.finished, [])
+        for unit in self.units[1:]:
+            unit.finish()
+        self.assertEqual(len(self.finished), 1)
+
+    def test_many_units(self):
+        """ Test if many units finishing synchronously don't recurse """
+        self.units = [InstantUnit(i) for i in range(5000)]
+        self._create_job(max_concurrent=1).run()
+        self.assertEqual(len(self.finished), 1)
+
+
+class DagJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.finished = []
+        self.job = DagJob('dag')
+        self.job.status_changed.connect(
+            lambda s: s.sender is self.job and self.finished.append(s))
+
+    def _unit(self, job_id, depends_on=(), resource=None):
+        unit = DummyUnit(job_id, self.log)
+        self.job.add_unit(unit, depends_on=depends_on, resource=resource)
+        return unit
+
+    def test_pipeline_overlap(self):
+        """ Test if independent chains overlap """
+        models_a = self._unit('models_a')
+        hazard_a = self._unit('hazard_a', depends_on=[models_a])
+        models_b = self._unit('models_b')
+        self._unit('hazard_b', depends_on=[models_b])
+        self.job.run()
+        self.assertEqual(self.log, [('start', 'models_a'),
+                                    ('start', 'models_b')])
+        models_a.finish()
+        # hazard of a starts while the models of b are still running
+        self.assertEqual(self.log[-1], ('start', 'hazard_a'))
+        self.assertEqual(self.job.dependencies(hazard_a), [models_a])
+
+    def test_join(self):
+        """ Test if a unit waits for all its dependencies """
+        a = self._unit('a')
+        b = self._unit('b')
+        c = self._unit('c', depends_on=[a, b])
+        self.job.run()
+        a.finish()
+        a.finish()  # repeated notifications are ignored
+        self.assertNotIn(('start', 'c'), self.log)
+        b.finish()
+        self.assertEqual(self.log[-1], ('start', 'c'))
+        c.finish()
+        self.assertEqual(len(self.finished), 1)
+
+    def test_resource_limit(self):
+        """ Test if units wait for a slot of their resource """
+        self.job.limiter.set_limit('oq', 1)
+        a = self._unit('a', resource='oq')
+        self._unit('b', resource='oq')
+        self.job.run()
+        self.assertEqual(self.log, [('start', 'a')])
+        a.finish()
+        self.assertEqual(self.log[-1], ('start', 'b'))
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            self._unit('a', depends_on=[DummyUnit('x', self.log)])
+
+    def test_empty(self):
+        self.job.run()
+        self.assertEqual(len(self.finished), 1)
+
+
+class ResourceLimiterTest(unittest.TestCase):
+
+    def test_limit(self):
+        """ Test if waiting users get a slot when one is released """
+        started = []
+        limiter = ResourceLimiter(default_limit=2)
+        limiter.set_limit('oq', 1)
+        for i in range(3):
+            limiter.acquire('worker', lambda i=i: started.append(('w', i)))
+            limiter.acquire('oq', lambda i=i: started.append(('oq', i)))
+        self.assertEqual(started, [('w', 0), ('oq', 0), ('w', 1)])
+        self.assertEqual(limiter.active('worker'), 2)
+        self.assertEqual(limiter.waiting('oq'), 2)
+        limiter.release('oq')
+        self.assertEqual(started[-1], ('oq', 1))
+        self.assertEqual(limiter.active('oq'), 1)
+        limiter.release('worker')
+        limiter.release('worker')
+        self.assertEqual(started[-1], ('w', 2))
+        self.assertEqual(limiter.active('worker'), 1)
+
+    def test_double_release(self):
+        """ Test if extra releases don't raise the limit """
+        started = []
+        limiter = ResourceLimiter(default_limit=1)
+        limiter.acquire('worker', lambda: started.append(0))
+        limiter.release('worker')
+        limiter.release('worker')
+        self.assertEqual(limiter.active('worker'), 0)
+        for i in (1, 2):
+            limiter.acquire('worker', lambda i=i: started.append(i))
+        self.assertEqual(started, [0, 1])
+        self.assertEqual(limiter.waiting('worker'), 1)
+
+    def test_unlimited(self):
+        started = []
+        limiter = ResourceLimiter()
+        for i in range(10):
+            limiter.acquire('worker', lambda: started.append(1))
+        self.assertEqual(len(started), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
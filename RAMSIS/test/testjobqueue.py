@@ -0,0 +1,108 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the job queue of the worker host
+
+The jobs run in a thread pool, so the tests can block them.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from mock import MagicMock
+
+from ramsis.workers.tools.jobqueue import JobQueue, QueueFull, RUNNING, \
+    COMPLETE, ERROR
+
+
+def fail():
+    raise ValueError('bad input')
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.queue = JobQueue(max_pending=2, max_results=3,
+                              executor=ThreadPoolExecutor(2))
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.shutdown()
+
+    def blocked(self, value=None):
+        self.release.wait(timeout=5)
+        return value
+
+    def test_pending(self):
+        """ Test if pending counts queued and running jobs """
+        self.queue.submit(self.blocked)
+        self.queue.submit(self.blocked)
+        self.assertEqual(self.queue.pending, 2)
+        self.assertRaises(QueueFull, self.queue.submit, self.blocked)
+        self.assertEqual(self.queue.pending, 2)
+        self.release.set()
+        self.queue.shutdown()
+        self.assertEqual(self.queue.pending, 0)
+
+    def test_pending_failed(self):
+        """ Test if failed jobs and submissions release their slot """
+        job_id = self.queue.submit(fail)
+        self.assertEqual(self.queue.status(job_id, 5)[0], ERROR)
+        self.queue.executor = MagicMock()
+        self.queue.executor.submit.side_effect = BrokenProcessPool()
+        self.assertRaises(BrokenProcessPool, self.queue.submit, fail)
+        self.assertEqual(self.queue.pending, 0)
+
+    def test_status(self):
+        """ Test the job states and waiting for results """
+        job_id = self.queue.submit(self.blocked, 42)
+        self.assertEqual(self.queue.status(job_id), (RUNNING, None))
+        self.assertEqual(self.queue.status(job_id, 0.05), (RUNNING, None))
+        threading.Timer(0.05, self.release.set).start()
+        self.assertEqual(self.queue.status(job_id, 5), (COMPLETE, 42))
+        state, error = self.queue.status(self.queue.submit(fail), 5)
+        self.assertEqual(state, ERROR)
+        self.assertIsInstance(error, ValueError)
+        self.assertRaises(KeyError, self.queue.status, 'unknown')
+
+    def test_expire(self):
+        """ Test if the oldest finished jobs are dropped first """
+        running = self.queue.submit(self.blocked)
+        done = [self.queue.completed(i) for i in range(4)]
+        self.assertEqual(self.queue.latest(), done[-1])
+        # the running job is kept although it is the oldest
+        self.assertEqual(self.queue.status(running)[0], RUNNING)
+        for job_id in done[:2]:
+            self.assertRaises(KeyError, self.queue.status, job_id)
+        self.assertEqual(self.queue.status(done[2]), (COMPLETE, 2))
+        self.assertEqual(self.queue.status(done[3]), (COMPLETE, 3))
+        self.release.set()
+        self.assertEqual(self.queue.status(running, 5)[0], COMPLETE)
+        self.queue.completed(4)
+        self.assertRaises(KeyError, self.queue.status, running)
+
+
+class BrokenPoolTest(unittest.TestCase):
+
+    def test_replace_pool(self):
+        """ Test if the queue replaces its own broken process pool """
+        queue = JobQueue(max_workers=1)
+        broken = MagicMock()
+        broken.submit.side_effect = BrokenProcessPool()
+        queue.executor = broken
+        try:
+            job_id = queue.submit(abs, -3)
+            self.assertEqual(queue.status(job_id, 30), (COMPLETE, 3))
+        finally:
+            queue.shutdown()
+        broken.shutdown.assert_called_once_with(wait=False)
+        self.assertIsNot(queue.executor, broken)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the error handling of the model client
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+from concurrent.futures import Future
+
+import requests
+from mock import MagicMock
+
+from core.engine.modelclient import ModelClient, local_injection_well
+from core.tools.catalog import geodetic_to_local
+from core.tools.notifications import ClientNotification
+
+
+def failed(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ModelClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = ModelClient('rj', {'url': 'http://localhost:5000',
+                                         'parameters': {}},
+                                  pool=MagicMock(), runner=MagicMock())
+        self.notifications = []
+        self.client.client_notification.connect(self.notifications.append)
+
+    def assertNotified(self, state):
+        self.assertEqual([n.state for n in self.notifications], [state])
+
+    def test_post_errors(self):
+        """ Test if any error while posting results in an error """
+        errors = (requests.ConnectionError(), requests.TooManyRedirects(),
+                  ValueError('cannot encode'))
+        for error in errors:
+            self.notifications.clear()
+            self.client._on_run_response(failed(error))
+            self.assertNotified(ClientNotification.ERROR)
+
+    def test_poll_errors(self):
+        """ Test if unexpected poll errors and results end the run """
+        self.client._on_results(failed(TypeError()))
+        self.assertNotified(ClientNotification.ERROR)
+
+        self.notifications.clear()
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'status': 'complete', 'result': {}}
+        self.client._on_results(completed(response))
+        self.assertNotified(ClientNotification.ERROR)
+        self.assertIsNone(self.client.results)
+
+    def test_results(self):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {
+            'status': 'complete', 'result': {'rate_prediction': [1, 2, 3]}}
+        self.client._on_results(completed(response))
+        self.assertNotified(ClientNotification.COMPLETE)
+        self.assertEqual(self.client.results, (1, 2, 3))
+
+    def test_injection_well(self):
+        """ Test if the well is sent in the frame of the local events """
+        ref = {'lat': 47.58, 'lon': 7.58, 'h': 0}
+        point = (47.59, 7.57, 4000.0)
+        well = local_injection_well(point, ref)
+        x, y, z = geodetic_to_local([47.59], [7.57], [4000.0],
+                                    (47.58, 7.58, 0))
+        self.assertAlmostEqual(well['well_tip_x'], x[0])
+        self.assertAlmostEqual(well['well_tip_y'], y[0])
+        self.assertAlmostEqual(well['well_tip_z'], z[0])
+        payload = MagicMock()
+        self.client.run(MagicMock(), {'reference_point': ref,
+                                      'injection_point': point,
+                                      'payload': payload})
+        self.client.use_npz = False
+        self.client._post(payload)
+        fields = payload.body.call_args[0][1]
+        self.assertEqual(fields['injection_well'], well)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the array representation of the worker model input
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from ramsis.workers.etas.model import common as etas
+from ramsis.workers.shapiro.model import common as shapiro
+from ramsis.workers.tools.catalog import CatalogColumns
+
+
+class Event:
+    data_attrs = ('date_time', 'magnitude')
+
+    def __init__(self, date_time, magnitude):
+        self.date_time = date_time
+        self.magnitude = magnitude
+
+
+class ModelInputArrayTest(unittest.TestCase):
+
+    ModelInput = etas.ModelInput
+
+    def setUp(self):
+        self.model_input = self.ModelInput(datetime(2018, 1, 1),
+                                           mag_range=(1, 5))
+        self.model_input.seismic_events = [
+            Event(datetime(1970, 1, 1, 0, 0, 10), 1.5),
+            Event(datetime(1970, 1, 1, 1), None)]
+        self.model_input.hydraulic_events = []
+
+    def test_columns(self):
+        """ Test if event attributes are exported as float64 arrays """
+        columns = self.model_input.columns()
+        times = columns['seismic_events_date_time']
+        magnitudes = columns['seismic_events_magnitude']
+        self.assertEqual(times.dtype, np.float64)
+        np.testing.assert_array_equal(times, [10.0, 3600.0])
+        np.testing.assert_array_equal(magnitudes, [1.5, np.nan])
+        np.testing.assert_array_equal(columns['t_run'], [1514764800.0])
+        self.assertEqual(columns['hydraulic_events'].size, 0)
+        names = [name for name, _ in self.model_input.primitive_rep()]
+        self.assertEqual(names, list(columns))
+
+    def test_from_columns(self):
+        """ Test if columnar input is exported without event objects """
+        catalog = CatalogColumns(date_time=[10.0, 20.0],
+                                 magnitude=[1.0, 2.0])
+        model_input = self.ModelInput.from_columns(datetime(2018, 1, 1),
+                                                   catalog)
+        self.assertIsInstance(model_input, self.ModelInput)
+        columns = model_input.columns()
+        np.testing.assert_array_equal(columns['seismic_events_magnitude'],
+                                      [1.0, 2.0])
+        self.assertNotIn('seismic_events_x', columns)
+
+    def test_records(self):
+        """ Test the structured and memory mapped record export """
+        records = self.model_input.records('seismic_events')
+        self.assertEqual(records.dtype.names, ('date_time', 'magnitude'))
+        np.testing.assert_array_equal(records['date_time'], [10.0, 3600.0])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.npy')
+            self.model_input.records('seismic_events', path=path)
+            loaded = np.load(path, mmap_mode='r')
+            np.testing.assert_array_equal(loaded['magnitude'], [1.5, np.nan])
+            del loaded
+
+
+class ShapiroModelInputArrayTest(ModelInputArrayTest):
+
+    ModelInput = shapiro.ModelInput
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the Omori-Utsu kernel shared by the RJ and ETAS workers
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+from ramsis.workers.tools.omori import omori_rates
+
+
+def reference_rate(event_times, weights, t, bin_size, p, c):
+    """ Straightforward per event computation of the rate for one window """
+    rate = 0
+    for t_e, weight in zip(event_times, weights):
+        t1 = (t - t_e) / 3600.0
+        if t1 < 0:
+            continue
+        t2 = t1 + bin_size
+        if p == 1:
+            omori = math.log((t2 + c) / (t1 + c))
+        else:
+            omori = ((t2 + c) ** (1 - p) - (t1 + c) ** (1 - p)) / (1 - p)
+        rate += omori * weight
+    return rate
+
+
+class OmoriRatesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.event_times = np.sort(rng.uniform(0, 48 * 3600.0, 25))
+        self.weights = rng.uniform(0.01, 3.0, 25)
+        self.forecast_times = np.arange(0, 60 * 3600.0, 3 * 3600.0)
+        self.bin_sizes = rng.uniform(1.0, 12.0, self.forecast_times.size)
+
+    def assertMatchesReference(self, p, chunk_size):
+        rates = omori_rates(self.event_times, self.weights,
+                            self.forecast_times, self.bin_sizes, p, 0.05,
+                            chunk_size=chunk_size)
+        expected = [reference_rate(self.event_times, self.weights, t,
+                                   bin_size, p, 0.05)
+                    for t, bin_size in zip(self.forecast_times,
+                                           self.bin_sizes)]
+        np.testing.assert_allclose(rates, expected, rtol=1e-12)
+
+    def test_windows(self):
+        """ Test if the kernel matches the per event computation """
+        self.assertMatchesReference(p=1.2, chunk_size=2 ** 20)
+
+    def test_p_one(self):
+        """ Test the logarithmic limit for p == 1 """
+        self.assertMatchesReference(p=1.0, chunk_size=2 ** 20)
+
+    def test_chunks(self):
+        """ Test if chunking over forecast times changes nothing """
+        # fewer pairs per chunk than events x windows (and events)
+        for chunk_size in (7, 60, 333):
+            self.assertMatchesReference(p=1.2, chunk_size=chunk_size)
+            self.assertMatchesReference(p=1.0, chunk_size=chunk_size)
+
+    def test_scalar_bin_size(self):
+        rates = omori_rates(self.event_times, self.weights,
+                            self.forecast_times, 6.0, 1.2, 0.05)
+        expected = omori_rates(self.event_times, self.weights,
+                               self.forecast_times,
+                               np.full(self.forecast_times.size, 6.0), 1.2,
+                               0.05)
+        np.testing.assert_array_equal(rates, expected)
+
+    def test_no_events(self):
+        rates = omori_rates([], [], [0.0, 3600.0], 6.0, 1.2, 0.05)
+        self.assertEqual(rates.tolist(), [0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
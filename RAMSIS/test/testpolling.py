@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the adaptive poll schedule
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+from core.tools.polling import PollSchedule
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+class PollScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_backoff(self):
+        """ Test if intervals grow exponentially up to the cap """
+        schedule = PollSchedule(first=0.5, factor=2, max_interval=3,
+                                jitter=0, clock=self.clock)
+        intervals = [schedule.next_interval() for _ in range(5)]
+        self.assertEqual(intervals, [0.5, 1.0, 2.0, 3.0, 3.0])
+        schedule.start()
+        self.assertEqual(schedule.next_interval(), 0.5)
+
+    def test_jitter(self):
+        """ Test if jitter stays within the configured bounds """
+        schedule = PollSchedule(first=10, factor=1, jitter=0.1,
+                                clock=self.clock)
+        intervals = [schedule.next_interval() for _ in range(100)]
+        self.assertTrue(all(9 <= i <= 11 for i in intervals))
+        self.assertGreater(len(set(intervals)), 1)
+
+    def test_deadline(self):
+        """ Test if the schedule gives up after the deadline """
+        schedule = PollSchedule(first=4, factor=1, jitter=0, deadline=10,
+                                clock=self.clock)
+        waited = []
+        while True:
+            interval = schedule.next_interval()
+            if interval is None:
+                break
+            waited.append(interval)
+            self.clock.t += interval
+        self.assertEqual(waited, [4, 4, 2])
+        self.assertTrue(schedule.expired)
+        self.assertEqual(schedule.next_interval_ms(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the result cache of the worker host
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from ramsis.workers.tools.catalog import CatalogColumns
+from ramsis.workers.tools.resultcache import ResultCache, input_digest
+
+
+def catalog():
+    return CatalogColumns(
+        date_time=np.array([1.0e9, 1.0e9 + 60, 1.0e9 + 120]),
+        magnitude=np.array([1.2, 0.8, 2.1]))
+
+
+class InputDigestTest(unittest.TestCase):
+
+    def test_dict_order(self):
+        """ Test if dicts give the same digest in any order """
+        a = OrderedDict([('a', 1.0), ('b', [1, 2]), ('c', {'x': None})])
+        b = OrderedDict([('c', {'x': None}), ('b', [1, 2]), ('a', 1.0)])
+        self.assertEqual(input_digest('rj', a), input_digest('rj', b))
+
+    def test_catalog_value(self):
+        """ Test if changing a single catalog value changes the digest """
+        parameters = {'a': -1.6, 'b': 1.0}
+        original = input_digest('rj', '1', catalog(), parameters)
+        self.assertEqual(original,
+                         input_digest('rj', '1', catalog(), parameters))
+        changed = catalog()
+        changed.magnitude[1] = 0.9
+        self.assertNotEqual(original,
+                            input_digest('rj', '1', changed, parameters))
+        self.assertNotEqual(original,
+                            input_digest('rj', '2', catalog(), parameters))
+
+    def test_types(self):
+        """ Test if values of different types are distinguished """
+        values = [1, 1.0, '1', [1], (1, 2), [(1, 2)], None,
+                  np.array([1]), np.array([1.0]), np.array([[1]]),
+                  datetime(2018, 1, 1)]
+        digests = set(input_digest(v) for v in values)
+        self.assertEqual(len(digests), len(values))
+        self.assertEqual(input_digest(np.float64(2.5)), input_digest(2.5))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        """ Test if the least recently used result is evicted """
+        cache = ResultCache(max_entries=2)
+        cache.put('a', [1])
+        cache.put('b', [2])
+        self.assertEqual(cache.get('a'), [1])
+        cache.put('c', [3])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), [1])
+        self.assertEqual(cache.get('c'), [3])
+        self.assertEqual(cache.stats(),
+                         {'hits': 3, 'misses': 1, 'entries': 2})
+
+    def test_disk(self):
+        """ Test if evicted results are reloaded from disk """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_entries=1, directory=directory)
+            cache.put('a', {'rate_prediction': [1.0, 2.0, 0.5]})
+            cache.put('b', {'rate_prediction': [3.0, 2.0, 0.5]})
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(cache.get('a'),
+                             {'rate_prediction': [1.0, 2.0, 0.5]})
+            # a new cache (e.g. after a restart) finds both
+            cache = ResultCache(max_entries=2, directory=directory)
+            self.assertEqual(cache.get('b'),
+                             {'rate_prediction': [3.0, 2.0, 0.5]})
+            self.assertEqual(cache.get('a'),
+                             {'rate_prediction': [1.0, 2.0, 0.5]})
+            self.assertIsNone(cache.get('c'))
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['a.json', 'b.json'])
+
+    def test_disk_error(self):
+        """ Test if write errors keep the result in memory only """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=os.path.join(directory, 'cache'))
+        # the directory is gone now
+        cache.put('a', [1])
+        self.assertEqual(cache.get('a'), [1])
+
+    def test_not_serializable(self):
+        """ Test if results that are not JSON serializable aren't cached """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=directory)
+            cache.put('a', {'rate_prediction': object()})
+            cache.put('b', {'rate_prediction': float('nan')})
+            cache.put('c', [{1, 2}])
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNone(cache.get('c'))
+            self.assertEqual(len(cache), 1)
+            # no partial or temporary files are left behind
+            self.assertEqual(os.listdir(directory), ['b.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
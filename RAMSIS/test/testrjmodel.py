@@ -0,0 +1,59 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the Reasenberg & Jones rates of the RJ worker
+
+The Omori-Utsu kernel itself is tested in testomori.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import unittest
+
+import numpy as np
+
+from ramsis.workers.rj.model import rj_rates
+from ramsis.workers.tools.omori import omori_rates
+
+
+class RjRatesTest(unittest.TestCase):
+
+    def test_weighting(self):
+        """ Test if events are weighted by the RJ magnitude term """
+        event_times = [0.0, 3600.0, 7200.0]
+        magnitudes = np.array([0.5, 2.0, 3.5])
+        a, b, m_min, m_max = -1.6, 1.0, 0.5, 4.0
+        rates, probabilities = rj_rates(event_times, magnitudes,
+                                        [7200.0, 10800.0], 6.0, a, b, 1.2,
+                                        0.05, m_min, m_max)
+        weights = 10 ** (a + b * (magnitudes - m_min)) - \
+            10 ** (a + b * (magnitudes - m_max))
+        np.testing.assert_allclose(
+            rates, omori_rates(event_times, weights, [7200.0, 10800.0], 6.0,
+                               1.2, 0.05))
+        np.testing.assert_allclose(probabilities, 1 - np.exp(-rates))
+
+    def test_known_values(self):
+        """ Test against precomputed results of the original model """
+        params = (-1.6, 1.0, 1.2, 0.05, 5.0, 7.0)
+        rates, probabilities = rj_rates([0.0], [5.5], [0.0], 6.0, *params)
+        self.assertAlmostEqual(rates[0], 0.442, delta=0.001)
+        self.assertAlmostEqual(probabilities[0], 0.357, delta=0.001)
+        rates, probabilities = rj_rates([-3600.0, 0.0], [5.5, 5.5], [0.0],
+                                        6.0, *params)
+        self.assertAlmostEqual(rates[0], 0.564, delta=0.001)
+        self.assertAlmostEqual(probabilities[0], 0.431, delta=0.001)
+        # events after the start of the window are ignored
+        rates, _ = rj_rates([-3600.0, 0.0], [5.5, 5.5], [-3600.0], 6.0,
+                            *params)
+        self.assertAlmostEqual(rates[0], 0.442, delta=0.001)
+
+    def test_no_events(self):
+        rates, probabilities = rj_rates([], [], [0.0, 3600.0], 6.0, -1.6,
+                                        1.0, 1.2, 0.05, 0.5, 4.0)
+        self.assertEqual(rates.tolist(), [0.0, 0.0])
+        self.assertEqual(probabilities.tolist(), [0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the MATLAB session pool of the shapiro worker
+
+The tests use a stub instead of a MATLAB session.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import threading
+import time
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from ramsis.workers.shapiro.model.common import ModelInput
+from ramsis.workers.shapiro.model import sessionpool
+from ramsis.workers.shapiro.model.sessionpool import SessionPool, put_values
+from ramsis.workers.shapiro.model.shapiro import Shapiro
+
+
+class StubSession:
+    """ Records the commands and emulates the shapiro wrapper """
+
+    def __init__(self):
+        self.commands = []
+        self.values = {}
+
+    def run(self, command):
+        self.commands.append(command)
+        if command == "run('shapiro_wrapper.m')":
+            self.values.update(forecast_success=True, forecast_numev=5.0,
+                               forecast_bval=1.2,
+                               forecast_vol_rates=np.array([1.0, 4.0]))
+
+    def putvalue(self, name, value):
+        self.values[name] = value
+
+    def getvalue(self, name):
+        return self.values[name]
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sessions = []
+        self.pool = SessionPool(2, factory=self._factory,
+                                init_commands=['init'])
+
+    def _factory(self):
+        session = StubSession()
+        self.sessions.append(session)
+        return session
+
+    def test_warm_sessions(self):
+        """ Test if sessions are initialized once and reused """
+        self.pool.start()
+        self.assertEqual(len(self.sessions), 2)
+        for _ in range(5):
+            with self.pool.session() as session:
+                self.assertIn(session, self.sessions)
+        self.assertEqual(len(self.sessions), 2)
+        self.assertTrue(all(s.commands == ['init'] for s in self.sessions))
+
+    def test_concurrent(self):
+        """ Test if concurrent users get different sessions """
+        borrowed = []
+        barrier = threading.Barrier(2)
+
+        def borrow():
+            with self.pool.session() as session:
+                borrowed.append(session)
+                barrier.wait(timeout=5)
+
+        threads = [threading.Thread(target=borrow) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(borrowed)), 2)
+
+    def test_failed_run(self):
+        """ Test if a session is replaced after an error """
+        pool = SessionPool(1, factory=self._factory)
+        pool.start()
+        with self.assertRaises(ValueError):
+            with pool.session():
+                raise ValueError('interrupted')
+        self.assertEqual(pool._started, 0)
+        with pool.session() as session:
+            self.assertIs(session, self.sessions[1])
+        self.assertEqual(pool._started, 1)
+
+    def test_failed_run_waiting(self):
+        """ Test if a waiting thread gets a new session after an error """
+        pool = SessionPool(1, factory=self._factory)
+        borrowed = []
+
+        def borrow():
+            with pool.session(timeout=5) as session:
+                borrowed.append(session)
+
+        with self.assertRaises(ValueError):
+            with pool.session():
+                thread = threading.Thread(target=borrow)
+                thread.start()
+                time.sleep(0.05)  # let the thread wait for the session
+                raise ValueError('interrupted')
+        thread.join()
+        self.assertEqual(borrowed, [self.sessions[1]])
+
+    def test_close(self):
+        """ Test if sessions borrowed at close are not returned """
+        self.pool.start()
+        with self.pool.session():
+            self.pool.close()
+            self.assertEqual(self.pool._started, 1)
+        self.assertEqual(self.pool._started, 0)
+        self.assertRaises(RuntimeError, self.pool.session().__enter__)
+
+    def test_configure(self):
+        """ Test if replacing the shared pool drops its sessions """
+        self.addCleanup(setattr, sessionpool, '_pool', None)
+        old = sessionpool.configure_session_pool(1)
+        old.factory = self._factory
+        with old.session():
+            new = sessionpool.configure_session_pool(2)
+        self.assertIs(sessionpool.session_pool(), new)
+        self.assertEqual(old._started, 0)
+        self.assertEqual(len(self.sessions), 1)
+        self.assertRaises(RuntimeError, old.session().__enter__)
+
+    def test_put_values(self):
+        """ Test if values are transferred in a single packed array """
+        session = StubSession()
+        put_values(session, [('a', [1, 2, 3]), ('b', 4.0), ('c', [])],
+                   prefix='ramsis_')
+        np.testing.assert_array_equal(session.values['ramsis_packed'],
+                                      [1, 2, 3, 4])
+        self.assertEqual(session.commands, [
+            'ramsis_a = ramsis_packed(1:3); ramsis_b = ramsis_packed(4:4); '
+            'ramsis_c = ramsis_packed(5:4); clear ramsis_packed;'])
+
+    def test_shapiro_run(self):
+        """ Test a model run in a pooled session """
+        model = Shapiro(pool=self.pool)
+        model_input = ModelInput(datetime(2018, 1, 1), mag_range=(1, 5))
+        model_input.seismic_events = []
+        model_input.hydraulic_events = []
+        model.prepare_run(model_input)
+        model.run()
+        self.assertFalse(model.output.failed)
+        self.assertEqual(model.output.cum_result.rate, 5.0)
+        self.assertEqual(len(model.output.vol_results), 2)
+        session = self.sessions[0]
+        self.assertIn('ramsis_packed', session.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
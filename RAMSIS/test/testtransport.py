@@ -0,0 +1,167 @@
+# -*- encoding: utf-8 -*-
+"""
+Unit tests for the binary (npz) forecast transport
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import io
+import json
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import flask
+import numpy as np
+from mock import MagicMock
+
+from core.engine.modelclient import (ForecastPayload, ModelClient,
+                                     NPZ_MIMETYPE)
+from core.tools.catalog import CatalogColumns
+from ramsis.workers.tools.transport import (decode_request,
+                                            UnsupportedMediaType)
+
+Event = namedtuple('Event', 'date_time lat lon depth magnitude')
+REF = {'lat': 47.58, 'lon': 7.58, 'h': 0}
+
+
+class StaticPayload(ForecastPayload):
+    """ Payload for a fixed serialized forecast """
+
+    def __init__(self, serialized, catalog):
+        super(StaticPayload, self).__init__(MagicMock(id=7), catalog)
+        self.serialized = serialized
+
+    def _serialize(self):
+        self.reference_point = REF
+        return self.serialized
+
+
+def make_payload(n=4):
+    t0 = datetime(2006, 12, 2, 18)
+    events = [Event(t0 + timedelta(hours=i), 47.58 + i * 0.001, 7.58,
+                    4000.0 + i, 0.5 + i) for i in range(n)]
+    serialized = {'t_run': '2006-12-03T00:00:00',
+                  'input': {'input_catalog': {
+                      'seismic_events': [{'magnitude': e.magnitude}
+                                         for e in events]}}}
+    return StaticPayload(serialized, CatalogColumns.from_events(events))
+
+
+class Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def json(self):
+        return {}
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+
+    def decode(self, **kwargs):
+        with self.app.test_request_context('/run', method='POST', **kwargs):
+            return decode_request(flask.request)
+
+    def test_npz_round_trip(self):
+        """ Test if the worker decodes what the client encodes """
+        payload = make_payload()
+        form = {'forecast': (io.BytesIO(payload.npz()), 'forecast.npz',
+                             NPZ_MIMETYPE),
+                'parameters': json.dumps({'a': 1.0}),
+                'scenario id': json.dumps(7),
+                'catalog_sync': json.dumps({'version': 'v1'})}
+        data, catalog = self.decode(data=form,
+                                    content_type='multipart/form-data')
+        self.assertEqual(data['parameters'], {'a': 1.0})
+        self.assertEqual(data['scenario id'], 7)
+        self.assertEqual(data['catalog_sync'], {'version': 'v1'})
+        forecast = data['forecast']
+        self.assertEqual(forecast['t_run'], '2006-12-03T00:00:00')
+        self.assertEqual(forecast['input']['input_catalog']['seismic_events'],
+                         [])
+        columns = payload.catalog
+        for name in ('date_time', 'lat', 'lon', 'depth', 'magnitude'):
+            np.testing.assert_array_equal(getattr(catalog, name),
+                                          getattr(columns, name))
+        x, y, z = columns.local_coordinates(REF)
+        np.testing.assert_array_equal(catalog.x, x)
+
+        # a subset of the events
+        mask = np.array([True, False, True, False])
+        form['forecast'] = (io.BytesIO(payload.npz(mask)), 'forecast.npz',
+                            NPZ_MIMETYPE)
+        _, catalog = self.decode(data=form,
+                                 content_type='multipart/form-data')
+        np.testing.assert_array_equal(catalog.magnitude, [0.5, 2.5])
+
+    def test_npz_ensemble(self):
+        """ Test if parameter sets reach the worker with the npz transport """
+        http = MagicMock()
+        http.post.return_value = Response(202)
+        client = ModelClient('rj', {'url': 'http://localhost:5000',
+                                    'parameters': {'a': 1.0},
+                                    'transport': 'npz'},
+                             pool=http, runner=MagicMock())
+        client.parameter_sets = [{'b': 1.0}, {'b': 1.1}, {'b': 1.2}]
+        client._post(make_payload())
+        kwargs = http.post.call_args[1]
+        name, buf, mimetype = kwargs['files']['forecast']
+        form = dict(kwargs['data'], forecast=(io.BytesIO(buf), name,
+                                              mimetype))
+        data, _ = self.decode(data=form, content_type='multipart/form-data')
+        self.assertEqual(data['parameters'], {'a': 1.0})
+        self.assertEqual(data['parameter_sets'], client.parameter_sets)
+
+    def test_batch_results(self):
+        """ Test if a single result is rejected for parameter sets """
+        single = {'rate_prediction': [1.0, 2.0, 3.0]}
+        batch = {'rate_predictions': [[1.0, 2.0, 3.0], None]}
+        self.assertEqual(ModelClient._parse_results(single), (1.0, 2.0, 3.0))
+        self.assertEqual(ModelClient._parse_results(batch, True),
+                         [(1.0, 2.0, 3.0), None])
+        with self.assertRaises(KeyError):
+            ModelClient._parse_results(single, True)
+
+    def test_json(self):
+        """ Test if JSON requests carry the events in the data """
+        payload = make_payload()
+        data, catalog = self.decode(data=payload.body({'a': 1.0}),
+                                    content_type='application/json')
+        self.assertIsNone(catalog)
+        self.assertEqual(data['scenario id'], 7)
+        self.assertEqual(
+            len(data['forecast']['input']['input_catalog']['seismic_events']),
+            4)
+
+    def test_unsupported(self):
+        with self.assertRaises(UnsupportedMediaType):
+            self.decode(data='x', content_type='text/plain')
+
+    def test_fallback(self):
+        """ Test if the client switches to JSON after a 415 """
+        http = MagicMock()
+        http.post.side_effect = [Response(415), Response(202),
+                                 Response(202)]
+        client = ModelClient('rj', {'url': 'http://localhost:5000',
+                                    'parameters': {}, 'transport': 'npz'},
+                             pool=http, runner=MagicMock())
+        payload = make_payload()
+        self.assertEqual(client._post(payload).status_code, 202)
+        self.assertFalse(client.use_npz)
+        first, second = http.post.call_args_list
+        self.assertIn('files', first[1])
+        self.assertEqual(second[1]['headers'],
+                         {'Content-Type': 'application/json'})
+        # subsequent runs post JSON right away
+        client._post(payload)
+        self.assertEqual(http.post.call_count, 3)
+        self.assertNotIn('files', http.post.call_args[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,38 +1,13 @@
-import os
-import sys
+"""
+Start a worker for one or several models
 
-sys.path.append(os.path.abspath('workers/rj'))
+usage: worker.py model [model ...] [--port PORT] [--processes N] ...
 
-from workers.rj.main import main as run_rj  # NOQA
+See workers/host.py for all options.
 
+"""
 
-def main():
-    commands = ['rj', 'etas', 'shapiro']
-    validate(commands)
-    run(commands)
-
-
-def validate(commands):
-    valid = True
-    if len(sys.argv) != 2:
-        valid = False
-    elif sys.argv[1] not in commands:
-        valid = False
-    if not valid:
-        print('usage: worker.py [{}]'.format('|'.join(commands)))
-        sys.exit()
-
-
-def run(commands):
-    arg = sys.argv[1]
-    if arg == commands[0]:
-        run_rj()
-    elif arg == commands[1]:
-        print('todo')
-        sys.exit()
-    elif arg == commands[2]:
-        print('todo')
-        sys.exit()
+from workers.host import main  # NOQA
 
 
 if __name__ == '__main__':
@@ -36,11 +36,51 @@ Copyright (C) 2013, ETH Zurich - Swiss Seismological Service SED
 
 """
 
-from datetime import timedelta
-
 import numpy as np
 
 from .common import Model, ModelOutput, ModelResult
+from ...tools.catalog import epoch_seconds
+from ...tools.omori import CHUNK_SIZE, forecast_windows, omori_rates
+
+
+def etas_rates(event_times, magnitudes, forecast_times, bin_sizes, alpha, k,
+               p, c, mu, cf, m_min, m_max, injection=None,
+               chunk_size=CHUNK_SIZE):
+    """
+    Vectorized ETAS rates for many forecast windows
+
+    The aftershock term is evaluated for all windows at once (see
+    :func:`omori_rates`). Events after the start of a window don't
+    contribute to it. The background term uses
+    the volume injected during each window, which the injection history
+    looks up from its cumulative flow.
+
+    :param event_times: event times as unix time stamps [s]
+    :param magnitudes: event magnitudes
+    :param forecast_times: window start times as unix time stamps [s]
+    :param bin_sizes: window lengths [h], scalar or one per window
+    :param alpha, k, p, c, mu, cf: model parameters (see :class:`Etas`)
+    :param m_min, m_max: magnitude range of the forecast
+    :param InjectionHistory injection: flow rates, no injection if None
+    :returns: tuple of arrays (rates, probabilities), one entry per window
+
+    """
+    forecast_times, bin_sizes = forecast_windows(forecast_times, bin_sizes)
+    # the magnitude term does not depend on time
+    m = np.asarray(magnitudes, dtype=np.float64)
+    m_term = k * ((10 ** alpha * (m - m_min)) - (10 ** alpha * (m - m_max)))
+    rates = omori_rates(event_times, m_term, forecast_times, bin_sizes, p, c,
+                        chunk_size=chunk_size)
+
+    # Add the modified background activity which is controlled by the
+    # fluid injection rate
+    # FIXME: get the flow units right
+    rates += mu
+    if injection is not None:
+        rates += cf * injection.volume(forecast_times,
+                                       forecast_times + bin_sizes * 3600.0)
+    probabilities = 1 - np.exp(-rates)
+    return rates, probabilities
 
 
 class Etas(Model):
@@ -73,9 +113,9 @@ class Etas(Model):
     def _do_run(self):
         """
         Forecast aftershocks at the times given in run data (see prepare_run)
-        The model takes the injection flow rate at each forecast time into
-        account to compute rates. See super class for how the injection flow
-        rate is selected.
+        The model takes the volume injected during each forecast window into
+        account to compute rates (see :class:`InjectionHistory` for how the
+        flow rate between samples is interpolated).
 
         The model forecasts the number of seismic events expected between times
         t given in the run data (see prepare_forecast) and *t + bin_size*.
@@ -85,60 +125,40 @@ class Etas(Model):
 
         """
 
-        # copy everything into local variables for better readability
-        a = self.alpha
-        k = self.k
-        c = self.c
-        p = self.p
-        mu = self.mu
-        cf = self.cf
-        events = self._model_input.seismic_events
-        forecast_times = self._model_input.forecast_times
         t_bin = self._model_input.t_bin
         m_min, m_max = self._model_input.forecast_mag_range
-        num_t = len(forecast_times)
-
-        # extract all main shock event magnitudes into a numpy array
-        m_all = np.array([e.magnitude for e in events])
-
-        # Compute rate for each forecast time interval
-        forecast_rates = np.zeros(num_t)
-        for t, i in zip(forecast_times, list(range(0, num_t))):
-            # Convert event times to relative hours for both seismic events
-            # and flow
-            t_rel = np.array([(t - e.date_time).total_seconds() / 3600.0
-                             for e in events])
-
-            # Filter out any events after the start of the forecast interval
-            t1 = t_rel[t_rel >= 0]
-            t2 = t1 + t_bin
-            m = m_all[t_rel >= 0]
-
-            # Compute the integral of lambda(t, M) over the time bin interval
-            # and subtract the upper magnitude limit from the lower limit to
-            # get the appropriate range
-            rate = ((t2 + c) ** (1 - p) - (t1 + c) ** (1 - p)) / (1 - p) * \
-                k * ((10 ** a * (m - m_min)) - (10 ** a * (m - m_max)))
-
-            # Sum up the contributions from each main shock event
-            forecast_rates[i] = rate.sum()
-
-            # Add the modified background activity which is controlled by the
-            # fluid injection rate
-            flow = self.flow_rate_in_interval(t, t + timedelta(hours=t_bin))
-            # FIXME: get the flow units right
-            forecast_rates[i] += mu + cf * flow * t_bin
-
-        # Compute the resulting probabilities of one or more events occurring
-        probabilities = 1 - np.exp(-forecast_rates)
+        forecast_times = [epoch_seconds(t)
+                          for t in self._model_input.forecast_times]
+        rates, probabilities = self.rates(self._model_input.seismic_columns,
+                                          forecast_times, t_bin, m_min, m_max,
+                                          self._model_input.injection_history)
 
         # Finish up
         # FIXME: we're only supporting a single forecast now, remove list stuff
         # FIXME: that b_val is just made up
         # FIXME: the rates are off by a factor of ~10^3 too :)
-        forecast = ModelResult(rate=forecast_rates[0] / 1000.0, b_val=1.5,
+        forecast = ModelResult(rate=rates[0] / 1000.0, b_val=1.5,
                                prob=probabilities[0])
         output = ModelOutput(t_run=self._model_input.t_run, dt=t_bin,
                              model=self)
         output.cum_result = forecast
         return output
+
+    def rates(self, catalog, forecast_times, bin_sizes, m_min, m_max,
+              injection=None, chunk_size=CHUNK_SIZE):
+        """
+        Forecast the number of events for many time windows at once
+
+        See :func:`etas_rates`.
+
+        :param CatalogColumns catalog: columnar view of the input catalog
+        :param forecast_times: forecast times as unix time stamps [s]
+        :param bin_sizes: window lengths [h], scalar or one per time
+        :param InjectionHistory injection: flow rates, no injection if None
+        :returns: arrays of rates and probabilities of one or more events
+
+        """
+        return etas_rates(catalog.date_time, catalog.magnitude,
+                          forecast_times, bin_sizes, self.alpha, self.k,
+                          self.p, self.c, self.mu, self.cf, m_min, m_max,
+                          injection=injection, chunk_size=chunk_size)
@@ -0,0 +1,60 @@
+# -*- encoding: utf-8 -*-
+"""
+Worker host plugin for the modified ETAS model
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from ..host import ModelPlugin
+from ..tools.catalog import CatalogColumns
+from ..tools.injection import InjectionHistory
+from .model.common import ModelInput
+from .model.etas import Etas
+
+
+def planned_injection(forecast, scenario_id):
+    """
+    Returns the planned injection of the scenario as
+    :class:`InjectionHistory`, None if there is no plan
+
+    """
+    for scenario in forecast.input.scenarios or []:
+        if scenario.id != scenario_id:
+            continue
+        plan = getattr(scenario, 'injection_plan', None)
+        samples = [s for s in getattr(plan, 'samples', None) or []
+                   if s.date_time is not None and s.flow_dh is not None]
+        return InjectionHistory.from_samples(samples) if samples else None
+    return None
+
+
+class EtasPlugin(ModelPlugin):
+
+    name = 'etas'
+    deterministic = True
+
+    def prepare(self, forecast, catalog, data):
+        if catalog is None:
+            events = forecast.input.input_catalog.seismic_events
+            catalog = CatalogColumns.from_events(events)
+        injection = planned_injection(forecast, data.get('scenario id'))
+        model_input = ModelInput.from_columns(
+            forecast.forecast_time, catalog, injection,
+            bin_size=forecast.forecast_interval,
+            mag_range=(forecast.m_min, forecast.m_max))
+        return model_input
+
+    @staticmethod
+    def run(args, parameters):
+        model = Etas(**parameters)
+        model.prepare_run(args)
+        model.run()
+        output = model.output
+        if output.failed:
+            raise RuntimeError(output.failure_reason)
+        result = output.cum_result
+        return result.rate, result.b_val, result.prob
+
+
+plugin = EtasPlugin()
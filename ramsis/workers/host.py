@@ -0,0 +1,466 @@
+# -*- encoding: utf-8 -*-
+"""
+Common host for model workers
+
+The host serves one or several forecast models from a single process. The
+models are loaded as plugins (see :class:`ModelPlugin`) and share the
+request decoding, the catalog cache for delta uploads, the job queues and
+the health and metrics endpoints. Results of deterministic models are
+cached by a hash of their input. Each hosted model has the endpoints
+
+    POST /<model>/run           queue a model run, returns the job id
+    GET  /<model>/run/<job id>  result of a run
+    GET  /<model>/run           result of the most recent run
+
+If the host serves a single model, the same endpoints are also available
+without the /<model> prefix. ``GET /health`` and ``GET /metrics`` report the
+state of the host.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import argparse
+import importlib
+import logging
+from collections import Counter
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+from threading import Lock
+
+from flask import Flask, got_request_exception, request
+from flask import current_app as app
+from flask_restful import Api, Resource
+
+from ramsisdata.schemas import ForecastSchema
+from .tools.catalog import CatalogColumns
+from .tools.catalogcache import CatalogCache, VersionMismatch
+from .tools.jobqueue import JobQueue, QueueFull, RUNNING, COMPLETE
+from .tools.resultcache import ResultCache, input_digest
+from .tools.transport import decode_request, UnsupportedMediaType
+
+# Plugin modules by model name, each module provides a *plugin* object
+PLUGINS = {
+    'rj': '.rj.plugin',
+    'etas': '.etas.plugin',
+    'shapiro': '.shapiro.plugin',
+    'ollinger': '.ollinger.plugin'
+}
+
+# Max. time to hold a long poll request [s]
+MAX_WAIT = 30
+
+
+class ModelPlugin:
+    """
+    Base class for the models served by the host
+
+    Plugins prepare the arguments of a model run from the request on the
+    request thread. The run itself is executed by :meth:`run` in one of
+    the host's executors: in a separate process for models that compute in
+    python, or in a thread for models that drive external engines (which
+    keep state in the host process, or are not picklable).
+
+    :cvar str name: model name, used in the endpoint urls
+    :cvar str executor: 'process' or 'thread'
+    :cvar int max_concurrent: max. number of runs at the same time (None
+        for no limit). Further requests are rejected.
+    :cvar bool deterministic: True if the model always returns the same
+        result for the same input. Only results of deterministic models
+        are cached.
+    :cvar str version: version of the model implementation. Bump it when
+        a change affects the results, cached results of other versions
+        are not used.
+
+    """
+
+    name = None
+    executor = 'process'
+    max_concurrent = None
+    deterministic = False
+    version = '1'
+
+    def startup(self, host):
+        """
+        Prepare the model before the host starts serving requests
+
+        :param WorkerHost host: the host that serves the model
+
+        """
+        pass
+
+    def shutdown(self):
+        pass
+
+    def prepare(self, forecast, catalog, data):
+        """
+        Returns the arguments for :meth:`run` (runs on the request thread)
+
+        :param forecast: de-serialized forecast input
+        :param CatalogColumns catalog: seismic events
+        :param dict data: the decoded request
+        :raises UnsupportedMediaType: if the plugin can't handle the
+            request's transport
+        :raises ValueError: if the request is invalid
+
+        """
+        raise NotImplementedError('Plugins must provide prepare')
+
+    @staticmethod
+    def run(args, parameters):
+        """
+        Run the model once (runs in the executor)
+
+        :param args: the arguments returned by :meth:`prepare`
+        :param dict parameters: model parameters
+        :returns: the rate prediction (rate, b_val, prob)
+
+        """
+        raise NotImplementedError('Plugins must provide run')
+
+
+def load_plugin(name):
+    """ Import the plugin for model *name* """
+    return importlib.import_module(PLUGINS[name], __package__).plugin
+
+
+def run_model(run, args, parameters, parameter_sets=None):
+    """
+    Execute a model run (in the executor)
+
+    :param run: the plugin's run function
+    :param list parameter_sets: if given, the model is run once for each
+        set (ensembles). Parameters missing in a set are taken from
+        *parameters*.
+    :returns: the result for the status response, i.e. a dict with the
+        'rate_prediction' or, for parameter sets, the 'rate_predictions'
+        with None for runs that failed
+
+    """
+    if parameter_sets is None:
+        return {'rate_prediction': run(args, parameters)}
+    predictions = []
+    for params in parameter_sets:
+        try:
+            predictions.append(run(args, dict(parameters, **params)))
+        except Exception:
+            predictions.append(None)
+    return {'rate_predictions': predictions}
+
+
+class WorkerHost:
+    """
+    Runs the models of several plugins on shared job queues
+
+    :param plugins: list of :class:`ModelPlugin`
+    :param int processes: size of the process pool (default: number of
+        cores)
+    :param int threads: size of the thread pool
+    :param int max_pending: max. number of queued or running jobs per pool
+    :param ResultCache cache: cache for the results of deterministic
+        models (no caching if None)
+
+    """
+
+    def __init__(self, plugins, processes=None, threads=4, max_pending=64,
+                 cache=None):
+        self.plugins = {p.name: p for p in plugins}
+        self.catalog_cache = CatalogCache()
+        self.cache = cache
+        self.threads = threads
+        self.queues = {}
+        kinds = set(p.executor for p in plugins)
+        if 'process' in kinds:
+            self.queues['process'] = JobQueue(max_workers=processes,
+                                              max_pending=max_pending)
+        if 'thread' in kinds:
+            self.queues['thread'] = JobQueue(
+                max_pending=max_pending,
+                executor=ThreadPoolExecutor(threads))
+        self._latest = {}
+        self._running = Counter()
+        self._counts = {name: Counter() for name in self.plugins}
+        self._lock = Lock()
+
+    def startup(self):
+        for plugin in self.plugins.values():
+            plugin.startup(self)
+
+    def shutdown(self):
+        for queue in self.queues.values():
+            queue.shutdown()
+        for plugin in self.plugins.values():
+            plugin.shutdown()
+
+    def submit(self, name, forecast, catalog, data):
+        """
+        Queue a run of model *name*
+
+        :returns: the job id
+        :raises QueueFull: if the run can't be accepted now
+        :raises BrokenExecutor: if the executor can't run jobs anymore
+
+        """
+        plugin = self.plugins[name]
+        args = plugin.prepare(forecast, catalog, data)
+        parameters = data['parameters']
+        parameter_sets = data.get('parameter_sets')
+        key = None
+        if self.cache is not None and plugin.deterministic:
+            key = input_digest(name, plugin.version, args, parameters,
+                               parameter_sets)
+            result = self.cache.get(key)
+            if result is not None:
+                job_id = self.queues[plugin.executor].completed(result)
+                with self._lock:
+                    self._counts[name]['cached'] += 1
+                    self._latest[name] = job_id
+                return job_id
+        with self._lock:
+            if plugin.max_concurrent is not None and \
+                    self._running[name] >= plugin.max_concurrent:
+                self._counts[name]['rejected'] += 1
+                raise QueueFull('{} runs of {} in progress'
+                                .format(self._running[name], name))
+            queue = self.queues[plugin.executor]
+            try:
+                job_id = queue.submit(run_model, plugin.run, args,
+                                      parameters, parameter_sets)
+            except (QueueFull, BrokenExecutor):
+                self._counts[name]['rejected'] += 1
+                raise
+            self._running[name] += 1
+            self._counts[name]['submitted'] += 1
+            self._latest[name] = job_id
+        queue.add_done_callback(job_id,
+                                lambda f: self._on_done(name, f, key))
+        return job_id
+
+    def latest(self, name):
+        """ Id of the most recent job of model *name* (None if none) """
+        return self._latest.get(name)
+
+    def status(self, name, job_id, wait_time=0):
+        """ State and result of a job (see :meth:`JobQueue.status`) """
+        queue = self.queues[self.plugins[name].executor]
+        return queue.status(job_id, wait_time)
+
+    def health(self):
+        return {'status': 'ok', 'models': sorted(self.plugins)}
+
+    def metrics(self):
+        """ Job counts per model and queue """
+        with self._lock:
+            models = {name: dict(counts, running=self._running[name])
+                      for name, counts in self._counts.items()}
+        queues = {kind: {'pending': queue.pending,
+                         'max_pending': queue.max_pending}
+                  for kind, queue in self.queues.items()}
+        metrics = {'models': models, 'queues': queues}
+        if self.cache is not None:
+            metrics['cache'] = self.cache.stats()
+        return metrics
+
+    def create_app(self, name='worker'):
+        """ Create the flask app with the endpoints of all models """
+        app = Flask(name)
+        api = Api(app)
+        kwargs = {'resource_class_kwargs': {'host': self}}
+        api.add_resource(Run, '/<string:model>/run', **kwargs)
+        api.add_resource(RunJob, '/<string:model>/run/<string:job_id>',
+                         endpoint='model_job', **kwargs)
+        if len(self.plugins) == 1:
+            default = {'model': next(iter(self.plugins))}
+            api.add_resource(Run, '/run', endpoint='default_run',
+                             defaults=default, **kwargs)
+            api.add_resource(RunJob, '/run/<string:job_id>',
+                             endpoint='default_job', defaults=default,
+                             **kwargs)
+        api.add_resource(Health, '/health', **kwargs)
+        api.add_resource(Metrics, '/metrics', **kwargs)
+        return app
+
+    def _on_done(self, name, future, key=None):
+        failed = future.cancelled() or future.exception() is not None
+        with self._lock:
+            self._running[name] -= 1
+            self._counts[name]['failed' if failed else 'completed'] += 1
+        if key is not None and not failed:
+            self.cache.put(key, future.result())
+
+
+class Run(Resource):
+    """
+    Model runs
+
+    POST starts a model run and returns its job id, GET returns the result
+    of the most recent run (see :class:`RunJob` for the result of a
+    specific run).
+
+    """
+
+    def __init__(self, host):
+        self.host = host
+
+    def post(self, model):
+        """
+        Queue a model run
+
+        Returns HTTP status code 202 and the job id on success, 400 if the
+        request is invalid and 503 if too many runs are pending or the
+        model processes are not available.
+
+        """
+        if model not in self.host.plugins:
+            return 'Unknown model {}'.format(model), 404
+        app.logger.debug('Received post request for {}'.format(model))
+        try:
+            data, catalog = decode_request(request)
+        except UnsupportedMediaType as e:
+            return 'Unsupported media type: {}'.format(e), 415
+        except (ValueError, KeyError) as e:
+            msg = 'Failed to decode request: {}'.format(repr(e))
+            app.logger.error(msg)
+            return msg, 400
+        forecast_schema = ForecastSchema()
+        try:
+            forecast = forecast_schema.load(data['forecast'])
+            forecast = forecast.data
+        except Exception as e:
+            msg = 'Failed to de-serialize data: {}'.format(repr(e))
+            app.logger.error(msg)
+            return msg, 400
+        response = {'status': RUNNING}
+        sync = data.get('catalog_sync')
+        if sync is not None:
+            if catalog is None:
+                events = forecast.input.input_catalog.seismic_events
+                catalog = CatalogColumns.from_events(events)
+            try:
+                catalog = self.host.catalog_cache.apply(sync, catalog)
+            except VersionMismatch as e:
+                app.logger.info('Catalog out of sync: {}'.format(e))
+                return 'Catalog out of sync: {}'.format(e), 409  # Conflict
+            response['catalog_version'] = sync['version']
+        try:
+            job_id = self.host.submit(model, forecast, catalog, data)
+        except UnsupportedMediaType as e:
+            return 'Unsupported media type: {}'.format(e), 415
+        except (ValueError, KeyError) as e:
+            msg = 'Invalid model input: {}'.format(repr(e))
+            app.logger.error(msg)
+            return msg, 400
+        except QueueFull as e:
+            app.logger.warning('Rejected {} run: {}'.format(model, e))
+            return 'Too many pending runs', 503  # Service unavailable
+        except BrokenExecutor as e:
+            app.logger.error('Cannot run {}: {}'.format(model, repr(e)))
+            return 'Model processes unavailable', 503
+        app.logger.info('Queued {} run {}'.format(model, job_id))
+        response['job_id'] = job_id
+        return response, 202  # Accepted
+
+    def get(self, model):
+        """ Return the result of the most recent run """
+        if model not in self.host.plugins:
+            return 'Unknown model {}'.format(model), 404
+        job_id = self.host.latest(model)
+        if job_id is None:
+            return '', 204  # No content
+        return job_response(self.host, model, job_id)
+
+
+class RunJob(Resource):
+    """ Result of a model run """
+
+    def __init__(self, host):
+        self.host = host
+
+    def get(self, model, job_id):
+        if model not in self.host.plugins:
+            return 'Unknown model {}'.format(model), 404
+        return job_response(self.host, model, job_id)
+
+
+class Health(Resource):
+
+    def __init__(self, host):
+        self.host = host
+
+    def get(self):
+        return self.host.health()
+
+
+class Metrics(Resource):
+
+    def __init__(self, host):
+        self.host = host
+
+    def get(self):
+        return self.host.metrics()
+
+
+def job_response(host, model, job_id):
+    """
+    Returns the status response for job_id
+
+    Long polling: if the request has a *wait* argument, the response is
+    delayed by up to *wait* seconds (max. MAX_WAIT) until the result is
+    available.
+
+    """
+    wait = min(request.args.get('wait', 0, type=float), MAX_WAIT)
+    try:
+        state, result = host.status(model, job_id, wait)
+    except KeyError:
+        return 'Unknown job {}'.format(job_id), 404
+    if state == RUNNING:
+        return {'status': RUNNING}, 202  # Accepted
+    if state == COMPLETE:
+        return {'status': COMPLETE, 'result': result}
+    app.logger.error('{} run {} failed: {}'.format(model, job_id,
+                                                   repr(result)))
+    return {'status': 'error', 'reason': repr(result)}
+
+
+def log_exception(sender, exception, **extra):
+    sender.logger.debug('Got exception during processing: %s', exception)
+
+
+def main(argv=None, port=5000):
+    parser = argparse.ArgumentParser(description='RAMSIS model worker')
+    parser.add_argument('models', nargs='+', choices=sorted(PLUGINS),
+                        help='models to serve')
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of model processes (default: number '
+                             'of cores)')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='number of threads for models that run in '
+                             'external engines')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='max. number of queued or running model runs')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='number of results to cache in memory (0 '
+                             'disables the cache)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='also store cached results in this directory')
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(args.cache_size, args.cache_dir)
+    host = WorkerHost([load_plugin(name) for name in args.models],
+                      processes=args.processes, threads=args.threads,
+                      max_pending=args.max_pending, cache=cache)
+    app = host.create_app('{}_worker'.format('_'.join(args.models)))
+    app.debug = True
+    app.logger.setLevel(logging.DEBUG)
+    got_request_exception.connect(log_exception, app)
+    app.logger.info('Starting worker for {}'.format(', '.join(args.models)))
+    host.startup()
+    # handle requests in threads, the models run in the executors
+    try:
+        app.run(host='0.0.0.0', port=args.port, use_reloader=False,
+                threaded=True)
+    finally:
+        host.shutdown()
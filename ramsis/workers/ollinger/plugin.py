@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+"""
+Worker host plugin for the Ollinger model
+
+The model is an external simulation that reads the catalog from and writes
+its results to a fixed directory, so only one run is possible at a time.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from datetime import datetime
+import csv
+import logging
+import os
+import subprocess
+import glob
+
+import numpy as np
+
+from ..host import ModelPlugin
+from ..tools.transport import UnsupportedMediaType
+
+log = logging.getLogger(__name__)
+
+
+class OllingerPlugin(ModelPlugin):
+
+    name = 'ollinger'
+    executor = 'thread'
+    max_concurrent = 1
+
+    model_dir = 'C:\RAMSIS\Worker\Simulation_Test'
+    model_file = os.path.join(model_dir, 'start_simulation.bat')
+    seismic_catalog_files = glob.glob(os.path.join(
+        model_dir, 'SeismicCatalog_000[0-9][0-9].csv'))
+
+    def prepare(self, forecast, catalog, data):
+        if catalog is not None:
+            # the catalog is written from the JSON events
+            raise UnsupportedMediaType('Only JSON requests are supported')
+        return _catalog_rows(data)
+
+    @staticmethod
+    def run(args, parameters):
+        log.info('Starting model')
+        _write_seismic_catalog(args)
+        return_code = subprocess.call(OllingerPlugin.model_file,
+                                      cwd=OllingerPlugin.model_dir)
+        if return_code != 0:
+            raise RuntimeError('Model failed with exit code {}'
+                               .format(return_code))
+        log.debug('Assembling results')
+        return _eval_results(OllingerPlugin.seismic_catalog_files)
+
+
+def _eval_results(seismic_catalog_files):
+    all_results = []
+    for catalog in seismic_catalog_files:
+        with open(catalog) as f:
+            reader = csv.reader(f, delimiter=';')
+            next(reader)  # skip header
+            mags = [float(row[1]) for row in reader]
+            gr = _estimate_gr_params(mags)
+            log.debug('Stats (a, b, std) for {}: {}'.format(catalog, gr))
+            all_results.append(gr)
+    gr = np.mean(all_results, 0).tolist()
+    log.debug('Mean {}:'.format(gr))
+    return gr
+
+
+def _catalog_rows(data):
+    """
+    Rows of the model's catalog file from the JSON events of the request
+
+    :raises KeyError: if the request or an event lacks a required field
+    :raises ValueError: if there are no events or an event is invalid
+
+    """
+    try:
+        events = data['forecast']['input']['input_catalog']
+        events = events['seismic_events']
+        rows = []
+        for e in events:
+            d = datetime.strptime(e['date_time'], '%Y-%m-%dT%H:%M:%S+00:00')
+            row = [d.strftime('%d.%m.%Y %H:%M:%S.0000')]
+            row += [e[key] for key in ['x', 'y', 'z', 'magnitude']]
+            rows.append(row)
+    except TypeError as e:
+        raise ValueError('Invalid seismic catalog: {}'.format(e))
+    return rows
+
+
+def _write_seismic_catalog(rows):
+    with open('Simulation_Test\\SeismicCatalog_Measured.csv', 'w',
+              newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(['Time', 'Offset-X(m)', 'Offset-Y(m)',
+                         'Offset-Z(m)', 'Local magnitude'])
+        writer.writerows(rows)
+
+
+def _estimate_gr_params(magnitudes, mc=None):
+    """
+    Estimates the Gutenberg Richter parameters based on a list of magnitudes.
+    The magnitudes list is expected to contain no values below mc
+
+    :param mc: Magnitude of completeness. If not given, the smallest value in
+        magnitudes is used as mc
+    :param magnitudes: List of magnitudes
+    :returns: Gutenberg Richter parameter estimates as tuple (a, b, std_b)
+
+    """
+    mags = np.array(magnitudes)
+    if mc is None:
+        mc = mags.min()
+    else:
+        mags = mags[mags >= mc]
+    n = mags.size
+    m_mean = mags.mean()
+    b = 1 / (np.log(10) * (m_mean - mc))
+    a = np.log10(n) + b * mc
+    variance = ((mags - m_mean) ** 2).sum() / (n * (n - 1))
+    std_b = 2.3 * np.sqrt(variance) * b ** 2
+    return a, b, std_b
+
+
+plugin = OllingerPlugin()
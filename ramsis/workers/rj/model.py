@@ -12,6 +12,39 @@ import logging
 from PyQt5 import QtCore
 import numpy as np
 
+from ..tools.catalog import CatalogColumns, epoch_seconds
+from ..tools.omori import CHUNK_SIZE, omori_rates
+
+
+def rj_rates(event_times, magnitudes, forecast_times, bin_sizes, a, b, p, c,
+             m_min, m_max, chunk_size=CHUNK_SIZE):
+    """
+    Vectorized Reasenberg & Jones rates for many forecast windows
+
+    See :func:`omori_rates` for how the windows are evaluated.
+
+    :param event_times: event times as unix time stamps [s]
+    :param magnitudes: event magnitudes
+    :param forecast_times: window start times as unix time stamps [s]
+    :param bin_sizes: window lengths [h], scalar or one per window
+    :param a, b, p, c: model parameters (see :class:`Rj`)
+    :param m_min, m_max: magnitude range of the forecast
+    :returns: tuple of arrays (rates, probabilities), one entry per window
+
+    """
+    # the magnitude term does not depend on time
+    m = np.asarray(magnitudes, dtype=np.float64)
+    m_term = 10 ** (a + b * (m - m_min)) - 10 ** (a + b * (m - m_max))
+    # The implementation below is found in various SED codes. It's
+    # based on a mistake in the original RJ '89 paper (see correction
+    # in RJ '94). Do not use. It's just here for reference.
+    # rate = ((t1+c)**(1-p) - (t2+c)**(1-p)) / ((1-p)*b*log(10)) * \
+    #        ((10 ** (a+b*(m-m_max))) - (10 ** (a+b*(m-m_min))))
+    rates = omori_rates(event_times, m_term, forecast_times, bin_sizes, p, c,
+                        chunk_size=chunk_size)
+    probabilities = 1 - np.exp(-rates)
+    return rates, probabilities
+
 
 class Rj(QtCore.QObject):
     """
@@ -45,7 +78,7 @@ class Rj(QtCore.QObject):
         self.model_result = None
         self._logger = logging.getLogger(self.__class__.__name__)
 
-    def run(self, forecast):
+    def run(self, forecast, catalog=None):
         """
         Forecast aftershocks at the times given in run data
 
@@ -70,58 +103,42 @@ class Rj(QtCore.QObject):
         Note that any events occurring after the start of each forecast window
         are ignored for the respective forecast.
 
+        :param forecast: forecast to compute
+        :param CatalogColumns catalog: columnar view of the input catalog.
+            Built from the forecast's input catalog if not given.
+        :returns: tuple (rate, b, probability)
+
         """
         self._logger.info('Rj model run initiated')
+        if catalog is None:
+            events = forecast.input.input_catalog.seismic_events
+            catalog = CatalogColumns.from_events(events)
+        t_run = epoch_seconds(forecast.forecast_time)
+        rates, probabilities = self.rates(catalog, [t_run],
+                                          forecast.forecast_interval,
+                                          forecast.m_min, forecast.m_max)
+        return rates[0], self.b, probabilities[0]
+
+    def rates(self, catalog, forecast_times, bin_sizes, m_min, m_max,
+              chunk_size=CHUNK_SIZE):
+        """
+        Forecast the number of events for many time windows at once
 
-        # copy everything into local variables for better readability
-        a = self.a
-        b = self.b
-        c = self.c
-        p = self.p
-        events = forecast.input.input_catalog.seismic_events
-        t_run = forecast.forecast_time
-        forecast_times = [t_run]
-        t_bin = forecast.forecast_interval
-        m_min = forecast.m_min
-        m_max = forecast.m_max
-        num_t = len(forecast_times)
-
-        # extract all main shock event magnitudes into a numpy array
-        m_all = np.array([e.magnitude for e in events])
-
-        # Compute rate for each forecast time interval
-        # TODO: not sure if we have to compute m_bins individually
-        forecast_rates = np.zeros(num_t)
-        for t, i in zip(forecast_times, list(range(0, num_t))):
-            # Convert event times to relative hours
-            t_all = np.array([(t - e.date_time).total_seconds() / 3600.0
-                             for e in events])
-
-            # Filter out any events after the start of the forecast interval
-            t1 = t_all[t_all >= 0]
-            t2 = t1 + t_bin
-            m = m_all[t_all >= 0]
-
-            # Compute the integral of lambda(t, M) over the time bin interval
-            # and subtract the upper magnitude limit from the lower limit to
-            # get the appropriate range
-            rate = ((t2 + c) ** (1 - p) - (t1 + c) ** (1 - p)) / (1 - p) * \
-                   ((10 ** (a + b * (m - m_min))) -
-                    (10 ** (a + b * (m - m_max))))
-
-            # The implementation below is found in various SED codes. It's
-            # based on a mistake in the original RJ '89 paper (see correction
-            # in RJ '94). Do not use. It's just here for reference.
-            # rate = ((t1+c)**(1-p) - (t2+c)**(1-p)) / ((1-p)*b*log(10)) * \
-            #        ((10 ** (a+b*(m-m_max))) - (10 ** (a+b*(m-m_min))))
-
-            # Sum up the contributions from each event
-            forecast_rates[i] = rate.sum()
-
-        # Compute the resulting probabilities of one or more events occurring
-        probabilities = 1 - np.exp(-forecast_rates)
-
-        return forecast_rates[0], b, probabilities[0]
+        Computes the rate for windows [t, t + bin_size] for each forecast
+        time t (see :func:`rj_rates`). This allows computing full rate time
+        series, e.g. for back-analysis.
+
+        :param CatalogColumns catalog: columnar view of the input catalog
+        :param forecast_times: forecast times as unix time stamps [s]
+        :param bin_sizes: window lengths [h], scalar or one per time
+        :param float m_min: lower magnitude limit
+        :param float m_max: upper magnitude limit
+        :returns: arrays of rates and probabilities of one or more events
+
+        """
+        return rj_rates(catalog.date_time, catalog.magnitude, forecast_times,
+                        bin_sizes, self.a, self.b, self.p, self.c, m_min,
+                        m_max, chunk_size=chunk_size)
 
         # Finish up
         # model_result = ModelResult()
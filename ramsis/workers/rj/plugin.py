@@ -0,0 +1,42 @@
+# -*- encoding: utf-8 -*-
+"""
+Worker host plugin for the Reasenberg-Jones model
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from collections import namedtuple
+
+from ..host import ModelPlugin
+from ..tools.catalog import CatalogColumns
+from .model import Rj
+
+# The forecast attributes the model needs. Unlike the de-serialized
+# forecast this can be sent to the worker processes.
+ForecastWindow = namedtuple('ForecastWindow', ['forecast_time',
+                                               'forecast_interval',
+                                               'm_min', 'm_max'])
+
+
+class RjPlugin(ModelPlugin):
+
+    name = 'rj'
+    deterministic = True
+
+    def prepare(self, forecast, catalog, data):
+        if catalog is None:
+            events = forecast.input.input_catalog.seismic_events
+            catalog = CatalogColumns.from_events(events)
+        window = ForecastWindow(forecast.forecast_time,
+                                forecast.forecast_interval,
+                                forecast.m_min, forecast.m_max)
+        return window, catalog
+
+    @staticmethod
+    def run(args, parameters):
+        window, catalog = args
+        return Rj(**parameters).run(window, catalog)
+
+
+plugin = RjPlugin()
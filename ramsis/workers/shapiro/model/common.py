@@ -21,12 +21,14 @@ Copyright (C) 2013, ETH Zurich - Swiss Seismological Service SED
 """
 
 from PyQt5 import QtCore
-from datetime import datetime
 from datetime import timedelta
 import logging
 
+from ...tools.injection import expected_flow, representative_flow
+from ...tools.modelinput import ColumnarInput
 
-class ModelInput(object):
+
+class ModelInput(ColumnarInput):
     """
     Holds ISHA model inputs and parameters for the next run. Not all models may
     require all of the inputs.
@@ -90,9 +92,10 @@ class ModelInput(object):
         """
         Compute expected flow from (future) data.
 
-        The expected flow during the forecast period is computed as the average
-        from the flow samples for that period. If no data is available, zero
-        flow is assumed.
+        The expected flow during the forecast period is computed as the time
+        weighted average of the flow samples for that period, so irregularly
+        spaced samples are accounted for. If no data is available, zero flow
+        is assumed.
 
         :param project: ramsis project containing the data
         :param t_run: time of the run
@@ -101,41 +104,8 @@ class ModelInput(object):
         """
         t_end = t_run + timedelta(hours=bin_size)
         events = project.hydraulic_history.events_between(t_run, t_end)
-        if len(events) == 0:
-            self.expected_flow = 0
-        else:
-            # TODO: we might have to estimate this from flow_dh. Also, the
-            # current implementation does not handle irregularly spaced samples
-            # correctly.
-            self.expected_flow = sum([e.flow_xt for e in events]) / len(events)
-
-    def primitive_rep(self):
-        """
-        Generator that unpacks input data into simple lists of primitive types.
-
-        We do this since we can't pass python objects to external code such as
-        Matlab. Lists are yielded as tuples (list_name, list) where list_name
-        is the name of the corresponding member variable. Members of members
-        will be returned with a combined name, E.g. all
-        self.seismic_event.magnitude will be returned as a list named
-        *seismic_event_magnitude*. datetime objects translated into unix time
-        stamps.
-
-        """
-        for base_name in ModelInput._data_attrs:
-            attr = getattr(self, base_name)
-            # make everything into a sequence type first
-            if attr is None:
-                attr = []
-            elif not hasattr(attr, '__iter__'):
-                attr = [attr]
-            if len(attr) > 0 and hasattr(attr[0], 'data_attrs'):
-                for attr_name in attr[0].data_attrs:
-                    combined_name = base_name + '_' + attr_name
-                    data = [getattr(obj, attr_name) for obj in attr]
-                    yield combined_name, _primitive(data)
-            else:
-                yield base_name, _primitive(attr)
+        # TODO: we might have to estimate this from flow_dh.
+        self.expected_flow = expected_flow(events, 'flow_xt')
 
 
 class ModelResult(object):
@@ -264,22 +234,5 @@ class Model(QtCore.QObject):
         If no flow rates are present at all the function returns 0
 
         """
-        if self._model_input.hydraulic_events is None:
-            return 0
-        rates = [h.flow_dh for h in self._model_input.hydraulic_events
-                 if t_min <= h.date_time < t_max]
-        if len(rates) == 0:
-            last_flow = self._model_input.hydraulic_events[-1]
-            flow = last_flow.flow_dh
-        else:
-            flow = max(rates)
-        return flow
-
-
-def _primitive(attr):
-        """ Converts any datetime object to unix time stamp """
-        epoch = datetime(1970, 1, 1)
-        if len(attr) > 0 and isinstance(attr[0], datetime):
-            return [(dt - epoch).total_seconds() for dt in attr]
-        else:
-            return attr
+        return representative_flow(self._model_input.injection_history,
+                                   t_min, t_max)
@@ -0,0 +1,191 @@
+# -*- encoding: utf-8 -*-
+"""
+Pool of warm MATLAB sessions
+
+Starting MATLAB takes much longer than a short forecast. The pool starts
+its sessions once, changes into the model directory and adds the model code
+to the path, so runs only have to transfer their inputs and invoke the
+wrapper script. Runs on different threads use different sessions.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import logging
+import os
+import queue
+from contextlib import contextmanager
+from threading import Lock
+
+import numpy as np
+
+MODEL_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Commands that prepare a new session for the shapiro wrapper
+INIT_COMMANDS = (
+    "cd('{}')".format(MODEL_DIR),
+    "addpath(fullfile('..', '..', 'external', 'shapiro_spatial'))"
+)
+
+log = logging.getLogger(__name__)
+
+
+def matlab_session():
+    """ Start a MATLAB session without display and java """
+    import pymatlab
+    return pymatlab.session_factory('-nodisplay -nojvm')
+
+
+class SessionPool:
+    """
+    A fixed number of pre-initialized MATLAB sessions
+
+    :param int size: number of sessions
+    :param factory: function that starts a new session (pymatlab by
+        default)
+    :param init_commands: commands to run in each new session
+
+    """
+
+    def __init__(self, size=2, factory=matlab_session,
+                 init_commands=INIT_COMMANDS):
+        self.size = size
+        self.factory = factory
+        self.init_commands = init_commands
+        self._idle = queue.Queue()
+        self._started = 0
+        self._closed = False
+        self._lock = Lock()
+
+    def start(self):
+        """ Start all sessions now instead of on first use """
+        with self._lock:
+            while self._started < self.size:
+                self._idle.put(self._new_session())
+                self._started += 1
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+        Context manager that borrows a session from the pool
+
+        Blocks until a session is available. Sessions are started on
+        demand if the pool hasn't been started. If the block raises, the
+        session may be left in an undefined state (e.g. an interrupted
+        command) and is replaced by a new one.
+
+        :raises queue.Empty: if no session became available within timeout
+        :raises RuntimeError: if the pool has been closed
+
+        """
+        session = None
+        while session is None:
+            with self._lock:
+                if self._closed:
+                    self._idle.put(None)  # wake up the next waiting thread
+                    raise RuntimeError('Session pool is closed')
+                start_new = self._idle.empty() and \
+                    self._started < self.size
+                if start_new:
+                    self._started += 1
+            if start_new:
+                try:
+                    session = self._new_session()
+                except Exception:
+                    with self._lock:
+                        self._started -= 1
+                    raise
+            else:
+                # None wakes us up to start a session for a discarded one
+                session = self._idle.get(timeout=timeout)
+        try:
+            yield session
+        except Exception:
+            self._release(session, discard=True)
+            raise
+        self._release(session)
+
+    def close(self):
+        """
+        Drop the idle sessions (MATLAB exits with the session)
+
+        Borrowed sessions are dropped when they are returned.
+
+        """
+        with self._lock:
+            self._closed = True
+            while not self._idle.empty():
+                if self._idle.get_nowait() is not None:
+                    self._started -= 1
+            self._idle.put(None)
+
+    def _release(self, session, discard=False):
+        with self._lock:
+            if discard or self._closed:
+                self._started -= 1
+                self._idle.put(None)
+            else:
+                self._idle.put(session)
+
+    def _new_session(self):
+        log.info('Starting MATLAB session')
+        session = self.factory()
+        for command in self.init_commands:
+            session.run(command)
+        return session
+
+
+def put_values(session, values, prefix=''):
+    """
+    Transfer numeric values to a session in bulk
+
+    Instead of one transfer per variable, all values are packed into a
+    single float64 array, which is unpacked into the individual variables
+    by a single command. Values that can't be packed (e.g. strings) are
+    transferred individually.
+
+    :param values: iterable of (name, value) tuples, values are scalars or
+        sequences
+    :param str prefix: prefix for the variable names
+
+    """
+    arrays, offset, statements = [], 0, []
+    for name, value in values:
+        try:
+            array = np.asarray(value, dtype=np.float64).ravel()
+        except (TypeError, ValueError):
+            session.putvalue(prefix + name, value)
+            continue
+        statements.append('{}{} = ramsis_packed({}:{});'.format(
+            prefix, name, offset + 1, offset + array.size))
+        arrays.append(array)
+        offset += array.size
+    if not statements:
+        return
+    packed = np.concatenate(arrays) if offset else np.zeros(1)
+    session.putvalue('ramsis_packed', packed)
+    statements.append('clear ramsis_packed;')
+    session.run(' '.join(statements))
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def session_pool():
+    """ Returns the shared session pool """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool()
+        return _pool
+
+
+def configure_session_pool(size):
+    """ Replace the shared session pool with one of size sessions """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = SessionPool(size)
+        return _pool
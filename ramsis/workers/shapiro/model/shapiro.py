@@ -6,12 +6,10 @@ Copyright (C) 2013, ETH Zurich - Swiss Seismological Service SED
 
 """
 
-import os
-
-import pymatlab
 import numpy as np
 
 from .common import Model, ModelOutput, ModelResult
+from .sessionpool import session_pool, put_values
 
 
 class Shapiro(Model):
@@ -27,10 +25,16 @@ class Shapiro(Model):
                         'matlab and execute shapiro_wrapper.m'
     'directly.'
 
-    def __init__(self):
-        """Initializes the model parameters"""
+    def __init__(self, pool=None):
+        """
+        Initializes the model
+
+        :param SessionPool pool: MATLAB sessions to run the model in
+            (defaults to the shared pool)
+
+        """
         super(Shapiro, self).__init__()
-        self._session = pymatlab.session_factory('-nodisplay -nojvm')
+        self._pool = pool or session_pool()
 
     def _do_run(self):
         """
@@ -47,43 +51,46 @@ class Shapiro(Model):
 
         """
 
+        with self._pool.session() as session:
+            return self._run_in(session)
+
+    def _run_in(self, session):
+        """ Run the model in MATLAB session *session* """
         # Copy input to matlab workspace
         # We can only pass simple arrays, so we need to decompose our input
         # object here and recompose it in matlab. Prefix all variables with
-        # ramsis_ to reduce conflicts
-        self._session.run('clear;')
-        for name, value in self.model_input.primitive_rep():
-            self._session.putvalue('ramsis_' + name, value)
+        # ramsis_ to reduce conflicts. The session is already in the model
+        # directory (see SessionPool).
+        session.run('clear;')
+        put_values(session, self.model_input.primitive_rep(), 'ramsis_')
         # Invoke wrapper script
-        script_path = os.path.dirname(os.path.realpath(__file__))
-        self._session.run('cd ' + script_path)
         try:
-            self._session.run("run('shapiro_wrapper.m')")
+            session.run("run('shapiro_wrapper.m')")
         except RuntimeError:
-            self._session.run("save('model_inputs')")
+            session.run("save('model_inputs')")
             self._logger.error(Shapiro._MATLAB_ERROR_MSG)
             if Model.RAISE_ON_ERRORS:
                 raise
             else:
                 success = False
         else:
-            success = self._session.getvalue('forecast_success')
+            success = session.getvalue('forecast_success')
 
         # Finish up
         t_run = self._model_input.t_run
         dt = self._model_input.t_bin
         output = ModelOutput(t_run=t_run, dt=dt, model=self)
         if success:
-            rate = float(self._session.getvalue('forecast_numev'))
-            b_val = float(self._session.getvalue('forecast_bval'))
-            vol_rates = self._session.getvalue('forecast_vol_rates')
+            rate = float(session.getvalue('forecast_numev'))
+            b_val = float(session.getvalue('forecast_bval'))
+            vol_rates = session.getvalue('forecast_vol_rates')
             # TODO: set prob correctly (and the b_vals on vol_results)
             output.cum_result = ModelResult(rate=rate, b_val=b_val, prob=0)
             output.vol_results = [ModelResult(r, 0, 0) for r in vol_rates]
             self._logger.info('number of events: ' + str(rate) +
                               ' voxel max: ' + str(np.amax(vol_rates)))
         else:
-            reason = self._session.getvalue('forecast_no_result_reason')
+            reason = session.getvalue('forecast_no_result_reason')
             output.failure_reason = reason
             output.failed = True
             self._logger.info('did not get any results')
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+"""
+Worker host plugin for the Shapiro model
+
+The model runs in MATLAB, so runs are executed in threads of the host
+process. Each thread gets its own session from a pool of warm sessions that
+is started with the host.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from datetime import timedelta
+
+from ..host import ModelPlugin
+from ..tools.catalog import CatalogColumns
+from ..tools.injection import expected_flow
+from .model.common import ModelInput
+from .model.shapiro import Shapiro
+from .model.sessionpool import configure_session_pool, session_pool
+
+
+class InjectionWell:
+    """
+    Well tip in the local coordinates of the seismic events
+
+    Exports its coordinates like the injection well of a ramsis project, so
+    the model sees them as ramsis_injection_well_well_tip_x etc.
+
+    """
+
+    data_attrs = ('well_tip_x', 'well_tip_y', 'well_tip_z')
+
+    def __init__(self, well_tip_x, well_tip_y, well_tip_z):
+        self.well_tip_x = well_tip_x
+        self.well_tip_y = well_tip_y
+        self.well_tip_z = well_tip_z
+
+
+def planned_samples(forecast, scenario_id):
+    """ Returns the injection plan samples of the scenario """
+    for scenario in forecast.input.scenarios or []:
+        if scenario.id == scenario_id:
+            plan = getattr(scenario, 'injection_plan', None)
+            return [s for s in getattr(plan, 'samples', None) or []
+                    if s.date_time is not None]
+    return []
+
+
+class ShapiroPlugin(ModelPlugin):
+
+    name = 'shapiro'
+    executor = 'thread'
+
+    def startup(self, host):
+        # one session per thread, so runs don't wait for each other
+        configure_session_pool(host.threads).start()
+
+    def shutdown(self):
+        session_pool().close()
+
+    def prepare(self, forecast, catalog, data):
+        if data.get('parameter_sets') is not None:
+            # the model has no parameters, all runs would be the same
+            raise ValueError('The shapiro model does not support parameter '
+                             'sets')
+        well = data.get('injection_well')
+        if well is None:
+            raise ValueError('The shapiro model needs the position of the '
+                             'injection well')
+        try:
+            injection_well = InjectionWell(**well)
+        except TypeError as e:
+            raise ValueError('Invalid injection well: {}'.format(e))
+        if catalog is None:
+            events = forecast.input.input_catalog.seismic_events
+            catalog = CatalogColumns.from_events(events)
+        model_input = ModelInput.from_columns(
+            forecast.forecast_time, catalog,
+            bin_size=forecast.forecast_interval,
+            mag_range=(forecast.m_min, forecast.m_max))
+        model_input.injection_well = injection_well
+        samples = planned_samples(forecast, data.get('scenario id'))
+        model_input.hydraulic_events = samples or None
+        # mean planned flow during the forecast period
+        t_start = forecast.forecast_time
+        t_end = t_start + timedelta(hours=forecast.forecast_interval)
+        period = [s for s in samples if s.flow_xt is not None
+                  if t_start <= s.date_time <= t_end]
+        model_input.expected_flow = expected_flow(period)
+        return model_input
+
+    @staticmethod
+    def run(args, parameters):
+        model = Shapiro()
+        model.prepare_run(args)
+        model.run()
+        output = model.output
+        if output.failed:
+            raise RuntimeError(output.failure_reason)
+        result = output.cum_result
+        return result.rate, result.b_val, result.prob
+
+
+plugin = ShapiroPlugin()
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+"""
+Columnar representation of the seismic events passed to a model
+
+The models only need a few event attributes as numeric arrays. Instead of
+rebuilding them with list comprehensions for every forecast time, the
+catalog is converted into contiguous float64 columns once per run.
+
+The client (RAMSIS.core.tools.catalog) extends these columns and uses the
+time conversions below, so both sides encode event times the same way.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+
+def epoch_seconds(t):
+    """ Returns the unix time stamp for a naive (UTC) datetime """
+    return (t.replace(tzinfo=None) - EPOCH).total_seconds()
+
+
+def epoch_us(times):
+    """
+    Converts a sequence of datetime objects to an int64 array of
+    microseconds since the unix epoch
+
+    :param times: sequence of naive (UTC) datetime objects or a numpy
+        datetime64 array. The latter is converted without a copy of the
+        individual elements.
+
+    """
+    if isinstance(times, np.ndarray) and times.dtype.kind == 'M':
+        return times.astype('datetime64[us]').astype(np.int64)
+    return np.fromiter(((t.replace(tzinfo=None) - EPOCH) // _US
+                        for t in times), dtype=np.int64, count=len(times))
+
+
+class CatalogColumns:
+    """
+    Contiguous float64 arrays of event times, locations and magnitudes
+
+    Event times are stored as unix time stamps. Columns that are not
+    available (e.g. local coordinates for events that have not been
+    converted by the client) are None.
+
+    :ivar numpy.ndarray date_time: event times [s since epoch]
+    :ivar numpy.ndarray lat: latitudes
+    :ivar numpy.ndarray lon: longitudes
+    :ivar numpy.ndarray depth: depths
+    :ivar numpy.ndarray magnitude: magnitudes
+    :ivar numpy.ndarray x: local x coordinates (or None)
+    :ivar numpy.ndarray y: local y coordinates (or None)
+    :ivar numpy.ndarray z: local z coordinates (or None)
+
+    """
+
+    fields = ('date_time', 'lat', 'lon', 'depth', 'magnitude', 'x', 'y', 'z')
+
+    def __init__(self, date_time=None, lat=None, lon=None, depth=None,
+                 magnitude=None, x=None, y=None, z=None):
+        columns = (date_time, lat, lon, depth, magnitude, x, y, z)
+        for name, column in zip(self.fields, columns):
+            if column is not None:
+                column = np.ascontiguousarray(column, dtype=np.float64)
+            setattr(self, name, column)
+
+    @classmethod
+    def from_events(cls, events, **kwargs):
+        """
+        Create the columns from event objects in a single pass
+
+        Attributes missing on the first event are skipped.
+
+        :param events: sequence of seismic events (or None)
+        :param kwargs: further arguments for the constructor
+
+        """
+        events = events or []
+        if len(events) == 0:
+            kwargs.update((name, np.zeros(0)) for name in cls.fields)
+            return cls(**kwargs)
+        names = [name for name in cls.fields
+                 if getattr(events[0], name, None) is not None]
+        rows = np.array([tuple(_value(getattr(e, name)) for name in names)
+                         for e in events], dtype=np.float64)
+        kwargs.update(zip(names, rows.T))
+        return cls(**kwargs)
+
+    def __len__(self):
+        return self.magnitude.size
+
+    def hours_before(self, t):
+        """ Time between each event and t in hours (negative if after t) """
+        return (epoch_seconds(t) - self.date_time) / 3600.0
+
+
+def _value(value):
+    return epoch_seconds(value) if isinstance(value, datetime) else value
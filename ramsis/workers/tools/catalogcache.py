@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+"""
+Worker side catalog state for delta uploads
+
+The client may send only the events that changed since its last upload
+together with a *catalog_sync* entry (see RAMSIS.core.engine.catalogsync).
+The worker keeps the resulting catalog per session and applies the deltas
+to it. Workers acknowledge the catalog version they hold by returning it as
+*catalog_version* in the response to the run request.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from .catalog import CatalogColumns
+
+# Event attributes that identify an event. The client computes its keys
+# with the same functions (see event_keys and key_values).
+KEY_FIELDS = ('date_time', 'lat', 'lon', 'depth', 'magnitude')
+
+
+class VersionMismatch(Exception):
+    """ Raised if the worker doesn't hold the base version of a delta """
+    pass
+
+
+class CatalogCache:
+    """
+    Keeps the most recent catalog of each session
+
+    :param int max_sessions: number of sessions to keep. The least recently
+        used session is dropped first.
+
+    """
+
+    def __init__(self, max_sessions=16):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def apply(self, sync, catalog):
+        """
+        Apply an uploaded catalog (or catalog delta) to the session state
+
+        :param dict sync: the *catalog_sync* entry of the request
+        :param CatalogColumns catalog: the uploaded events
+        :returns: the complete catalog for this run
+        :raises VersionMismatch: if the delta can't be applied
+
+        """
+        session = sync['session']
+        with self._lock:
+            if sync.get('base_version') is None:
+                full = catalog
+            else:
+                try:
+                    version, cached = self._sessions[session]
+                except KeyError:
+                    raise VersionMismatch('Unknown session')
+                if version == sync['version']:
+                    # somebody else already uploaded this version
+                    self._sessions.move_to_end(session)
+                    return cached
+                if version != sync['base_version']:
+                    raise VersionMismatch('Expected base version {}'
+                                          .format(version))
+                full = _merge(cached, sync.get('removed', []), catalog)
+            self._sessions[session] = (sync['version'], full)
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return full
+
+
+def event_keys(columns):
+    """
+    Returns an (n, 5) float64 array of event keys for CatalogColumns
+
+    """
+    return np.column_stack([getattr(columns, name) for name in KEY_FIELDS])
+
+
+def key_values(keys):
+    """ View each key row as a single opaque value for set operations """
+    keys = np.ascontiguousarray(keys, dtype=np.float64)
+    row_size = keys.dtype.itemsize * len(KEY_FIELDS)
+    return keys.view(np.dtype((np.void, row_size))).ravel()
+
+
+def _merge(cached, removed, added):
+    """ Returns cached without the removed events and with added events """
+    keep = np.ones(len(cached), dtype=bool)
+    if len(removed) > 0:
+        removed = np.reshape(removed, (-1, len(KEY_FIELDS)))
+        keep = ~np.isin(key_values(event_keys(cached)),
+                        key_values(removed))
+    columns = {}
+    for name in CatalogColumns.fields:
+        old, new = getattr(cached, name), getattr(added, name)
+        if old is not None and new is not None:
+            columns[name] = np.concatenate((old[keep], new))
+    merged = CatalogColumns(**columns)
+    order = np.argsort(merged.date_time, kind='mergesort')
+    return CatalogColumns(**{name: getattr(merged, name)[order]
+                             for name in columns})
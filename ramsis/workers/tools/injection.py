@@ -0,0 +1,192 @@
+# -*- encoding: utf-8 -*-
+"""
+Indexed injection history for flow queries over arbitrary time windows
+
+The injected volume up to each sample is precomputed once as a cumulative
+(trapezoidal) sum, so the volume injected during any window follows from
+the difference of two interpolated values of the cumulative curve. Maximum
+flow rates are looked up in a sparse table of the maxima of all power of
+two runs of samples. Both take a binary search per query, i.e. O(log n),
+and account for irregularly spaced samples.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import numpy as np
+
+from .catalog import epoch_seconds
+
+
+class InjectionHistory:
+    """
+    Flow samples as sorted float64 arrays with their cumulative volume
+
+    The flow is linearly interpolated between samples, held at the last
+    sampled value after the last sample and zero before the first sample.
+    Volumes are given in [flow unit * h], i.e. the flow integrated over
+    hours like the forecast bins.
+
+    :param times: sample times as unix time stamps [s]
+    :param flows: flow rates at the sample times
+
+    """
+
+    def __init__(self, times, flows):
+        times = np.asarray(times, dtype=np.float64)
+        flows = np.asarray(flows, dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        self.times = np.ascontiguousarray(times[order])
+        self.flows = np.ascontiguousarray(flows[order])
+        segments = np.diff(self.times) / 3600.0 * \
+            (self.flows[1:] + self.flows[:-1]) / 2
+        self.cumulative = np.concatenate(([0.0], np.cumsum(segments)))
+        # _max_table[j][i] is the max. flow of samples i .. i + 2**j - 1
+        self._max_table = [self.flows]
+        width = 1
+        while 2 * width <= self.flows.size:
+            previous = self._max_table[-1]
+            self._max_table.append(np.maximum(previous[:-width],
+                                              previous[width:]))
+            width *= 2
+
+    @classmethod
+    def from_samples(cls, samples, flow_attr='flow_dh'):
+        """
+        Create the index from a list of injection sample objects
+
+        :param str flow_attr: name of the sample attribute with the flow
+            rate
+
+        """
+        samples = samples or []
+        times = [epoch_seconds(s.date_time) for s in samples]
+        flows = [getattr(s, flow_attr) for s in samples]
+        return cls(times, flows)
+
+    def __len__(self):
+        return self.times.size
+
+    def flow_at(self, t):
+        """ Interpolated flow rate at t (unix time stamp or array of them) """
+        t = np.asarray(t, dtype=np.float64)
+        if self.times.size == 0:
+            return np.zeros(t.shape)
+        i, lo, flow_t = self._interpolate(t)
+        return np.where(i < 0, 0.0, flow_t)
+
+    def volume_before(self, t):
+        """
+        Volume injected before t (unix time stamp or array of them)
+
+        Binary search for the sample preceding t, so O(log n) per query.
+
+        """
+        t = np.asarray(t, dtype=np.float64)
+        if self.times.size == 0:
+            return np.zeros(t.shape)
+        i, lo, flow_t = self._interpolate(t)
+        volume = self.cumulative[lo] + (t - self.times[lo]) / 3600.0 * \
+            (self.flows[lo] + flow_t) / 2
+        return np.where(i < 0, 0.0, volume)
+
+    def volume(self, t_min, t_max):
+        """ Volume injected in [t_min, t_max] (unix time stamps or arrays) """
+        return self.volume_before(t_max) - self.volume_before(t_min)
+
+    def mean_flow(self, t_min, t_max):
+        """
+        Time weighted mean flow rate in [t_min, t_max]
+
+        Unlike the plain average of the samples this is not biased towards
+        densely sampled periods. Returns the flow at t_min for empty
+        intervals.
+
+        """
+        t_min = np.asarray(t_min, dtype=np.float64)
+        t_max = np.asarray(t_max, dtype=np.float64)
+        hours = (t_max - t_min) / 3600.0
+        mean = self.volume(t_min, t_max) / np.where(hours > 0, hours, 1)
+        return np.where(hours > 0, mean, self.flow_at(t_min))
+
+    def max_flow(self, t_min, t_max):
+        """
+        Max. sampled flow rate in [t_min, t_max)
+
+        Returns NaN for intervals without samples.
+
+        """
+        first = np.searchsorted(self.times, t_min, side='left')
+        stop = np.searchsorted(self.times, t_max, side='left')
+        shape = np.shape(stop - first)
+        first, stop = np.broadcast_arrays(np.atleast_1d(first),
+                                          np.atleast_1d(stop))
+        count = stop - first
+        valid = count > 0
+        flows = np.full(count.shape, np.nan)
+        # two (overlapping) power of two runs cover each interval
+        level = np.zeros(count.shape, dtype=int)
+        level[valid] = np.floor(np.log2(count[valid]))
+        for j in np.unique(level[valid]):
+            selected = valid & (level == j)
+            table = self._max_table[j]
+            flows[selected] = np.maximum(table[first[selected]],
+                                         table[stop[selected] - 2 ** j])
+        return flows.reshape(shape)
+
+    def _interpolate(self, t):
+        """
+        Locate t and interpolate the flow
+
+        :returns: tuple (index of the preceding sample (-1 if none), the
+            same index clipped to valid samples, flow at t)
+
+        """
+        n = self.times.size
+        i = np.searchsorted(self.times, t, side='right') - 1
+        lo = np.clip(i, 0, n - 1)
+        hi = np.minimum(lo + 1, n - 1)
+        span = self.times[hi] - self.times[lo]
+        rise = self.flows[hi] - self.flows[lo]
+        slope = np.where(span > 0, rise / np.where(span > 0, span, 1), 0)
+        return i, lo, self.flows[lo] + slope * (t - self.times[lo])
+
+
+def expected_flow(samples, flow_attr='flow_xt'):
+    """
+    Time weighted mean flow rate of the injection samples
+
+    Irregularly spaced samples are accounted for. Returns 0 if there are no
+    samples.
+
+    :param samples: injection sample objects, e.g. those of the forecast
+        period
+    :param str flow_attr: name of the sample attribute with the flow rate
+
+    """
+    if not samples:
+        return 0
+    history = InjectionHistory.from_samples(samples, flow_attr)
+    return float(history.mean_flow(history.times[0], history.times[-1]))
+
+
+def representative_flow(history, t_min, t_max):
+    """
+    Flow rate of the injection history that is representative for the
+    interval t_min, t_max
+
+    Returns the maximum flow rate sampled in [t_min, t_max]. If no flow
+    rate was sampled in this interval, it returns the last flow rate it
+    finds. If no flow rates are present at all it returns 0.
+
+    :param InjectionHistory history: indexed flow rates
+    :param datetime t_min: start of the interval
+    :param datetime t_max: end of the interval
+
+    """
+    if len(history) == 0:
+        return 0
+    flow = history.max_flow(epoch_seconds(t_min), epoch_seconds(t_max))
+    if np.isnan(flow):
+        return float(history.flows[-1])
+    return float(flow)
@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+"""
+Job queue for workers that run several model runs at the same time
+
+Model runs are executed in a process pool, so runs from different clients
+(e.g. scenarios) neither overwrite each other's results nor block the
+request handlers. Each run gets a job id, which the client uses to fetch
+its results.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+ERROR = 'error'
+
+
+class QueueFull(Exception):
+    """ Raised if the maximum number of pending jobs has been reached """
+    pass
+
+
+class JobQueue:
+    """
+    Bounded queue of model runs with per job result storage
+
+    :param int max_workers: number of processes (defaults to the number of
+        cores)
+    :param int max_pending: max. number of jobs that are queued or running
+    :param int max_results: number of jobs to keep. The oldest finished jobs
+        are dropped first.
+    :param executor: executor for the jobs, a ProcessPoolExecutor with
+        max_workers processes if not given. The queue replaces its own
+        process pool if it breaks (e.g. a model process was killed).
+
+    """
+
+    def __init__(self, max_workers=None, max_pending=64, max_results=256,
+                 executor=None):
+        self.max_workers = max_workers
+        self.executor = executor or ProcessPoolExecutor(max_workers)
+        self._own_executor = executor is None
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.pending = 0
+        self._jobs = OrderedDict()
+        self._lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) for execution
+
+        :returns: the job id
+        :raises QueueFull: if max_pending jobs are queued or running
+        :raises BrokenExecutor: if the executor can't run jobs anymore
+
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull('{} jobs pending'.format(self.pending))
+            try:
+                future = self.executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                if not self._own_executor:
+                    raise
+                # jobs of the broken pool have failed, start a new one
+                self.executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(self.max_workers)
+                future = self.executor.submit(fn, *args, **kwargs)
+            self.pending += 1
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = future
+            self._expire()
+        future.add_done_callback(self._on_done)
+        return job_id
+
+    def completed(self, result):
+        """
+        Add a job that has already completed with result (e.g. from a
+        cache)
+
+        :returns: the job id
+
+        """
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = future
+            self._expire()
+        return job_id
+
+    def add_done_callback(self, job_id, callback):
+        """ Call callback(future) when the job has finished """
+        with self._lock:
+            future = self._jobs[job_id]
+        future.add_done_callback(callback)
+
+    def latest(self):
+        """ Id of the most recently submitted job, None if there is none """
+        with self._lock:
+            return next(reversed(self._jobs), None)
+
+    def status(self, job_id, wait_time=0):
+        """
+        Returns the state and result of a job
+
+        :param float wait_time: wait up to wait_time seconds for the job to
+            finish
+        :returns: tuple (state, result) where state is one of RUNNING,
+            COMPLETE or ERROR and result is the return value of the job
+            function if it completed or the exception if it failed
+        :raises KeyError: if the job is unknown (or expired)
+
+        """
+        with self._lock:
+            future = self._jobs[job_id]
+        if wait_time > 0:
+            wait([future], timeout=wait_time)
+        if not future.done():
+            return RUNNING, None
+        error = future.exception()
+        if error is not None:
+            return ERROR, error
+        return COMPLETE, future.result()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _on_done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def _expire(self):
+        """ Drop the oldest finished jobs if we hold too many """
+        excess = len(self._jobs) - self.max_results
+        if excess <= 0:
+            return
+        expired = [job_id for job_id, future in self._jobs.items()
+                   if future.done()][:excess]
+        for job_id in expired:
+            del self._jobs[job_id]
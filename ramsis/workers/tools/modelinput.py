@@ -0,0 +1,202 @@
+# -*- encoding: utf-8 -*-
+"""
+Input data handling shared by the model inputs of the workers
+
+The ETAS and Shapiro workers each define their own ModelInput. The columnar
+and indexed views of the input data and their export to numpy arrays are
+the same for both and live here.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from operator import attrgetter
+
+import numpy as np
+
+from .catalog import CatalogColumns, epoch_seconds
+from .injection import InjectionHistory
+
+
+class ColumnarInput:
+    """
+    Mixin for model inputs that provides columnar views of the events and
+    exports the input as numpy arrays
+
+    The seismic events are converted to :class:`CatalogColumns` and the
+    hydraulic events to an :class:`InjectionHistory` on first access. Both
+    are reused until the events are replaced.
+
+    :cvar _data_attrs: names of the input attributes that are exported by
+        :meth:`columns`
+
+    """
+
+    _data_attrs = []
+    _seismic_events = None
+    _seismic_columns = None
+    _hydraulic_events = None
+    _injection_history = None
+
+    @classmethod
+    def from_columns(cls, t_run, catalog, injection=None, bin_size=6.0,
+                     mc=None, mag_range=None):
+        """
+        Create input from columnar data instead of event objects
+
+        Used where the event objects are not available, e.g. in worker
+        processes.
+
+        :param CatalogColumns catalog: seismic events
+        :param InjectionHistory injection: flow rates (optional)
+
+        """
+        model_input = cls(t_run, bin_size=bin_size, mc=mc,
+                          mag_range=mag_range)
+        model_input._seismic_columns = catalog
+        model_input._injection_history = injection
+        return model_input
+
+    @property
+    def seismic_events(self):
+        return self._seismic_events
+
+    @seismic_events.setter
+    def seismic_events(self, events):
+        self._seismic_events = events
+        self._seismic_columns = None
+
+    @property
+    def seismic_columns(self):
+        """ Columnar view (:class:`CatalogColumns`) of the seismic events """
+        if self._seismic_columns is None:
+            self._seismic_columns = \
+                CatalogColumns.from_events(self._seismic_events)
+        return self._seismic_columns
+
+    @property
+    def hydraulic_events(self):
+        return self._hydraulic_events
+
+    @hydraulic_events.setter
+    def hydraulic_events(self, events):
+        self._hydraulic_events = events
+        self._injection_history = None
+
+    @property
+    def injection_history(self):
+        """ Indexed flow rates (:class:`InjectionHistory`) """
+        if self._injection_history is None:
+            self._injection_history = \
+                InjectionHistory.from_samples(self._hydraulic_events)
+        return self._injection_history
+
+    def primitive_rep(self):
+        """
+        Generator that unpacks input data into arrays of primitive types.
+
+        We do this since we can't pass python objects to external code such as
+        Matlab. Arrays are yielded as tuples (array_name, array) where
+        array_name is the name of the corresponding member variable. Members
+        of members will be returned with a combined name, E.g. all
+        self.seismic_event.magnitude will be returned as an array named
+        *seismic_event_magnitude*. datetime objects translated into unix time
+        stamps. See :meth:`columns`.
+
+        """
+        yield from self.columns().items()
+
+    def columns(self):
+        """
+        The input data as numpy arrays (see :meth:`primitive_rep`)
+
+        Event attributes are collected in a single pass over the events and
+        converted to arrays column wise, i.e. the per value conversion runs
+        in numpy. Numbers become float64 arrays (None becomes NaN), datetimes
+        float64 unix time stamps. If the input was created from columns
+        (:meth:`from_columns`), the seismic event columns are used as they
+        are.
+
+        :returns: OrderedDict of arrays by name
+
+        """
+        columns = OrderedDict()
+        for base_name in self._data_attrs:
+            columns.update(self._group_columns(base_name))
+        return columns
+
+    def records(self, base_name, path=None):
+        """
+        The columns of a group of objects as a single structured array
+
+        Fields are named after the attributes, e.g. the records of
+        'seismic_events' have the fields date_time, magnitude etc.
+
+        :param str base_name: name of the group, e.g. 'seismic_events'
+        :param str path: if given, the records are written to a memory
+            mapped .npy file at path, which external code can read without
+            copying
+        :returns: structured array (numpy.memmap if path is given)
+
+        """
+        prefix = base_name + '_'
+        columns = [(name[len(prefix):], column) for name, column
+                   in self._group_columns(base_name).items()
+                   if name.startswith(prefix)]
+        dtype = [(name, column.dtype) for name, column in columns]
+        size = columns[0][1].size if columns else 0
+        if path is None:
+            records = np.empty(size, dtype=dtype)
+        else:
+            records = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                                shape=(size,))
+        for name, column in columns:
+            records[name] = column
+        if path is not None:
+            records.flush()
+        return records
+
+    def _group_columns(self, base_name):
+        """ Returns the columns for data attribute base_name """
+        if base_name == 'seismic_events' and self._seismic_events is None \
+                and self._seismic_columns is not None:
+            catalog = self._seismic_columns
+            return OrderedDict(
+                (base_name + '_' + name, getattr(catalog, name))
+                for name in CatalogColumns.fields
+                if getattr(catalog, name) is not None)
+        attr = getattr(self, base_name)
+        # make everything into a sequence type first
+        if attr is None:
+            attr = []
+        elif not hasattr(attr, '__iter__'):
+            attr = [attr]
+        if len(attr) > 0 and hasattr(attr[0], 'data_attrs'):
+            names = list(attr[0].data_attrs)
+            rows = list(map(attrgetter(*names), attr))
+            if len(names) == 1:
+                rows = [(row,) for row in rows]
+            return OrderedDict((base_name + '_' + name, _array(values))
+                               for name, values in zip(names, zip(*rows)))
+        return OrderedDict([(base_name, _array(attr))])
+
+
+def _array(values):
+    """
+    Converts a sequence of values to a numpy array
+
+    datetime objects are converted to unix time stamps.
+
+    """
+    values = list(values)
+    if len(values) > 0 and isinstance(values[0], datetime):
+        if values[0].tzinfo is not None:
+            return np.array([epoch_seconds(v) for v in values])
+        times = np.array(values, dtype='datetime64[us]')
+        return (times - np.datetime64(0, 'us')) / np.timedelta64(1, 's')
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array(values)
@@ -0,0 +1,70 @@
+# -*- encoding: utf-8 -*-
+"""
+Vectorized Omori-Utsu aftershock kernel for many forecast windows
+
+The RJ and ETAS models both sum the Omori-Utsu integral of each event over
+a forecast window, weighted by a magnitude dependent productivity. They
+only differ in that weight.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import numpy as np
+
+# Max. number of (forecast time, event) pairs evaluated at once. Bounds the
+# memory of the temporary arrays to a few tens of MB.
+CHUNK_SIZE = 2 ** 20
+
+
+def forecast_windows(forecast_times, bin_sizes):
+    """
+    Returns the forecast times [s] and window lengths [h] as float64 arrays
+    of the same shape
+
+    """
+    forecast_times = np.atleast_1d(np.asarray(forecast_times,
+                                              dtype=np.float64))
+    bin_sizes = np.broadcast_to(np.asarray(bin_sizes, dtype=np.float64),
+                                forecast_times.shape)
+    return forecast_times, bin_sizes
+
+
+def omori_rates(event_times, weights, forecast_times, bin_sizes, p, c,
+                chunk_size=CHUNK_SIZE):
+    """
+    Sum of the weighted Omori-Utsu integrals of all events for each window
+
+    The relative times of all events to a chunk of forecast times are
+    computed as a 2-D (times x events) array, the contributions of events
+    that occur after the start of a window are masked out. The forecast
+    times are processed in chunks of at most *chunk_size* pairs.
+
+    :param event_times: event times as unix time stamps [s]
+    :param weights: productivity of each event
+    :param forecast_times: window start times as unix time stamps [s]
+    :param bin_sizes: window lengths [h], scalar or one per window
+    :param float p: Omori-Utsu exponent (p == 1 uses the logarithmic limit)
+    :param float c: Omori-Utsu time offset [h]
+    :returns: array of rates, one per window
+
+    """
+    event_times = np.asarray(event_times, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    forecast_times, bin_sizes = forecast_windows(forecast_times, bin_sizes)
+    rates = np.zeros(forecast_times.size)
+    step = max(chunk_size // max(event_times.size, 1), 1)
+    for i in range(0, forecast_times.size, step):
+        t = forecast_times[i:i + step, np.newaxis]
+        t1 = (t - event_times) / 3600.0  # hours since each event
+        t2 = t1 + bin_sizes[i:i + step, np.newaxis]
+        # ignore events after the start of the window
+        after = t1 < 0
+        t1[after] = 0
+        t2[after] = 0
+        if p == 1:
+            omori = np.log((t2 + c) / (t1 + c))
+        else:
+            omori = ((t2 + c) ** (1 - p) - (t1 + c) ** (1 - p)) / (1 - p)
+        rates[i:i + step] = omori @ weights
+    return rates
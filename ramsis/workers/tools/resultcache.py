@@ -0,0 +1,170 @@
+# -*- encoding: utf-8 -*-
+"""
+Cache for the results of deterministic model runs
+
+Forecasts are often re-run with identical inputs (manual re-runs, replayed
+simulations). The results of such runs are looked up by a content hash of
+the normalized model input instead of being recomputed.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def input_digest(*items):
+    """
+    Returns a content hash (hex) of items
+
+    Supports (nested) dicts, lists and tuples, numpy arrays, scalars,
+    datetimes and plain objects (hashed by their attributes). Dicts are
+    hashed independently of their order.
+
+    """
+    h = hashlib.sha256()
+    for item in items:
+        _update(h, item)
+    return h.hexdigest()
+
+
+def _update(h, obj):
+    if isinstance(obj, np.generic):
+        # before the scalars, np.float64 is a float with a numpy repr
+        _update(h, obj.item())
+    elif obj is None or isinstance(obj, (bool, int, float, str)):
+        h.update(repr(obj).encode('utf-8'))
+    elif isinstance(obj, np.ndarray):
+        h.update('array{}{}'.format(obj.dtype.str, obj.shape)
+                 .encode('utf-8'))
+        h.update(memoryview(np.ascontiguousarray(obj)).cast('B'))
+    elif isinstance(obj, datetime):
+        h.update(obj.isoformat().encode('utf-8'))
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for key in sorted(obj, key=repr):
+            _update(h, key)
+            _update(h, obj[key])
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for value in obj:
+            _update(h, value)
+        h.update(b']')
+    elif hasattr(obj, '__dict__'):
+        h.update(type(obj).__name__.encode('utf-8'))
+        _update(h, vars(obj))
+    else:
+        h.update(repr(obj).encode('utf-8'))
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of JSON serializable results, optionally on disk
+
+    With a *directory*, results are also written to disk, so they survive
+    restarts of the worker. Entries that dropped out of memory are then
+    reloaded from disk.
+
+    :param int max_entries: number of results to keep in memory
+    :param str directory: directory for the on-disk store (optional)
+
+    """
+
+    def __init__(self, max_entries=1024, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ Returns the result for key, None if it is not cached """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+        if result is None and self.directory is not None:
+            result = self._load(key)
+            if result is not None:
+                self._store(key, result)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """
+        Cache the result for key
+
+        Results that are not JSON serializable are not cached. If the
+        result can't be written to disk, it is only kept in memory.
+
+        """
+        try:
+            data = json.dumps(result)
+        except (TypeError, ValueError) as e:
+            log.warning('Not caching result {}: {}'.format(key, e))
+            return
+        self._store(key, result)
+        if self.directory is not None:
+            self._write(key, data)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+    def _store(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _write(self, key, data):
+        # write to a temp file first, so readers never see a partial result
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+        except OSError as e:
+            log.error('Failed to store result {}: {}'.format(key, e))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            log.error('Failed to store result {}: {}'.format(key, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
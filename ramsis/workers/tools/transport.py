@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+"""
+Decoding of model run requests
+
+RAMSIS posts model runs either as JSON or, if the client is configured for
+the binary transport, as a multipart form with the forecast in a compressed
+numpy archive (npz). In the archive, seismic events are stored column wise
+as float64 arrays named after the event attributes (date_time as unix time
+stamp) and everything else as utf-8 encoded JSON in the *meta* array.
+
+Workers that don't support a content type respond with 415 (Unsupported
+Media Type), upon which the client falls back to JSON.
+
+Copyright (C) 2018, ETH Zurich - Swiss Seismological Service SED
+
+"""
+
+import io
+import json
+
+import numpy as np
+
+from .catalog import CatalogColumns
+
+NPZ_MIMETYPE = 'application/x-ramsis-npz'
+
+
+class UnsupportedMediaType(Exception):
+    pass
+
+
+def decode_request(request):
+    """
+    Decode the data of a model run request
+
+    :param request: flask request
+    :returns: tuple (data, catalog) where data is the request data as a
+        dict with keys 'forecast', 'parameters', 'scenario id' and any
+        further fields of the request (e.g. 'parameter_sets'), and
+        catalog is a :class:`CatalogColumns` if the events have been sent
+        column wise or None otherwise (i.e. the events are in data).
+    :raises UnsupportedMediaType: if the content type is not supported
+    :raises ValueError: if the request data can't be decoded
+
+    """
+    if request.mimetype == 'application/json':
+        return request.get_json(), None
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('forecast')
+        if upload is None or upload.mimetype != NPZ_MIMETYPE:
+            raise UnsupportedMediaType('Expected forecast as {}'
+                                       .format(NPZ_MIMETYPE))
+        forecast, catalog = load_npz(upload.read())
+        # all other fields are JSON encoded
+        data = {name: json.loads(value)
+                for name, value in request.form.items()}
+        if 'parameters' not in data:
+            raise KeyError('parameters')
+        data.setdefault('scenario id', None)
+        data['forecast'] = forecast
+        return data, catalog
+    raise UnsupportedMediaType(request.mimetype)
+
+
+def load_npz(buf):
+    """
+    Load a forecast in the binary transport format
+
+    :param bytes buf: npz archive
+    :returns: tuple (forecast, catalog) with the serialized forecast (without
+        seismic events) and the events as :class:`CatalogColumns`
+
+    """
+    with np.load(io.BytesIO(buf), allow_pickle=False) as archive:
+        forecast = json.loads(archive['meta'].tobytes().decode('utf-8'))
+        columns = {name: archive[name] for name in CatalogColumns.fields
+                   if name in archive.files}
+    if 'magnitude' not in columns:
+        return forecast, None
+    return forecast, CatalogColumns(**columns)